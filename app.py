@@ -8,6 +8,7 @@ import os  # Add missing import for os.getenv
 from routes.auth_routes import auth_bp
 from routes.form_routes import form_bp
 from routes.route_routes import route_bp
+from models.search_index import rebuild_search_indexes
  
 def register_blueprints(app):
     """輔助函數：註冊所有藍圖"""
@@ -23,6 +24,14 @@ def setup_basic_routes(app):
         return {"success": True, "message": "RoutinInspection API 服務正常運行 (v2)"}
     app.logger.info("Basic /api/ping route registered.")
 
+def warm_search_indexes(app):
+    """輔助函數：啟動時載入路線、表單與使用者的搜尋索引 (失敗時於第一次搜尋再載入)"""
+    try:
+        with app.app_context():
+            rebuild_search_indexes()
+    except Exception as e:
+        app.logger.warning(f"Search indexes not loaded at startup: {str(e)}")
+
 
 # 除錯：確認環境變數載入狀況
 print("=== DEBUG INFO ===")
@@ -46,6 +55,9 @@ register_blueprints(app)
 # 設定基礎路由
 setup_basic_routes(app)
 
+# 載入搜尋索引
+warm_search_indexes(app)
+
 # 應用程式的運行部分
 if __name__ == '__main__':
     # 使用來自 app.config 的 PORT 和 DEBUG 設定
@@ -54,6 +54,44 @@ class Config:
                 
         self.PORT = _get_int_env('PORT', 3001)
 
+        # 快取配置：部門代碼 -> 表單索引的有效秒數 (表單變更時會立即失效)
+        self.DEPARTMENT_INDEX_TTL = _get_int_env('DEPARTMENT_INDEX_TTL', 300)
+
+        # 快取配置：巡檢路線快照的有效秒數 (透過 API 異動時會立即失效；每次讀取另外比對資料表版本，
+        # 其他 worker 行程的異動在下一次讀取時重新載入)，
+        # 以及可整表快取的最大筆數 (超過時直接查詢資料庫；0 表示停用)
+        self.ROUTE_CACHE_TTL = _get_int_env('ROUTE_CACHE_TTL', 300)
+        self.ROUTE_CACHE_MAX_ROWS = _get_int_env('ROUTE_CACHE_MAX_ROWS', 2000)
+
+        # 巡檢路線：POST /api/routes/bulk 單次最多處理的操作數 (新增/更新 + 刪除)
+        self.ROUTES_BULK_MAX = _get_int_env('ROUTES_BULK_MAX', 2000)
+
+        # 即時搜尋：路線、表單與使用者的行程內 n-gram 索引
+        # 單一索引超過 SEARCH_INDEX_MAX_DOCS 筆時改用資料庫查詢 (設為 0 停用索引)；每 SEARCH_INDEX_TTL 秒重新載入
+        # 索引屬於各個行程：多個 worker (gunicorn -w 4) 時，其他 worker 的寫入最多要 SEARCH_INDEX_TTL 秒後才搜尋得到
+        self.SEARCH_INDEX_MAX_DOCS = _get_int_env('SEARCH_INDEX_MAX_DOCS', 100000)
+        self.SEARCH_INDEX_TTL = _get_int_env('SEARCH_INDEX_TTL', 60)
+
+        # 巡檢紀錄：單次請求最多可寫入的紀錄筆數
+        self.RECORDS_MAX_BATCH = _get_int_env('RECORDS_MAX_BATCH', 5000)
+
+        # 複製表單時，每個交易複製的巡檢紀錄筆數
+        self.CLONE_RECORDS_BATCH_SIZE = _get_int_env('CLONE_RECORDS_BATCH_SIZE', 5000)
+
+        # 表單資料表：每個 user_ 資料表 (含 _p2、_p3 ... 分割表) 最多容納的項目數
+        self.FORM_ITEMS_PER_TABLE = _get_int_env('FORM_ITEMS_PER_TABLE', 200)
+
+        # 資料表中繼資料快取 (user_ 資料表的欄位與索引) 完整重新載入的間隔秒數
+        self.TABLE_CATALOG_TTL = _get_int_env('TABLE_CATALOG_TTL', 300)
+
+        # 表單資料表的 DDL (建立、改名、封存) 預設由背景佇列執行；設為 true 時於請求中直接執行
+        # (不寫入 DdlJob、不取得跨行程鎖定，只適用於測試或單一 worker 行程)
+        self.DDL_QUEUE_INLINE = _get_bool_env('DDL_QUEUE_INLINE', False)
+        # 新增 / 複製表單的請求等待建立工作的秒數，逾時回應 202 與工作狀態
+        self.DDL_WAIT_TIMEOUT = _get_int_env('DDL_WAIT_TIMEOUT', 30)
+        # 背景執行緒等待其他 worker 行程的 DDL 工作 (sp_getapplock) 的秒數，逾時該工作失敗
+        self.DDL_LOCK_TIMEOUT = _get_int_env('DDL_LOCK_TIMEOUT', 600)
+
         # 應用程式根日誌級別 (可選，用於更細緻的日誌控制)
         self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 
@@ -106,10 +144,10 @@ def create_app(test_config=None, load_env=True):
     
     CORS(app,  
          resources={r"/api/*": {"origins": cors_origins_config}},
-         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
          supports_credentials=True,
-         allow_headers=["Content-Type", "Authorization", "X-Requested-With"],  # 添加常用的請求頭
-         expose_headers=["Content-Type", "Authorization"]
+         allow_headers=["Content-Type", "Authorization", "X-Requested-With", "If-Match", "If-None-Match"],  # 添加常用的請求頭
+         expose_headers=["Content-Type", "Authorization", "ETag"]
     )
     
     # 添加調試日誌
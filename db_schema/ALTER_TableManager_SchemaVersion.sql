@@ -0,0 +1,24 @@
+-- 表單定義的內容雜湊與版本號：
+--   SchemaHash    : SchemaContent 的 SHA2_256 雜湊 (大寫十六進位)，寫入時一併儲存；
+--                   PUT 內容與目前定義相同時只需比對此欄位，不重寫 SchemaContent
+--   SchemaVersion : 表單定義 (含模式) 每次實際變更時加 1，作為 GET /api/forms/{id} 的 ETag
+IF COL_LENGTH(N'dbo.TableManager', N'SchemaHash') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD [SchemaHash] [char](64) NULL;
+END
+GO
+
+IF COL_LENGTH(N'dbo.TableManager', N'SchemaVersion') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD [SchemaVersion] [int] NOT NULL
+            CONSTRAINT [DF_TableManager_SchemaVersion] DEFAULT (1);
+END
+GO
+
+-- 回填既有資料列的雜湊 (與應用程式以 UTF-16LE 計算的結果相同)
+UPDATE [dbo].[TableManager]
+SET [SchemaHash] = CONVERT(char(64), HASHBYTES('SHA2_256', [SchemaContent]), 2)
+WHERE [SchemaHash] IS NULL AND [SchemaContent] IS NOT NULL;
+GO
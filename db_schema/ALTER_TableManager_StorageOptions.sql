@@ -0,0 +1,31 @@
+-- 表單資料表 (user_*) 的儲存選項，由 create_form_table 與結構更新套用：
+--   SparseItems     : Item{n} / Item{n}_Remark 欄位是否使用 SPARSE (多數項目留空的表單可節省空間)
+--   DataCompression : 主表、分割表與索引的 DATA_COMPRESSION (NONE / ROW / PAGE)
+-- SQL Server 不允許含 SPARSE 欄位的資料表使用資料壓縮，兩者擇一使用。
+IF COL_LENGTH(N'dbo.TableManager', N'SparseItems') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD [SparseItems] [bit] NOT NULL
+            CONSTRAINT [DF_TableManager_SparseItems] DEFAULT (0);
+END
+GO
+
+IF COL_LENGTH(N'dbo.TableManager', N'DataCompression') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD [DataCompression] [nvarchar](10) NOT NULL
+            CONSTRAINT [DF_TableManager_DataCompression] DEFAULT (N'NONE');
+END
+GO
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.check_constraints
+    WHERE name = N'CK_TableManager_StorageOptions' AND parent_object_id = OBJECT_ID(N'[dbo].[TableManager]')
+)
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD CONSTRAINT [CK_TableManager_StorageOptions]
+            CHECK ([DataCompression] IN (N'NONE', N'ROW', N'PAGE')
+                   AND ([SparseItems] = 0 OR [DataCompression] = N'NONE'));
+END
+GO
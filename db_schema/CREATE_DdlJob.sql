@@ -0,0 +1,20 @@
+-- 表單資料表 DDL 工作的狀態：
+--   工作由處理請求的 worker 行程加入並執行，狀態同時寫入此資料表，
+--   GET /api/forms/jobs/{jobId} 落在其他 worker 時仍可查詢。
+--   Result 為工作結果的 JSON；完成已久的工作可定期刪除。
+IF OBJECT_ID(N'[dbo].[DdlJob]', N'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[DdlJob](
+        [JobId] [char](32) NOT NULL,
+        [Kind] [varchar](32) NOT NULL,
+        [FormId] [int] NULL,
+        [Status] [varchar](16) NOT NULL,
+        [CreatedAt] [datetime2](0) NOT NULL,
+        [StartedAt] [datetime2](0) NULL,
+        [FinishedAt] [datetime2](0) NULL,
+        [Result] [nvarchar](max) NULL,
+        [Error] [nvarchar](max) NULL,
+        CONSTRAINT [PK_DdlJob] PRIMARY KEY CLUSTERED ([JobId] ASC)
+    ) ON [PRIMARY] TEXTIMAGE_ON [PRIMARY];
+END
+GO
@@ -0,0 +1,46 @@
+-- 內容定址的表單結構儲存：
+--   相同內容的表單結構 (例如各部門幾乎相同的表單、刪除時封存的 _oldN 定義) 只保存一份，
+--   TableManager.SchemaHash 參照 SchemaBlob.SchemaHash，TableManager.SchemaContent 不再使用。
+--   SchemaHash 為 SchemaContent 以 UTF-16LE 計算的 SHA2_256 (大寫十六進位)，與應用程式計算的結果相同。
+-- 需先執行 ALTER_TableManager_SchemaVersion.sql (新增並回填 TableManager.SchemaHash)。
+IF OBJECT_ID(N'[dbo].[SchemaBlob]', N'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[SchemaBlob](
+        [SchemaHash] [char](64) NOT NULL,
+        [SchemaContent] [nvarchar](max) NOT NULL,
+        [CreatedAt] [datetime] NOT NULL CONSTRAINT [DF_SchemaBlob_CreatedAt] DEFAULT (GETDATE()),
+        CONSTRAINT [PK_SchemaBlob] PRIMARY KEY CLUSTERED ([SchemaHash] ASC)
+    ) ON [PRIMARY] TEXTIMAGE_ON [PRIMARY];
+END
+GO
+
+-- 將既有的 SchemaContent 搬移到 SchemaBlob (相同雜湊只保留一份)
+INSERT INTO [dbo].[SchemaBlob] ([SchemaHash], [SchemaContent])
+SELECT src.[SchemaHash], src.[SchemaContent]
+FROM (
+    SELECT [SchemaHash], [SchemaContent],
+           ROW_NUMBER() OVER (PARTITION BY [SchemaHash] ORDER BY [TableManagerId]) AS rn
+    FROM [dbo].[TableManager]
+    WHERE [SchemaHash] IS NOT NULL AND [SchemaContent] IS NOT NULL
+) src
+WHERE src.rn = 1
+  AND NOT EXISTS (SELECT 1 FROM [dbo].[SchemaBlob] b WHERE b.[SchemaHash] = src.[SchemaHash]);
+GO
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.foreign_keys
+    WHERE name = N'FK_TableManager_SchemaBlob' AND parent_object_id = OBJECT_ID(N'[dbo].[TableManager]')
+)
+BEGIN
+    ALTER TABLE [dbo].[TableManager]
+        ADD CONSTRAINT [FK_TableManager_SchemaBlob]
+            FOREIGN KEY ([SchemaHash]) REFERENCES [dbo].[SchemaBlob] ([SchemaHash]);
+END
+GO
+
+-- 內容已搬移，釋放 TableManager 中重複的 nvarchar(max) 資料
+UPDATE [dbo].[TableManager]
+SET [SchemaContent] = NULL
+WHERE [SchemaContent] IS NOT NULL
+  AND EXISTS (SELECT 1 FROM [dbo].[SchemaBlob] b WHERE b.[SchemaHash] = [TableManager].[SchemaHash]);
+GO
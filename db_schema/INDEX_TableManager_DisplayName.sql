@@ -0,0 +1,12 @@
+-- 部門代碼搜尋 (search_department) 使用 DisplayName LIKE 'XXXX%' 前綴查詢，
+-- 此索引讓查詢可以使用 index seek 而不是掃描整個 TableManager。
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = N'IX_TableManager_DisplayName' AND object_id = OBJECT_ID(N'[dbo].[TableManager]')
+)
+BEGIN
+    CREATE NONCLUSTERED INDEX [IX_TableManager_DisplayName]
+        ON [dbo].[TableManager] ([DisplayName])
+        INCLUDE ([TableName], [TestMode]);
+END
+GO
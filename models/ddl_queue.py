@@ -0,0 +1,276 @@
+"""
+user_ 資料表 DDL 背景佇列
+
+建立、重新命名與封存 (刪除) 表單資料表的 DDL 會取得結構描述鎖 (Sch-M)，
+因此 HTTP 請求只記錄意圖 (TableManager 的變更) 並將 DDL 加入佇列後立即返回；
+單一背景執行緒以專用的資料庫連線依加入順序逐一執行，
+同一表單的建立、改名與封存不會互相交錯。
+多個 worker 行程 (gunicorn -w 4) 各自有一個背景執行緒，執行工作前以 sp_getapplock
+取得資料庫層級的工作階段鎖定，因此所有行程的 DDL 仍逐一執行。
+取得鎖定後重新載入 table catalog：其他行程的 DDL 不會更新本行程的快取，
+工作 (與其中的結構比對) 因此不會依據過期的欄位定義產生語句。
+新增表單的 TableManager 紀錄與資料表在同一個交易中建立，該請求會等待工作完成 (wait=True)，
+最多等待 DDL_WAIT_TIMEOUT 秒，逾時則返回尚未完成的工作狀態。
+工作狀態同時寫入 DdlJob 資料表，GET /api/forms/jobs/<job_id> 落在其他 worker 時也查詢得到。
+DDL_QUEUE_INLINE 為 True 時 (例如測試或單一行程) 於請求中直接執行，不寫入 DdlJob 也不取得鎖定。
+"""
+import json
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from werkzeug.exceptions import HTTPException
+from db import close_db, get_db
+from .table_catalog import load_table_catalog
+
+DDL_JOB_HISTORY_SIZE = 1000
+# 所有 worker 行程共用的 DDL 鎖定名稱 (sp_getapplock)
+DDL_LOCK_RESOURCE = "form_table_ddl"
+
+_jobs_lock = threading.Lock()
+_jobs = OrderedDict()  # job_id -> 工作狀態 (保留最近 DDL_JOB_HISTORY_SIZE 個)
+_queue = queue.Queue()
+_worker = None
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _job_snapshot(job):
+    """工作狀態的副本 (不含要執行的函數)"""
+    return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _format_time(value):
+    return value.isoformat(timespec='seconds') if value else None
+
+
+def _save_job(job, rollback=False):
+    """
+    將工作狀態寫入 DdlJob (不存在時新增) 並提交，供其他 worker 行程查詢。
+    rollback=True 時先回滾失敗工作殘留的交易。寫入失敗只記錄警告，不影響工作本身。
+    """
+    db = get_db()
+    cursor = None
+    try:
+        if rollback:
+            db.rollback()
+        cursor = db.cursor()
+        with _jobs_lock:
+            snapshot = _job_snapshot(job)
+        result = json.dumps(snapshot["result"], ensure_ascii=False, default=str) if snapshot["result"] is not None else None
+        cursor.execute("""
+            SET NOCOUNT ON;
+            UPDATE DdlJob SET Status = ?, StartedAt = ?, FinishedAt = ?, Result = ?, Error = ? WHERE JobId = ?;
+            IF @@ROWCOUNT = 0
+                INSERT INTO DdlJob (JobId, Kind, FormId, Status, CreatedAt, StartedAt, FinishedAt, Result, Error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """, (snapshot["status"], _parse_time(snapshot["startedAt"]), _parse_time(snapshot["finishedAt"]), result,
+              snapshot["error"], snapshot["id"],
+              snapshot["id"], snapshot["kind"], snapshot["formId"], snapshot["status"], _parse_time(snapshot["createdAt"]),
+              _parse_time(snapshot["startedAt"]), _parse_time(snapshot["finishedAt"]), result, snapshot["error"]))
+        db.commit()
+    except Exception as e:
+        current_app.logger.warning(f"Could not save state of DDL job {job['id']}: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def _load_job(job_id):
+    """從 DdlJob 讀取其他 worker 行程加入的工作狀態，不存在時返回 None"""
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SELECT JobId, Kind, FormId, Status, CreatedAt, StartedAt, FinishedAt, Result, Error
+            FROM DdlJob WHERE JobId = ?
+        """, (job_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0].strip(),
+            "kind": row[1],
+            "formId": row[2],
+            "status": row[3],
+            "createdAt": _format_time(row[4]),
+            "startedAt": _format_time(row[5]),
+            "finishedAt": _format_time(row[6]),
+            "result": json.loads(row[7]) if row[7] else None,
+            "error": row[8]
+        }
+    except Exception as e:
+        current_app.logger.warning(f"Could not load state of DDL job {job_id}: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+
+
+def get_ddl_job(job_id):
+    """取得工作狀態 (本行程沒有時查詢 DdlJob)，不存在時返回 None"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return _job_snapshot(job)
+    if current_app.config.get('DDL_QUEUE_INLINE', False):
+        return None
+    return _load_job(job_id)
+
+
+def _acquire_ddl_lock():
+    """
+    以 sp_getapplock 取得所有 worker 行程共用的 DDL 鎖定 (工作階段層級，跨越工作中的提交)，
+    最多等待 DDL_LOCK_TIMEOUT 秒，逾時拋出 TimeoutError。
+    """
+    timeout_ms = current_app.config.get('DDL_LOCK_TIMEOUT', 600) * 1000
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SET NOCOUNT ON;
+            DECLARE @result int;
+            EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = ?;
+            SELECT @result;
+        """, (DDL_LOCK_RESOURCE, timeout_ms))
+        row = cursor.fetchone()
+        db.commit()
+    finally:
+        cursor.close()
+    if row is None or row[0] < 0:
+        raise TimeoutError("Timed out waiting for a DDL job running in another worker process.")
+
+
+def _release_ddl_lock():
+    """釋放 DDL 鎖定；連線已中斷時鎖定隨連線關閉釋放"""
+    db = get_db()
+    cursor = None
+    try:
+        cursor = db.cursor()
+        cursor.execute("EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", (DDL_LOCK_RESOURCE,))
+        db.commit()
+    except Exception as e:
+        current_app.logger.warning(f"Could not release DDL lock: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def _reload_table_catalog():
+    """持有 DDL 鎖定時重新載入 table catalog (其他行程在此之前的 DDL 都已完成)"""
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        load_table_catalog(cursor)
+        db.commit()
+    finally:
+        cursor.close()
+
+
+def _run_job(job, shared=False):
+    """
+    執行工作並記錄結果；失敗時記錄錯誤訊息而不拋出。
+    shared=True (背景執行緒) 時先取得跨行程的 DDL 鎖定並重新載入 table catalog，並將狀態寫入 DdlJob。
+    """
+    locked = False
+    try:
+        if shared:
+            _acquire_ddl_lock()
+            locked = True
+            _reload_table_catalog()
+        with _jobs_lock:
+            job.update(status="running", startedAt=_now())
+        if shared:
+            _save_job(job)
+        current_app.logger.info(f"Running DDL job {job['id']} ({job['kind']}) for form {job['formId']}")
+        result = job["_target"](*job["_args"])
+        with _jobs_lock:
+            job.update(status="succeeded", result=result, finishedAt=_now(), _args=())
+        current_app.logger.info(f"DDL job {job['id']} ({job['kind']}) succeeded")
+    except Exception as e:
+        error = e.description if isinstance(e, HTTPException) else str(e)
+        with _jobs_lock:
+            job.update(status="failed", error=error, finishedAt=_now(), _args=())
+        current_app.logger.error(f"DDL job {job['id']} ({job['kind']}) for form {job['formId']} failed: {error}")
+        return False
+    finally:
+        if shared:
+            _save_job(job, rollback=job["status"] == "failed")
+        if locked:
+            _release_ddl_lock()
+        job["_done"].set()
+    return True
+
+
+def _worker_loop(app):
+    """背景執行緒：整個執行期間維持同一個 app context，get_db() 因此使用專用的連線"""
+    with app.app_context():
+        while True:
+            job = _queue.get()
+            try:
+                if not _run_job(job, shared=True):
+                    # 失敗後重新建立連線，避免殘留的交易或中斷的連線影響下一個工作
+                    close_db()
+            finally:
+                _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _jobs_lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        app = current_app._get_current_object()
+        _worker = threading.Thread(target=_worker_loop, args=(app,), name="ddl-queue", daemon=True)
+        _worker.start()
+
+
+def enqueue_ddl_job(kind, form_id, target, *args, wait=False):
+    """
+    加入一個 DDL 工作 (kind 例如 create_table、rename_table、archive_table)，返回工作狀態。
+    target(*args) 於背景執行緒執行；DDL_QUEUE_INLINE 為 True 時直接執行並返回完成後的狀態。
+    wait=True 時等待工作完成才返回 (仍與其他 DDL 工作依序執行)，最多等待 DDL_WAIT_TIMEOUT 秒；
+    逾時返回的狀態為 queued 或 running，呼叫端應回應 202 讓用戶端以工作 ID 查詢。
+    """
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "formId": form_id,
+        "status": "queued",
+        "createdAt": _now(),
+        "startedAt": None,
+        "finishedAt": None,
+        "result": None,
+        "error": None,
+        "_target": target,
+        "_args": args,
+        "_done": threading.Event()
+    }
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+        while len(_jobs) > DDL_JOB_HISTORY_SIZE:
+            _jobs.popitem(last=False)
+
+    if current_app.config.get('DDL_QUEUE_INLINE', False):
+        _run_job(job)
+    else:
+        # 呼叫端在加入工作前已提交自己的變更，這裡提交的只有 DdlJob 的新增
+        _save_job(job)
+        _ensure_worker()
+        _queue.put(job)
+        current_app.logger.info(f"Queued DDL job {job['id']} ({kind}) for form {form_id}")
+        if wait and not job["_done"].wait(current_app.config.get('DDL_WAIT_TIMEOUT', 30)):
+            current_app.logger.warning(f"DDL job {job['id']} ({kind}) did not finish within DDL_WAIT_TIMEOUT")
+    return get_ddl_job(job["id"])
+
+
+def wait_for_ddl_queue():
+    """等待佇列中的工作全部完成 (用於測試或關閉前)"""
+    _queue.join()
@@ -0,0 +1,149 @@
+"""
+表單定義的行程內快取
+
+表單結構以內容雜湊為鍵保存在 SchemaBlob (內容定址，相同內容只保存一份)，
+TableManager.SchemaHash 參照該雜湊。解析後的結果同樣以內容雜湊為鍵快取在行程記憶體中，
+內容相同的表單共用同一個解析結果；只要雜湊不變，讀取時就不需要再傳輸與解析 nvarchar(max) 內容。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# 解析後的表單結構，以內容雜湊為鍵，保留最近使用的項目
+SCHEMA_CACHE_SIZE = 1024
+_schema_lock = threading.Lock()
+_schema_cache = OrderedDict()
+
+_validated_lock = threading.Lock()
+# 已確認為合法 JSON 的內容雜湊
+_validated_hashes = set()
+
+# 部門代碼 -> (到期時間, 表單摘要列表)，保留最近使用的部門代碼
+DEPARTMENT_INDEX_SIZE = 512
+_department_lock = threading.Lock()
+_department_index = OrderedDict()
+# 每次失效加 1；載入期間若已失效，載入的 (可能是舊的) 結果不寫入索引
+_department_generation = 0
+
+# 編譯後的表單結構 (CompiledSchema)，以內容雜湊為鍵，保留最近使用的項目
+COMPILED_SCHEMA_CACHE_SIZE = 256
+_compiled_lock = threading.Lock()
+_compiled_schemas = OrderedDict()
+
+
+def get_cached_schema(content_hash):
+    """取得內容雜湊對應的已解析表單結構，不存在時返回 None"""
+    if content_hash is None:
+        return None
+    with _schema_lock:
+        parsed_schema = _schema_cache.get(content_hash)
+        if parsed_schema is not None:
+            _schema_cache.move_to_end(content_hash)
+        return parsed_schema
+
+
+def store_cached_schema(content_hash, parsed_schema):
+    """寫入已解析的表單結構 (呼叫端不可再修改 parsed_schema)，超過上限時移除最久未使用的項目"""
+    if content_hash is None:
+        return
+    with _schema_lock:
+        _schema_cache[content_hash] = parsed_schema
+        _schema_cache.move_to_end(content_hash)
+        while len(_schema_cache) > SCHEMA_CACHE_SIZE:
+            _schema_cache.popitem(last=False)
+
+
+def clear_schema_cache():
+    """清空結構快取 (內容以雜湊定址，表單變更時不需個別失效)"""
+    with _schema_lock:
+        _schema_cache.clear()
+    with _validated_lock:
+        _validated_hashes.clear()
+
+
+def schema_content_hash(schema_content_str):
+    """
+    以與 SCHEMA_HASH_SQL 相同的方式計算雜湊：
+    HASHBYTES('SHA2_256', nvarchar) 以 UTF-16LE 編碼計算，並輸出大寫十六進位字串
+    """
+    if schema_content_str is None:
+        return None
+    return hashlib.sha256(schema_content_str.encode('utf-16-le')).hexdigest().upper()
+
+
+def is_schema_validated(content_hash):
+    """檢查指定內容是否已驗證為合法 JSON"""
+    if content_hash is None:
+        return False
+    with _validated_lock:
+        return content_hash in _validated_hashes
+
+
+def mark_schema_validated(content_hash):
+    """記錄指定內容已驗證為合法 JSON"""
+    if content_hash is None:
+        return
+    with _validated_lock:
+        _validated_hashes.add(content_hash)
+
+
+def get_department_forms(code):
+    """取得部門代碼對應的表單摘要列表，若不存在或已過期則返回 None"""
+    with _department_lock:
+        entry = _department_index.get(code)
+        if entry is not None:
+            _department_index.move_to_end(code)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def department_index_generation():
+    """目前的索引世代，查詢部門表單前取得並傳給 store_department_forms"""
+    with _department_lock:
+        return _department_generation
+
+
+def store_department_forms(code, forms, ttl_seconds, generation):
+    """
+    寫入部門代碼對應的表單摘要列表，超過 DEPARTMENT_INDEX_SIZE 個部門代碼時移除最久未使用的項目。
+    generation 與目前世代不同 (查詢期間表單已變更) 時不寫入。
+    """
+    with _department_lock:
+        if generation != _department_generation:
+            return
+        _department_index[code] = (time.monotonic() + ttl_seconds, forms)
+        _department_index.move_to_end(code)
+        while len(_department_index) > DEPARTMENT_INDEX_SIZE:
+            _department_index.popitem(last=False)
+
+
+def invalidate_department_index():
+    """表單新增、修改或刪除後，清空部門代碼索引"""
+    global _department_generation
+    with _department_lock:
+        _department_index.clear()
+        _department_generation += 1
+
+
+def get_cached_compiled_schema(content_hash):
+    """取得內容雜湊對應的 CompiledSchema，不存在時返回 None"""
+    if content_hash is None:
+        return None
+    with _compiled_lock:
+        compiled = _compiled_schemas.get(content_hash)
+        if compiled is not None:
+            _compiled_schemas.move_to_end(content_hash)
+        return compiled
+
+
+def store_cached_compiled_schema(content_hash, compiled):
+    """寫入 CompiledSchema，超過上限時移除最久未使用的項目"""
+    if content_hash is None:
+        return
+    with _compiled_lock:
+        _compiled_schemas[content_hash] = compiled
+        _compiled_schemas.move_to_end(content_hash)
+        while len(_compiled_schemas) > COMPILED_SCHEMA_CACHE_SIZE:
+            _compiled_schemas.popitem(last=False)
@@ -0,0 +1,451 @@
+"""
+巡檢紀錄 (user_ 表單資料表) 的存取
+
+每個表單在 create_form_table 建立的 user_<form> 資料表中保存巡檢紀錄，
+欄位包含 UserId、PointInfoId、CheckDate 等基本欄位，以及每個項目的
+Item{n} / Item{n}_Remark 欄位。項目過多的表單會垂直分割到 user_<form>_p2 ...
+分割表，寫入時依欄位所在的資料表拆開，讀取時再以主鍵 JOIN 回單一紀錄。
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from flask import abort, current_app
+from werkzeug.exceptions import HTTPException
+from db import get_db
+from .form_schema import get_compiled_schema, get_form_table_name, get_item_table_layout, REMARK_COLUMN_LENGTH
+from .table_catalog import load_table_catalog
+from .table_manager import get_form_schema
+
+# 可由用戶端寫入的基本欄位與其值的類型
+RECORD_BASE_COLUMNS = {
+    "UserId": "int",
+    "PointInfoId": "int",
+    "ReviewerId": "int",
+    "ReviewerComment": "text",
+    "CheckDate": "datetime",
+}
+
+# GET /api/forms/<id>/records 支援的等值過濾欄位 (查詢參數 -> 資料表欄位)
+RECORD_FILTER_PARAMS = {
+    "userId": "UserId",
+    "pointInfoId": "PointInfoId",
+    "reviewerId": "ReviewerId",
+}
+
+# decimal(18, 4) 可保存的最大絕對值 (整數部分 14 位)
+ITEM_DECIMAL_LIMIT = Decimal("1e14")
+
+# 預先組好的 INSERT / SELECT 語句，以 (資料表名稱, 結構雜湊) 為鍵，保留最近使用的項目
+INSERT_STATEMENT_CACHE_SIZE = 256
+_insert_lock = threading.Lock()
+_insert_statements = OrderedDict()
+
+
+def _get_record_statements(cursor, table_name, content_hash, compiled):
+    """
+    取得 (或建立) 指定資料表版本的參數化 INSERT 語句、欄位順序與查詢用的 FROM 子句。
+    首次使用某版本時查詢一次項目欄位所在的資料表 (主表或分割表)。
+    表單定義已提交但 DDL 工作尚未新增欄位時，部分項目在資料表中還沒有欄位：
+    先重新載入 table catalog 確認 (欄位可能由其他 worker 行程新增)，仍缺少的項目不列入語句，
+    並記錄在 missing_items 中；這樣的語句不放入快取，欄位新增後即重新建立。
+    """
+    key = (table_name, content_hash)
+    with _insert_lock:
+        cached = _insert_statements.get(key)
+        if cached is not None:
+            _insert_statements.move_to_end(key)
+            return cached
+
+    layout = get_item_table_layout(cursor, table_name)
+    location = {item_id: partition_table for _, partition_table, item_ids in layout for item_id in item_ids}
+    if any(item_id not in location for item_id in compiled.item_ids):
+        load_table_catalog(cursor)
+        layout = get_item_table_layout(cursor, table_name)
+        location = {item_id: partition_table for _, partition_table, item_ids in layout for item_id in item_ids}
+    missing_items = [item_id for item_id in compiled.item_ids if item_id not in location]
+    partitions = {partition_table: [] for _, partition_table, _ in layout}
+    for item_id in compiled.item_ids:
+        if item_id in location:
+            partitions[location[item_id]].extend([f"Item{item_id}", f"Item{item_id}_Remark"])
+
+    main_columns = list(RECORD_BASE_COLUMNS) + ["TableName"] + partitions.pop(table_name)
+    partitions = {partition_table: columns for partition_table, columns in partitions.items() if columns}
+    id_column = f"{table_name}Id"
+
+    def insert_sql(target_table, columns, key_value=None):
+        column_list = ", ".join(f"[{column}]" for column in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        if key_value is not None:
+            column_list = f"[{id_column}], {column_list}"
+            placeholders = f"{key_value}, {placeholders}"
+        return f"INSERT INTO [dbo].[{target_table}] ({column_list}) VALUES ({placeholders})"
+
+    columns = list(main_columns)
+    if not partitions:
+        statement = {
+            "insert": insert_sql(table_name, main_columns),
+            "columns": columns,
+            "partitioned": False,
+            "select": f"* FROM [dbo].[{table_name}]",
+            "qualifier": ""
+        }
+    else:
+        # 每筆紀錄一個批次：先寫入主表取得主鍵，再以相同主鍵寫入各分割表
+        batch = ["SET NOCOUNT ON;", insert_sql(table_name, main_columns) + ";",
+                 "DECLARE @RecordId int = SCOPE_IDENTITY();"]
+        select_columns = ["m.*"]
+        joins = []
+        for index, (partition_table, partition_columns) in enumerate(partitions.items(), start=2):
+            batch.append(insert_sql(partition_table, partition_columns, key_value="@RecordId") + ";")
+            columns.extend(partition_columns)
+            alias = f"p{index}"
+            select_columns.extend(f"{alias}.[{column}]" for column in partition_columns)
+            joins.append(f"LEFT JOIN [dbo].[{partition_table}] AS {alias} ON {alias}.[{id_column}] = m.[{id_column}]")
+        statement = {
+            "insert": "\n".join(batch),
+            "columns": columns,
+            "partitioned": True,
+            "select": f"{', '.join(select_columns)} FROM [dbo].[{table_name}] AS m {' '.join(joins)}",
+            "qualifier": "m."
+        }
+    statement["missing_items"] = missing_items
+    if missing_items:
+        return statement
+
+    with _insert_lock:
+        _insert_statements[key] = statement
+        while len(_insert_statements) > INSERT_STATEMENT_CACHE_SIZE:
+            _insert_statements.popitem(last=False)
+    return statement
+
+
+def _coerce_base_value(column, value):
+    """將基本欄位的值轉換為資料庫參數，格式錯誤時拋出 ValueError"""
+    if value is None:
+        return None
+    kind = RECORD_BASE_COLUMNS[column]
+    if kind == "int":
+        if isinstance(value, bool):
+            raise ValueError(f"{column} 必須是整數")
+        return int(value)
+    if kind == "datetime":
+        if not isinstance(value, str):
+            raise ValueError(f"{column} 必須是 ISO 8601 日期時間字串")
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return str(value)
+
+
+def _coerce_item_value(value, item=None):
+    """
+    依項目的欄位型別 (見 CompiledSchema 的 kind) 將值轉換為資料庫參數，格式錯誤時拋出 ValueError。
+    未標示類型的項目 (nvarchar(max)) 一律轉為字串。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        raise ValueError("項目值必須是字串、數字或布林值")
+    kind = item["kind"] if item else None
+    if kind == "decimal":
+        if isinstance(value, bool):
+            raise ValueError("必須是數值")
+        try:
+            number = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError("必須是數值")
+        if not number.is_finite() or abs(number) >= ITEM_DECIMAL_LIMIT:
+            raise ValueError("數值超出範圍")
+        return number
+    if kind == "bit":
+        if isinstance(value, bool):
+            return value
+        if value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in ("true", "false", "1", "0"):
+            return value.strip().lower() in ("true", "1")
+        raise ValueError("必須是布林值")
+    if kind == "date":
+        if not isinstance(value, str):
+            raise ValueError("必須是 ISO 8601 日期字串")
+        return date.fromisoformat(value[:10])
+    if isinstance(value, bool):
+        value = "1" if value else "0"
+    value = str(value)
+    if kind == "text" and item["max_length"] and len(value) > item["max_length"]:
+        raise ValueError(f"長度不可超過 {item['max_length']} 個字元")
+    return value
+
+
+def _coerce_remark_value(value):
+    """將 Item{n}_Remark 的值轉換為字串並檢查長度"""
+    value = _coerce_item_value(value)
+    if value is not None and len(value) > REMARK_COLUMN_LENGTH:
+        raise ValueError(f"長度不可超過 {REMARK_COLUMN_LENGTH} 個字元")
+    return value
+
+
+def _build_record_row(record, columns, compiled):
+    """驗證單筆紀錄並轉換為與 columns 對應的參數列，返回 (row, errors)"""
+    if not isinstance(record, dict):
+        return None, ["紀錄必須是 JSON 物件"]
+
+    errors = []
+    values = {}
+    for key, value in record.items():
+        try:
+            if key in RECORD_BASE_COLUMNS:
+                values[key] = _coerce_base_value(key, value)
+                continue
+            is_remark = key.endswith("_Remark")
+            item_key = key[:-len("_Remark")] if is_remark else key
+            if not item_key.startswith("Item") or not item_key[4:].isdigit():
+                errors.append(f"未知的欄位: {key}")
+                continue
+            item = compiled.items_by_id.get(int(item_key[4:]))
+            if item is None:
+                errors.append(f"表單中不存在的項目: {key}")
+                continue
+            values[key] = _coerce_remark_value(value) if is_remark else _coerce_item_value(value, item)
+        except (ValueError, TypeError) as e:
+            errors.append(f"欄位 {key} 格式錯誤: {e}")
+
+    if errors:
+        return None, errors
+    return tuple(values.get(column) for column in columns), []
+
+
+def insert_form_records(form_id, records):
+    """
+    將巡檢紀錄寫入表單的 user_ 資料表。
+    records 為單筆紀錄 (dict) 或紀錄列表；紀錄依表單結構驗證後，
+    以快取的參數化 INSERT 搭配 fast_executemany 在同一交易中批次寫入；
+    垂直分割的表單則每筆紀錄以一個批次同時寫入主表與分割表。
+    返回 None (表單不存在)、{"success": False, "errors": [...]} 或 {"success": True, "inserted": n}
+    """
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list) or not records:
+        return {"success": False, "errors": [{"index": None, "messages": ["請提供至少一筆紀錄"]}]}
+
+    max_batch = current_app.config.get('RECORDS_MAX_BATCH', 5000)
+    if len(records) > max_batch:
+        return {"success": False, "errors": [{"index": None, "messages": [f"單次最多寫入 {max_batch} 筆紀錄"]}]}
+
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+    if not isinstance(form["formJson"], dict):
+        abort(500, description=f"Form definition {form_id} has no valid schema.")
+
+    compiled = get_compiled_schema(form["formJson"], content_hash=form["schemaHash"])
+    table_name = get_form_table_name(form["formIdentifier"])
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        statement = _get_record_statements(cursor, table_name, form["schemaHash"], compiled)
+        missing_columns = {column for item_id in statement["missing_items"]
+                           for column in (f"Item{item_id}", f"Item{item_id}_Remark")}
+        if any(isinstance(record, dict) and missing_columns.intersection(record) for record in records):
+            # 資料表遷移尚未完成，寫入會遺失這些項目的值；用戶端稍後重試
+            abort(409, description=f"Table '{table_name}' has no columns yet for items "
+                                   f"{statement['missing_items']}; the schema migration is still running, retry later.")
+        columns = statement["columns"]
+        table_name_index = columns.index("TableName")
+
+        rows = []
+        errors = []
+        for index, record in enumerate(records):
+            row, record_errors = _build_record_row(record, columns, compiled)
+            if record_errors:
+                errors.append({"index": index, "messages": record_errors})
+                continue
+            row = list(row)
+            row[table_name_index] = form["formIdentifier"][:32]
+            rows.append(row)
+
+        if errors:
+            return {"success": False, "errors": errors}
+
+        # 分割表的寫入批次依賴 SCOPE_IDENTITY()，需逐筆執行，因此只在單一資料表時使用 fast_executemany
+        cursor.fast_executemany = not statement["partitioned"]
+        cursor.executemany(statement["insert"], rows)
+        db.commit()
+        current_app.logger.info(f"Inserted {len(rows)} records into '{table_name}' for form ID {form_id}")
+        return {"success": True, "inserted": len(rows), "table_name": table_name}
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error inserting records into '{table_name}': {str(e)}")
+        abort(500, description=f"Error inserting records: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def query_form_records(form_id, filters=None, after=None, limit=50):
+    """
+    查詢表單的巡檢紀錄，依主鍵由新到舊排序並以 keyset 方式分頁。
+    filters 可包含 userId、pointInfoId、reviewerId (整數) 以及 checkDateFrom / checkDateTo (datetime，含起不含迄)；
+    after 為上一頁回傳的 next_cursor (主鍵值)。
+    每個過濾欄位都有對應的非叢集索引 (見 RECORD_INDEX_COLUMNS)。
+    返回 None (表單不存在) 或 {"records": [...], "next_cursor": 主鍵或 None}
+    """
+    filters = filters or {}
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+
+    table_name = get_form_table_name(form["formIdentifier"])
+    id_column = f"{table_name}Id"
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        compiled = get_compiled_schema(form["formJson"], content_hash=form["schemaHash"])
+        statement = _get_record_statements(cursor, table_name, form["schemaHash"], compiled)
+        # 分割表以 JOIN 合併，基本欄位與主鍵需加上主表別名
+        qualifier = statement["qualifier"]
+
+        where_clauses = []
+        params = []
+        for param_name, column in RECORD_FILTER_PARAMS.items():
+            if filters.get(param_name) is not None:
+                where_clauses.append(f"{qualifier}[{column}] = ?")
+                params.append(filters[param_name])
+        if filters.get("checkDateFrom") is not None:
+            where_clauses.append(f"{qualifier}[CheckDate] >= ?")
+            params.append(filters["checkDateFrom"])
+        if filters.get("checkDateTo") is not None:
+            where_clauses.append(f"{qualifier}[CheckDate] < ?")
+            params.append(filters["checkDateTo"])
+        if after is not None:
+            where_clauses.append(f"{qualifier}[{id_column}] < ?")
+            params.append(after)
+
+        where_string = f" WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        query = f"SELECT TOP (?) {statement['select']}{where_string} ORDER BY {qualifier}[{id_column}] DESC"
+
+        cursor.execute(query, [limit] + params)
+        columns = [column[0] for column in cursor.description]
+        records = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        next_cursor = records[-1][id_column] if len(records) == limit else None
+        return {"records": records, "next_cursor": next_cursor}
+    except Exception as e:
+        current_app.logger.error(f"Error querying records from '{table_name}': {str(e)}")
+        abort(500, description=f"Error querying records: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+
+def _build_record_copy_statements(source_family, target_family, source_table, target_table, target_identifier):
+    """
+    產生複製一批紀錄 (主鍵大於 @last 且不大於 @high) 的 INSERT ... SELECT 語句，返回 [(語句, 參數)]。
+    每個目標資料表一個語句，欄位取兩邊都存在者，分布在來源分割表的欄位以主鍵 LEFT JOIN 取得。
+    """
+    source_id = f"{source_table}Id"
+    target_id = f"{target_table}Id"
+    source_main = next(entry for entry in source_family if entry["references"] is None)
+    source_partitions = [entry for entry in source_family if entry["references"] is not None]
+    # 主表別名為 m，分割表依序為 s1、s2 ...
+    aliases = {source_main["name"]: "m"}
+    aliases.update({entry["name"]: f"s{number}" for number, entry in enumerate(source_partitions, start=1)})
+    # 來源欄位 (小寫) -> (別名, 欄位名稱)
+    source_columns = {}
+    for entry in [source_main] + source_partitions:
+        for key, column in entry["columns"].items():
+            if key != source_id.lower():
+                source_columns.setdefault(key, (aliases[entry["name"]], column["name"]))
+
+    # 主表先寫入 (分割表以外鍵參照主表)
+    target_main = next(entry for entry in target_family if entry["references"] is None)
+    target_partitions = [entry for entry in target_family if entry["references"] is not None]
+    statements = []
+    for entry in [target_main] + target_partitions:
+        columns = [column["name"] for key, column in entry["columns"].items()
+                   if key != target_id.lower() and key in source_columns]
+        prefix_params = []
+        values = []
+        for column in columns:
+            if entry is target_main and column == "TableName":
+                # 複製後的紀錄屬於新表單
+                values.append("?")
+                prefix_params.append(target_identifier[:32])
+            else:
+                values.append("{}.[{}]".format(*source_columns[column.lower()]))
+        joined = {source_columns[column.lower()][0] for column in columns}
+        join_sql = "".join(
+            f" LEFT JOIN [dbo].[{partition['name']}] AS {aliases[partition['name']]}"
+            f" ON {aliases[partition['name']]}.[{source_id}] = m.[{source_id}]"
+            for partition in source_partitions if aliases[partition["name"]] in joined
+        )
+        statements.append((
+            f"INSERT INTO [dbo].[{entry['name']}] ([{target_id}]{''.join(f', [{column}]' for column in columns)}) "
+            f"SELECT m.[{source_id}]{''.join(f', {value}' for value in values)} "
+            f"FROM [dbo].[{source_main['name']}] AS m{join_sql} WHERE m.[{source_id}] > @last AND m.[{source_id}] <= @high;",
+            prefix_params
+        ))
+    return statements
+
+
+def copy_form_records(source_table, target_table, target_identifier):
+    """
+    將 source_table (含分割表) 的巡檢紀錄複製到 target_table (含分割表)，保留原本的紀錄 ID。
+    兩邊都存在的欄位才會複製，TableName 欄位改為 target_identifier。
+    依主鍵順序分批 (每批 CLONE_RECORDS_BATCH_SIZE 筆) 以 INSERT ... SELECT 在伺服器端複製，每批一個交易，
+    避免長時間鎖定與交易記錄暴增。批次以上一批的最後一個 ID 為起點 (keyset)，
+    ID 不連續 (刪除、重設 IDENTITY) 時也不會產生空的批次。返回 {"copied": 筆數, "batches": 批次數}。
+    """
+    from .table_catalog import get_table_family
+
+    batch_size = current_app.config.get('CLONE_RECORDS_BATCH_SIZE', 5000)
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        source_family = get_table_family(cursor, source_table)
+        target_family = get_table_family(cursor, target_table)
+        if not source_family or not target_family:
+            abort(404, description=f"Table '{source_table}' or '{target_table}' not found.")
+        statements = _build_record_copy_statements(source_family, target_family, source_table, target_table, target_identifier)
+        source_id = f"{source_table}Id"
+        # 先取得本批最後一個 ID (@high)，再複製 @last 之後到 @high 的紀錄；返回 @high 與本批筆數
+        # 主表的 ID 為 IDENTITY，寫入原本的 ID 需開啟 IDENTITY_INSERT
+        batch_sql = "\n".join(
+            ["SET XACT_ABORT ON;", "SET NOCOUNT ON;",
+             "DECLARE @last bigint = ?, @high bigint, @copied int;",
+             f"SELECT @high = MAX(k.[{source_id}]), @copied = COUNT(*) FROM (SELECT TOP (?) [{source_id}] "
+             f"FROM [dbo].[{source_table}] WHERE [{source_id}] > @last ORDER BY [{source_id}]) AS k;",
+             f"SET IDENTITY_INSERT [dbo].[{target_table}] ON;", statements[0][0],
+             f"SET IDENTITY_INSERT [dbo].[{target_table}] OFF;"] + [sql for sql, _ in statements[1:]]
+            + ["SELECT @high, @copied;"]
+        )
+        statement_params = [param for _, params in statements for param in params]
+
+        cursor.execute(f"SELECT MIN([{source_id}]) FROM [dbo].[{source_table}]")
+        first_id = cursor.fetchone()[0]
+        total = 0
+        batches = 0
+        last = first_id - 1 if first_id is not None else None
+        while last is not None:
+            cursor.execute(batch_sql, [last, batch_size] + statement_params)
+            high, copied = cursor.fetchone()
+            db.commit()
+            batches += 1
+            total += copied
+            # 不足一批代表已複製到最後一筆
+            last = high if copied == batch_size else None
+
+        current_app.logger.info(f"Copied {total} records from '{source_table}' to '{target_table}' in {batches} batches")
+        return {"copied": total, "batches": batches}
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error copying records from '{source_table}' to '{target_table}': {str(e)}")
+        abort(500, description=f"Error copying records: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
@@ -2,47 +2,213 @@ import json
 # import logging # logging 已被 current_app.logger 取代
 from flask import abort, current_app # 新增 current_app
 from db import get_db
+from .form_cache import schema_content_hash, get_cached_compiled_schema, store_cached_compiled_schema
+from .table_catalog import (
+    apply_catalog_changes, get_catalog_table, get_table_family, invalidate_table_catalog, table_exists
+)
 
 # TODO: 將資料庫名稱設為可配置 (例如，從環境變數或設定檔讀取) -> 這個 TODO 現在可以解決了
 # 移除這一行 -> DB_NAME = 'RoutinInspection_dev' # 或 'RoutinInspection'
 
+# 項目標籤與類型可能出現的欄位名稱 (依序取第一個有值的欄位)
+ITEM_LABEL_KEYS = ('ItemName', 'Label', 'Title', 'Name', 'label', 'name')
+ITEM_TYPE_KEYS = ('ItemType', 'InputType', 'Type', 'type')
+ITEM_MAX_LENGTH_KEYS = ('MaxLength', 'maxLength', 'maxlength')
+
+# 項目類型 (不分大小寫) 與 Item{n} 欄位型別的對應
+ITEM_NUMERIC_TYPES = {'number', 'numeric', 'decimal', 'float', 'integer', 'int'}
+ITEM_BOOLEAN_TYPES = {'checkbox', 'boolean', 'bool', 'switch'}
+ITEM_DATE_TYPES = {'date'}
+ITEM_TEXT_TYPES = {'text', 'string', 'select', 'radio', 'dropdown', 'option'}
+
+ITEM_DECIMAL_SQL_TYPE = "[decimal](18, 4)"
+ITEM_TEXT_DEFAULT_LENGTH = 255
+NVARCHAR_MAX_LENGTH = 4000  # 超過此長度只能使用 nvarchar(max)
+REMARK_COLUMN_LENGTH = 1000
+
+# user_ 資料表的儲存選項 (保存在 TableManager.SparseItems / DataCompression)
+STORAGE_COMPRESSION_TYPES = ('NONE', 'ROW', 'PAGE')
+DEFAULT_STORAGE_OPTIONS = {"sparse": False, "compression": "NONE"}
+
+def _iter_item_elements(element, base_path=""):
+    """
+    以迭代方式 (非遞迴，不受遞迴深度限制) 依文件順序走訪 JSON 結構，
+    產生 (ItemId 原始值, 元素, JSON Pointer 路徑)。
+    只會往 'Elements' (列表或單個物件) 及列表元素向下走訪。
+    """
+    stack = [(element, base_path)]
+    while stack:
+        node, path = stack.pop()
+        if isinstance(node, dict):
+            # 檢查是否為 Item 類型且包含 ItemId
+            if node.get('ElmentType') == 'Item' and 'ItemId' in node:
+                yield node['ItemId'], node, path
+            if 'Elements' in node:
+                elements_value = node['Elements']
+                if isinstance(elements_value, (list, dict)): # Elements 也可能是單個物件
+                    stack.append((elements_value, f"{path}/Elements"))
+        elif isinstance(node, list):
+            # 反向推入堆疊，確保彈出順序與原本的遞迴順序相同
+            for index in range(len(node) - 1, -1, -1):
+                stack.append((node[index], f"{path}/{index}"))
+        # 其他類型 (如字串、數字) 不包含 ItemId，直接忽略
+
 def collect_items(element, items_list):
     """
-    遞迴函數，收集 JSON 結構中所有有效的 ItemId。
-    確保 ItemId 是整數且不重複。
+    收集 JSON 結構中所有有效的 ItemId (依出現順序附加到 items_list)。
+    確保 ItemId 是整數且不重複；以集合判斷重複，整體為線性時間。
     """
-    if isinstance(element, dict):
-        # 檢查是否為 Item 類型且包含 ItemId
-        if element.get('ElmentType') == 'Item' and 'ItemId' in element:
+    seen = set(items_list)
+    for raw_item_id, _, _ in _iter_item_elements(element):
+        try:
+            item_id = int(raw_item_id)
+        except (ValueError, TypeError):
+            # 記錄無效的 ItemId 但繼續處理
+            current_app.logger.warning(f"Skipping invalid or non-integer ItemId: {raw_item_id}")
+            continue
+        # 只有當 ItemId 是有效整數且尚未加入列表時才添加
+        if item_id not in seen:
+            seen.add(item_id)
+            items_list.append(item_id)
+
+def _first_value(element, keys):
+    """取得元素中第一個有值的欄位"""
+    for key in keys:
+        value = element.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+def _infer_item_column(element, item_type):
+    """
+    依元素的類型與長度設定推斷 Item{n} 欄位，返回 (kind, SQL 型別, 最大長度)。
+    kind 為 decimal、bit、date、text 之一；未知或未標示類型的項目維持 nvarchar(max) (kind 為 None)。
+    """
+    normalized = str(item_type).strip().lower() if item_type is not None else ''
+    if normalized in ITEM_NUMERIC_TYPES:
+        return "decimal", ITEM_DECIMAL_SQL_TYPE, None
+    if normalized in ITEM_BOOLEAN_TYPES:
+        return "bit", "[bit]", None
+    if normalized in ITEM_DATE_TYPES:
+        return "date", "[date]", None
+    if normalized in ITEM_TEXT_TYPES:
+        max_length = ITEM_TEXT_DEFAULT_LENGTH
+        raw_length = _first_value(element, ITEM_MAX_LENGTH_KEYS)
+        if raw_length is not None:
             try:
-                item_id = int(element['ItemId'])
-                # 只有當 ItemId 是有效整數且尚未加入列表時才添加
-                if item_id not in items_list:
-                    items_list.append(item_id)
+                max_length = int(raw_length)
             except (ValueError, TypeError):
-                 # 記錄無效的 ItemId 但繼續處理
-                 current_app.logger.warning(f"Skipping invalid or non-integer ItemId: {element.get('ItemId')}")
-        
-        # 遞迴處理 'Elements' (如果是列表或字典)
-        if 'Elements' in element:
-            elements_value = element['Elements']
-            if isinstance(elements_value, list):
-                for sub_element in elements_value:
-                    collect_items(sub_element, items_list)
-            elif isinstance(elements_value, dict): # 處理 Elements 是單個物件的情況
-                 collect_items(elements_value, items_list)
-        
-        # (可選) 如果需要遞迴處理字典中的其他值 (可能是巢狀結構)
-        # for key, value in element.items():
-        #     if key != 'Elements' and isinstance(value, (dict, list)):
-        #          collect_items(value, items_list)
+                current_app.logger.warning(f"Ignoring invalid MaxLength '{raw_length}' for item {element.get('ItemId')}")
+        if 0 < max_length <= NVARCHAR_MAX_LENGTH:
+            return "text", f"[nvarchar]({max_length})", max_length
+        return "text", "[nvarchar](max)", None
+    return None, "[nvarchar](max)", None
 
-    # 如果元素本身是列表，遞迴處理列表中的每個元素
-    elif isinstance(element, list):
-        for sub_element in element:
-            collect_items(sub_element, items_list)
+def build_item_column_definitions(item, sparse=False):
+    """產生單一項目的 Item{n} 與 Item{n}_Remark 欄位定義 (sparse 時兩個欄位皆為 SPARSE)"""
+    item_id = item["id"]
+    null_spec = "SPARSE NULL" if sparse else "NULL"
+    return [
+        f"[Item{item_id}] {item['sql_type']} {null_spec}",
+        f"[Item{item_id}_Remark] [nvarchar]({REMARK_COLUMN_LENGTH}) {null_spec}"
+    ]
 
-    # 其他類型 (如字串、數字) 不包含 ItemId，直接忽略
+def _item_catalog_columns(items, sparse=False):
+    """項目的 Item{n} 與 Item{n}_Remark 欄位，格式為 table catalog 的 [(欄位, 型別, sparse)]"""
+    return [
+        (f"Item{item['id']}{suffix}", sql_type, sparse)
+        for item in items
+        for suffix, sql_type in (("", item["sql_type"]), ("_Remark", f"[nvarchar]({REMARK_COLUMN_LENGTH})"))
+    ]
+
+def normalize_storage_options(options):
+    """
+    驗證並正規化儲存選項 {"sparse": bool, "compression": "NONE" | "ROW" | "PAGE"}，格式錯誤時拋出 ValueError。
+    SQL Server 不允許含 SPARSE 欄位的資料表使用資料壓縮，因此兩者不可同時啟用。
+    """
+    if options is None:
+        return dict(DEFAULT_STORAGE_OPTIONS)
+    if not isinstance(options, dict):
+        raise ValueError("storageOptions 必須是 JSON 物件")
+    sparse = options.get("sparse", False)
+    if not isinstance(sparse, bool):
+        raise ValueError("storageOptions.sparse 必須是布林值")
+    compression = str(options.get("compression") or "NONE").upper()
+    if compression not in STORAGE_COMPRESSION_TYPES:
+        raise ValueError(f"storageOptions.compression 必須是 {', '.join(STORAGE_COMPRESSION_TYPES)} 之一")
+    if sparse and compression != "NONE":
+        raise ValueError("SPARSE 欄位無法與資料壓縮同時使用")
+    return {"sparse": sparse, "compression": compression}
+
+def _compression_clause(storage_options):
+    """CREATE TABLE / CREATE INDEX 的 WITH (DATA_COMPRESSION = ...) 子句"""
+    if not storage_options or storage_options["compression"] == "NONE":
+        return ""
+    return f" WITH (DATA_COMPRESSION = {storage_options['compression']})"
+
+class CompiledSchema:
+    """
+    表單 JSON 的編譯結果，同一版本的 schema 只建立一次，
+    供建立資料表、結構比對與資料驗證共用。
+    items 依出現順序排列，每個項目包含 id、label、type、path (JSON Pointer)、原始元素，
+    以及推斷出的欄位資訊 kind、sql_type、max_length。
+    呼叫端不可修改其內容。
+    """
+    def __init__(self, items):
+        self.items = items
+        self.item_ids = [item["id"] for item in items]
+        self.items_by_id = {item["id"]: item for item in items}
+
+    def __len__(self):
+        return len(self.items)
+
+def compile_schema(form_json):
+    """將表單 JSON 編譯為 CompiledSchema (不使用快取)"""
+    items = []
+    seen = set()
+    for raw_item_id, element, path in _iter_item_elements(form_json):
+        try:
+            item_id = int(raw_item_id)
+        except (ValueError, TypeError):
+            current_app.logger.warning(f"Skipping invalid or non-integer ItemId: {raw_item_id}")
+            continue
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        item_type = _first_value(element, ITEM_TYPE_KEYS)
+        kind, sql_type, max_length = _infer_item_column(element, item_type)
+        items.append({
+            "id": item_id,
+            "label": _first_value(element, ITEM_LABEL_KEYS),
+            "type": item_type,
+            "path": path,
+            "element": element,
+            "kind": kind,
+            "sql_type": sql_type,
+            "max_length": max_length
+        })
+    return CompiledSchema(items)
+
+def get_compiled_schema(form_json, content_hash=None):
+    """
+    取得表單 JSON 的 CompiledSchema，以內容雜湊為鍵快取。
+    form_json 可以是字串或已解析的 dict；未提供 content_hash 時依內容計算。
+    """
+    if isinstance(form_json, str):
+        if content_hash is None:
+            content_hash = schema_content_hash(form_json)
+        cached = get_cached_compiled_schema(content_hash)
+        if cached is not None:
+            return cached
+        form_json = json.loads(form_json)
+    elif content_hash is None:
+        content_hash = schema_content_hash(json.dumps(form_json, sort_keys=True))
+
+    cached = get_cached_compiled_schema(content_hash)
+    if cached is None:
+        cached = compile_schema(form_json)
+        store_cached_compiled_schema(content_hash, cached)
+    return cached
 
 def get_configured_db_name():
     """輔助函數：從配置中獲取資料庫名稱"""
@@ -53,6 +219,280 @@ def get_configured_db_name():
         raise ValueError("DB_NAME is not configured.")
     return db_name
 
+def get_form_table_name(form_identifier):
+    """根據表單識別符取得對應的 user_ 資料表名稱"""
+    trimmed_identifier = form_identifier.strip()
+    return trimmed_identifier if trimmed_identifier.startswith("user_") else f"user_{trimmed_identifier}"
+
+# 巡檢紀錄查詢 (GET /api/forms/<id>/records) 可過濾的欄位，每個欄位建立一個非叢集索引。
+# 非叢集索引會隱含叢集主鍵 ({table}Id)，因此等值過濾後可直接依主鍵順序做 keyset 分頁。
+RECORD_INDEX_COLUMNS = ("CheckDate", "UserId", "PointInfoId", "ReviewerId")
+
+def build_record_index_sql(table_name, column, storage_options=None):
+    """產生巡檢紀錄過濾欄位的 CREATE INDEX 語句"""
+    return f"CREATE NONCLUSTERED INDEX [IX_{table_name}_{column}] ON [dbo].[{table_name}] ([{column}]){_compression_clause(storage_options)};"
+
+def _ensure_record_indexes(cursor, table_name, storage_options=None, catalog_changes=None):
+    """
+    為既有的 user_ 資料表補建缺少的過濾欄位索引，返回新建立的索引名稱。
+    以索引的第一個鍵欄位判斷是否已存在 (資料表重新命名後索引名稱不會跟著變更)。
+    catalog_changes 有提供時加入對應的 catalog 變更，由呼叫端在提交後套用。
+    """
+    table = get_catalog_table(cursor, table_name)
+    indexed_columns = table["indexed_columns"] if table else set()
+
+    missing_columns = [column for column in RECORD_INDEX_COLUMNS if column not in indexed_columns]
+    if not missing_columns:
+        return []
+    cursor.execute("\n".join(build_record_index_sql(table_name, column, storage_options) for column in missing_columns))
+    if catalog_changes is not None:
+        catalog_changes.extend(("add_index", table_name, column) for column in missing_columns)
+    created = [f"IX_{table_name}_{column}" for column in missing_columns]
+    current_app.logger.info(f"Created record indexes on '{table_name}': {created}")
+    return created
+
+# SQL Server 單一資料表最多 1,024 個欄位，而每個項目佔 Item{n} 與 Item{n}_Remark 兩個欄位。
+# 項目數超過 FORM_ITEMS_PER_TABLE 的表單會垂直分割：其餘項目依序放在 {table}_p2、{table}_p3 ... 分割表，
+# 分割表以與主表相同的 {table}Id 為主鍵，並以外鍵 (ON DELETE CASCADE) 參照主表。
+DEFAULT_ITEMS_PER_TABLE = 200
+MAX_ITEMS_PER_TABLE = 500
+
+def get_items_per_table():
+    """取得每個資料表最多容納的項目數 (不超過欄位數上限)"""
+    configured = current_app.config.get('FORM_ITEMS_PER_TABLE') or DEFAULT_ITEMS_PER_TABLE
+    return max(1, min(int(configured), MAX_ITEMS_PER_TABLE))
+
+def get_partition_table_name(table_name, partition_number):
+    """取得第 n 個分割表的名稱 (第 1 個即為主表)"""
+    return table_name if partition_number == 1 else f"{table_name}_p{partition_number}"
+
+def _partition_number(table_name, partition_table):
+    """由資料表名稱取得分割編號 (主表為 1)，不是該主表的分割表時返回 None"""
+    if partition_table.lower() == table_name.lower():
+        return 1
+    prefix = f"{table_name}_p"
+    suffix = partition_table[len(prefix):]
+    if partition_table.lower().startswith(prefix.lower()) and suffix.isdigit() and int(suffix) >= 2:
+        return int(suffix)
+    return None
+
+def _uses_lob_columns(items):
+    """是否有 nvarchar(max) 欄位 (TEXTIMAGE_ON 只能用於含 LOB 欄位的資料表)"""
+    return any(item["sql_type"].endswith("(max)") for item in items)
+
+def _item_column_id(column_name):
+    """Item{n} 欄位的項目 ID (Item{n}_Remark 與其他欄位返回 None)"""
+    raw_id = column_name[4:]
+    return int(raw_id) if column_name.startswith("Item") and raw_id.isdigit() else None
+
+def get_item_table_layout(cursor, table_name):
+    """
+    由 table catalog 取得主表與其分割表中既有的 Item{n} 欄位，
+    返回依分割編號排序的 [(編號, 資料表名稱, {項目 ID})]；主表一定位於第一個位置。
+    """
+    partitions = {1: (1, table_name, set())}
+    for table in get_table_family(cursor, table_name):
+        number = _partition_number(table_name, table["name"])
+        if number is None:
+            continue
+        if number not in partitions:
+            partitions[number] = (number, table["name"], set())
+        partitions[number][2].update(
+            item_id for item_id in map(_item_column_id, (column["name"] for column in table["columns"].values()))
+            if item_id is not None
+        )
+    return [partitions[number] for number in sorted(partitions)]
+
+def build_partition_table_sql(table_name, partition_table, items, storage_options=None):
+    """產生分割表的 CREATE TABLE 語句 (主鍵與主表相同並參照主表)"""
+    storage_options = storage_options or DEFAULT_STORAGE_OPTIONS
+    id_column = f"{table_name}Id"
+    columns = [f"[{id_column}] [int] NOT NULL"]
+    columns.extend(", ".join(build_item_column_definitions(item, storage_options["sparse"])) for item in items)
+    all_columns_str = ",\n            ".join(columns)
+    textimage = " TEXTIMAGE_ON [PRIMARY]" if _uses_lob_columns(items) else ""
+    return f"""
+        CREATE TABLE [dbo].[{partition_table}](
+            {all_columns_str},
+         CONSTRAINT [PK_{partition_table}] PRIMARY KEY CLUSTERED ([{id_column}] ASC),
+         CONSTRAINT [FK_{partition_table}] FOREIGN KEY ([{id_column}])
+            REFERENCES [dbo].[{table_name}] ([{id_column}]) ON DELETE CASCADE
+        ) ON [PRIMARY]{textimage}{_compression_clause(storage_options)}
+        """
+
+def _apply_storage_options(cursor, table_names, storage_options, catalog_changes=None):
+    """
+    讓既有的主表與分割表符合儲存選項 (依 table catalog 的欄位與壓縮設定比對)，返回執行的語句。
+    先移除 SPARSE、再以 ALTER INDEX ALL ... REBUILD 調整壓縮 (含非叢集索引)，最後加上 SPARSE，
+    確保任何時刻都不會同時存在 SPARSE 欄位與資料壓縮。
+    """
+    sparse = storage_options["sparse"]
+    compression = storage_options["compression"]
+    statements = []
+    rebuilds = []
+    changes = []
+    for table_name in table_names:
+        table = get_catalog_table(cursor, table_name)
+        if table is None:
+            continue
+        for column in table["columns"].values():
+            if not column["name"].startswith("Item") or not column["name"][4:5].isdigit() or column["sparse"] == sparse:
+                continue
+            statements.append(f"ALTER TABLE [dbo].[{table['name']}] ALTER COLUMN [{column['name']}] {'ADD' if sparse else 'DROP'} SPARSE;")
+            changes.append(("alter_column", table["name"], column["name"], None, sparse))
+        if table["compression"] != compression:
+            rebuilds.append(f"ALTER INDEX ALL ON [dbo].[{table['name']}] REBUILD WITH (DATA_COMPRESSION = {compression});")
+            changes.append(("set_compression", table["name"], compression))
+    if catalog_changes is not None:
+        catalog_changes.extend(changes)
+    # 啟用 SPARSE 時需先解除壓縮；停用 SPARSE 時需先移除 SPARSE 才能壓縮
+    statements = rebuilds + statements if sparse else statements + rebuilds
+    if statements:
+        cursor.execute("\n".join(statements))
+        current_app.logger.info(f"Applied storage options {storage_options} to {table_names}: {len(statements)} statements")
+    return statements
+
+def apply_table_storage_options(form_identifier, storage_options):
+    """讓表單的主表與分割表套用新的儲存選項 (表單的儲存選項於 TableManager 變更後呼叫)"""
+    try:
+        storage_options = normalize_storage_options(storage_options)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    table_name = get_form_table_name(form_identifier)
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        layout = get_item_table_layout(cursor, table_name)
+        catalog_changes = []
+        statements = _apply_storage_options(cursor, [name for _, name, _ in layout], storage_options, catalog_changes)
+        db.commit()
+        apply_catalog_changes(catalog_changes)
+        return {"success": True, "table_name": table_name, "storage_changes": statements}
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error applying storage options to '{table_name}': {str(e)}")
+        abort(500, description=f"Error applying storage options: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+def rename_partition_tables(cursor, old_table_name, new_table_name, catalog_changes=None):
+    """
+    將主表的分割表 ({old}_pN) 與其主鍵欄位一併改為新主表的名稱，需在重新命名主表之前呼叫。
+    返回 [(舊名稱, 新名稱)]。
+    """
+    renamed = []
+    for table in get_table_family(cursor, old_table_name):
+        partition_table = table["name"]
+        number = _partition_number(old_table_name, partition_table)
+        if number is None or number == 1:
+            continue
+        new_partition_table = get_partition_table_name(new_table_name, number)
+        cursor.execute(f"EXEC sp_rename N'[dbo].[{partition_table}].[{old_table_name}Id]', N'{new_table_name}Id', 'COLUMN'")
+        cursor.execute(f"EXEC sp_rename N'[dbo].[{partition_table}]', N'{new_partition_table}'")
+        if catalog_changes is not None:
+            catalog_changes.extend([("rename_column", partition_table, f"{old_table_name}Id", f"{new_table_name}Id"),
+                                    ("rename_table", partition_table, new_partition_table)])
+        renamed.append((partition_table, new_partition_table))
+    if renamed:
+        current_app.logger.info(f"Renamed partition tables of '{old_table_name}': {renamed}")
+    return renamed
+
+def build_form_table_sql(cursor, form_identifier, compiled, storage_options):
+    """
+    產生建立表單資料表的 SQL (不執行)。
+    返回 dict:
+    - drop_sql: 刪除既有同名主表與其分割表
+    - create_sql: 建立主表、巡檢紀錄索引與分割表
+    - table_name / partition_tables
+    - catalog_changes: 提交後套用到 table catalog 的變更
+    """
+    table_name = get_form_table_name(form_identifier)
+
+    # 注意：這裡的 SQL Server 特定語法 IF OBJECT_ID...
+    # 它在當前連接的資料庫上下文中操作，所以不需要指定 DB_NAME
+    # 先刪除參照主表的分割表 (外鍵)，再刪除主表
+    existing_tables = [table["name"] for table in get_table_family(cursor, table_name)]
+    drop_sql = f"""
+        DECLARE @drop_partitions nvarchar(max) = N'';
+        SELECT @drop_partitions += N'DROP TABLE [dbo].' + QUOTENAME(OBJECT_NAME(parent_object_id)) + N';'
+        FROM sys.foreign_keys WHERE referenced_object_id = OBJECT_ID(N'[dbo].[{table_name}]');
+        EXEC sp_executesql @drop_partitions;
+        IF OBJECT_ID(N'[dbo].[{table_name}]', N'U') IS NOT NULL DROP TABLE [dbo].[{table_name}]
+    """
+
+    # 項目過多時垂直分割：第一組項目放在主表，其餘依序放在 _p2、_p3 ... 分割表
+    items_per_table = get_items_per_table()
+    item_groups = [compiled.items[i:i + items_per_table] for i in range(0, len(compiled.items), items_per_table)] or [[]]
+
+    id_column = f"{table_name}Id"
+    base_column_types = [
+        ("UserId", "[int]"),
+        ("PointInfoId", "[int]"),
+        ("TableName", "[nchar](32)"),
+        ("ReviewerId", "[int]"),
+        ("ReviewerComment", "[nchar](32)"),
+        ("CheckDate", "[datetime]")
+    ]
+    base_columns = [f"[{id_column}] [int] IDENTITY(1,1) NOT NULL"] + [
+        f"[{column}] {sql_type} NULL" for column, sql_type in base_column_types
+    ]
+
+    # 依項目類型決定欄位型別 (decimal / bit / date / nvarchar(n))
+    item_columns = [", ".join(build_item_column_definitions(item, storage_options["sparse"])) for item in item_groups[0]]
+
+    all_columns_str = ",\n            ".join(base_columns + item_columns)
+
+    primary_key_constraint = f"""
+     CONSTRAINT [PK_{table_name}] PRIMARY KEY CLUSTERED
+    (
+        [{table_name}Id] ASC
+    )WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+    """
+
+    # TEXTIMAGE_ON 只能用於含 nvarchar(max) 等 LOB 欄位的資料表
+    textimage = " TEXTIMAGE_ON [PRIMARY]" if _uses_lob_columns(item_groups[0]) else ""
+    create_sql = f"""
+    CREATE TABLE [dbo].[{table_name}](
+        {all_columns_str}
+        ,{primary_key_constraint}
+    ) ON [PRIMARY]{textimage}{_compression_clause(storage_options)}
+    """
+    # 注意：主鍵約束前面加了逗號，因為它是 CREATE TABLE 列表中的最後一個元素
+
+    # 建立巡檢紀錄查詢使用的非叢集索引，與 CREATE TABLE 在同一批次執行
+    create_sql += "\n" + "\n".join(
+        build_record_index_sql(table_name, column, storage_options) for column in RECORD_INDEX_COLUMNS
+    )
+
+    # 提交後更新 table catalog 的內容
+    catalog_changes = [("drop_table", name) for name in existing_tables]
+    catalog_changes.append((
+        "create_table", table_name, None,
+        [(id_column, "[int]", False)] + [(column, sql_type, False) for column, sql_type in base_column_types]
+        + _item_catalog_columns(item_groups[0], storage_options["sparse"]),
+        [id_column] + list(RECORD_INDEX_COLUMNS), storage_options["compression"]
+    ))
+
+    partition_tables = []
+    for partition_number, items in enumerate(item_groups[1:], start=2):
+        partition_table = get_partition_table_name(table_name, partition_number)
+        create_sql += "\n" + build_partition_table_sql(table_name, partition_table, items, storage_options)
+        catalog_changes.append((
+            "create_table", partition_table, table_name,
+            [(id_column, "[int]", False)] + _item_catalog_columns(items, storage_options["sparse"]), [id_column], storage_options["compression"]
+        ))
+        partition_tables.append(partition_table)
+
+    return {
+        "table_name": table_name,
+        "partition_tables": partition_tables,
+        "drop_sql": drop_sql,
+        "create_sql": create_sql,
+        "catalog_changes": catalog_changes
+    }
+
 def create_form_table(form_data):
     """
     根據表單 JSON 建立新的 user_ 資料表。
@@ -79,8 +519,7 @@ def create_form_table(form_data):
     if not form_identifier:
         abort(400, description="Missing formIdentifier for table creation.")
     
-    trimmed_identifier = form_identifier.strip()
-    table_name = trimmed_identifier if trimmed_identifier.startswith("user_") else f"user_{trimmed_identifier}"
+    table_name = get_form_table_name(form_identifier)
     
     form_json = form_data.get('formJson')
     if isinstance(form_json, str):
@@ -91,60 +530,41 @@ def create_form_table(form_data):
     
     if not isinstance(form_json, dict):
         abort(400, description="formJson must be a valid JSON object.")
+
+    try:
+        storage_options = normalize_storage_options(form_data.get('storageOptions'))
+    except ValueError as e:
+        abort(400, description=str(e))
     
     current_app.logger.info(f"Attempting to create table '{table_name}' in database '{db_name_for_logging}'")
 
     try:
-        item_ids = []
-        collect_items(form_json.get('Elements', []), item_ids)
+        compiled = get_compiled_schema(form_json)
         
-        if not item_ids:
+        if not compiled.item_ids:
             current_app.logger.warning(f"No items found in formJson for '{form_identifier}'. Creating table with base columns only.")
 
-        # 注意：這裡的 SQL Server 特定語法 IF OBJECT_ID...
-        # 它在當前連接的資料庫上下文中操作，所以不需要指定 DB_NAME
-        cursor.execute(f"IF OBJECT_ID(N'[dbo].[{table_name}]', N'U') IS NOT NULL DROP TABLE [dbo].[{table_name}]")
+        table_sql = build_form_table_sql(cursor, form_identifier, compiled, storage_options)
+        partition_tables = table_sql["partition_tables"]
+        if partition_tables:
+            current_app.logger.info(f"Form '{form_identifier}' has {len(compiled.items)} items; partitioned into {partition_tables}")
+
+        cursor.execute(table_sql["drop_sql"])
         current_app.logger.info(f"Dropped existing table '{table_name}' if it existed in current database.")
-        
-        base_columns = [
-            f"[{table_name}Id] [int] IDENTITY(1,1) NOT NULL",
-            "[UserId] [int] NULL",
-            "[PointInfoId] [int] NULL",
-            "[TableName] [nchar](32) NULL",
-            "[ReviewerId] [int] NULL",
-            "[ReviewerComment] [nchar](32) NULL",
-            "[CheckDate] [datetime] NULL"
-        ]
-        
-        item_columns = [f"[Item{item_id}] [nvarchar](max) NULL, [Item{item_id}_Remark] [nvarchar](max) NULL" for item_id in item_ids]
-            
-        all_columns_str = ",\n            ".join(base_columns + item_columns)
-
-        primary_key_constraint = f"""
-         CONSTRAINT [PK_{table_name}] PRIMARY KEY CLUSTERED 
-        (
-            [{table_name}Id] ASC
-        )WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
-        """
 
-        create_table_sql = f"""
-        CREATE TABLE [dbo].[{table_name}](
-            {all_columns_str}
-            ,{primary_key_constraint} 
-        ) ON [PRIMARY] TEXTIMAGE_ON [PRIMARY]
-        """
-        # 注意：主鍵約束前面加了逗號，因為它是 CREATE TABLE 列表中的最後一個元素
-        
+        create_table_sql = table_sql["create_sql"]
         current_app.logger.debug(f"Executing CREATE TABLE SQL for {table_name}:\n{create_table_sql}")
         cursor.execute(create_table_sql)
         db.commit()
+        apply_catalog_changes(table_sql["catalog_changes"])
         
         current_app.logger.info(f"Successfully created table '{table_name}'")
         
         return {
             "success": True,
             "message": f"Table {table_name} created successfully.",
-            "table_name": table_name
+            "table_name": table_name,
+            "partition_tables": partition_tables
         }
     except Exception as e:
         db.rollback()
@@ -155,7 +575,13 @@ def create_form_table(form_data):
             cursor.close()
 
 
-def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_json):
+def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_json, storage_options=None,
+                                 previous_form_json=None):
+    """
+    將 user_ 資料表 (含分割表) 改名並更新結構以符合 form_json。
+    previous_form_json 為更新前儲存的表單結構，傳給 update_form_table_schema，
+    使結構比對與 /schema/plan 的結果一致 (不會轉換型別推斷之前建立的欄位)。
+    """
     if not old_form_identifier or not new_form_identifier:
         abort(400, description="Old and new form identifiers are required for rename/update.")
     
@@ -168,7 +594,8 @@ def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_
     if old_form_identifier == new_form_identifier:
         current_app.logger.info(f"Form identifier '{new_form_identifier}' unchanged, only updating schema.")
         # 傳遞 db_name_for_schema_checks 給 update_form_table_schema
-        return update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks)
+        return update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks, storage_options=storage_options,
+                                        previous_form_json=previous_form_json)
 
     db = get_db()
     old_table_name = f"user_{old_form_identifier}"
@@ -179,29 +606,25 @@ def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_
     rename_success = False
     cursor = db.cursor()
     try:
-        # 檢查舊表時，TABLE_CATALOG 使用配置的 DB_NAME
-        cursor.execute(f"""
-            SELECT TABLE_NAME 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = ? AND TABLE_CATALOG = ? 
-        """, (old_table_name, db_name_for_schema_checks))
-        if not cursor.fetchone():
+        # 以 table catalog 檢查舊表與新表，不需查詢 INFORMATION_SCHEMA
+        old_table = get_catalog_table(cursor, old_table_name)
+        if old_table is None:
             current_app.logger.warning(f"Old table '{old_table_name}' not found. Assuming schema update for potentially existing '{new_table_name}'.")
             cursor.close()
-            return update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks)
-
-        # 檢查新表時，TABLE_CATALOG 使用配置的 DB_NAME
-        cursor.execute(f"""
-            SELECT TABLE_NAME 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = ? AND TABLE_CATALOG = ?
-        """, (new_table_name, db_name_for_schema_checks))
-        if cursor.fetchone():
+            return update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks, storage_options=storage_options,
+                                        previous_form_json=previous_form_json)
+
+        if table_exists(cursor, new_table_name):
             abort(409, description=f"Target table name '{new_table_name}' already exists. Cannot rename.")
 
+        # 分割表 (_p2、_p3 ...) 需在主表改名前一併改名
+        catalog_changes = []
+        rename_partition_tables(cursor, old_table_name, new_table_name, catalog_changes)
+
         # sp_rename 在當前資料庫執行，通常不需要顯式指定 DB_NAME
         rename_sql = f"EXEC sp_rename '[dbo].[{old_table_name}]', '{new_table_name}'"
         cursor.execute(rename_sql)
+        catalog_changes.append(("rename_table", old_table_name, new_table_name))
         
         old_pk_name = f"PK_{old_table_name}"
         new_pk_name = f"PK_{new_table_name}"
@@ -214,23 +637,25 @@ def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_
         old_id_col = f"{old_table_name}Id"
         new_id_col = f"{new_table_name}Id"
         try:
-            # 檢查舊 ID 列時，TABLE_CATALOG 使用配置的 DB_NAME
-            cursor.execute(f"""
-                SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = ? AND COLUMN_NAME = ? AND TABLE_CATALOG = ?
-            """, (new_table_name, old_id_col, db_name_for_schema_checks))
-            if cursor.fetchone():
+            # 舊 ID 列是否存在，以改名前的 catalog 內容判斷
+            if old_id_col.lower() in old_table["columns"]:
                  rename_col_sql = f"EXEC sp_rename N'[dbo].[{new_table_name}].[{old_id_col}]', N'{new_id_col}', 'COLUMN'"
                  cursor.execute(rename_col_sql)
+                 catalog_changes.append(("rename_column", new_table_name, old_id_col, new_id_col))
             else:
                  current_app.logger.warning(f"Old ID column '{old_id_col}' not found in renamed table '{new_table_name}'. Skipping.")
         except Exception as col_e:
             current_app.logger.warning(f"Could not rename column '{old_id_col}' to '{new_id_col}'. Error: {col_e}")
         
+        # 改名先提交 (DDL 工作使用持續的連線，未提交的 sp_rename 會一直持有 Sch-M 鎖)，提交後才更新 catalog
+        db.commit()
+        apply_catalog_changes(catalog_changes)
         rename_success = True
         current_app.logger.info(f"Successfully renamed table components from '{old_table_name}' to '{new_table_name}'.")
 
     except Exception as e:
+        db.rollback()
+        invalidate_table_catalog()
         current_app.logger.error(f"Error during table rename from '{old_table_name}' to '{new_table_name}': {str(e)}")
         abort(500, description=f"Error renaming table: {str(e)}")
     finally:
@@ -240,7 +665,8 @@ def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_
     if rename_success:
         try:
             # 傳遞 db_name_for_schema_checks 給 update_form_table_schema
-            update_result = update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks)
+            update_result = update_form_table_schema(new_form_identifier, form_json, db_name_param=db_name_for_schema_checks, storage_options=storage_options,
+                                        previous_form_json=previous_form_json)
             return {
                 "success": True,
                 "message": f"Table renamed to {new_table_name} and schema updated successfully.",
@@ -248,17 +674,29 @@ def rename_and_update_form_table(old_form_identifier, new_form_identifier, form_
                 "schema_update_details": update_result
             }
         except Exception as update_e:
+             invalidate_table_catalog()
              current_app.logger.error(f"Table renamed to '{new_table_name}', but schema update failed: {str(update_e)}")
              abort(500, description=f"Table renamed, but schema update failed: {str(update_e)}")
     else:
          abort(500, description="Table rename failed.")
 
 
-def update_form_table_schema(form_identifier, form_json, existing_cursor=None, db_name_param=None):
+def update_form_table_schema(form_identifier, form_json, existing_cursor=None, db_name_param=None, storage_options=None,
+                             previous_form_json=None, only_items=None, drop_removed=False):
     """
-    輔助函數：更新指定 user_ 資料表的結構以匹配 formJson (僅新增欄位)。
-    db_name_param 應該是從配置中獲取的資料庫名稱，用於 INFORMATION_SCHEMA 查詢。
+    輔助函數：更新指定 user_ 資料表 (含 _pN 分割表) 的結構以匹配 formJson。
+    以 schema_diff 比對出新增、移除、變更型別與更名的項目，並以單一批次執行遷移。
+    db_name_param 應該是從配置中獲取的資料庫名稱，用於日誌。
+    資料表是否存在與既有欄位皆由 table catalog 判斷；DDL 提交後更新 catalog，
+    使用 existing_cursor 時由呼叫端提交，因此改為清空 catalog。
+    storage_options 有提供時，既有資料表與新欄位都會套用該儲存選項 (SPARSE / DATA_COMPRESSION)。
+    previous_form_json 為更新前的表單結構，用於辨識 ItemId 變更以保留欄位資料。
+    only_items 為項目 ID 集合時只比對這些項目 (見 plan_schema_changes)。
+    已不在表單中的項目欄位預設保留 (表單定義的編輯不會刪除巡檢紀錄)，
+    只有 drop_removed=True (POST /schema/migrate 帶 dropRemoved) 時移除。
     """
+    from .schema_diff import plan_schema_changes, build_migration_batch
+
     if isinstance(form_json, str):
         try:
             form_json = json.loads(form_json)
@@ -266,6 +704,11 @@ def update_form_table_schema(form_identifier, form_json, existing_cursor=None, d
             abort(400, description="Invalid JSON in formJson for schema update")
     if not isinstance(form_json, dict):
          abort(400, description="formJson must be a valid JSON object for schema update.")
+    if storage_options is not None:
+        try:
+            storage_options = normalize_storage_options(storage_options)
+        except ValueError as e:
+            abort(400, description=str(e))
 
     db = get_db() # 當前連接的資料庫
     cursor = existing_cursor or db.cursor() 
@@ -279,58 +722,75 @@ def update_form_table_schema(form_identifier, form_json, existing_cursor=None, d
     table_name = f"user_{form_identifier}"
     current_app.logger.info(f"Updating schema for table '{table_name}' in database '{db_name_for_checks}'")
 
+    def commit_catalog_changes():
+        # 沒有 existing_cursor 時一律提交，即使沒有任何變更 (同一連線上先前未提交的 DDL 不會一直持有鎖)
+        if existing_cursor:
+            if catalog_changes:
+                invalidate_table_catalog()
+        else:
+            db.commit()
+            apply_catalog_changes(catalog_changes)
+
+    catalog_changes = []
     try:
-        # 查詢 INFORMATION_SCHEMA.TABLES 時，TABLE_CATALOG 使用配置的 DB_NAME
-        cursor.execute(f"""
-            SELECT 1 FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = ? AND TABLE_CATALOG = ?
-        """, (table_name, db_name_for_checks))
-        if not cursor.fetchone():
+        if not table_exists(cursor, table_name):
              current_app.logger.error(f"Table '{table_name}' not found for schema update in db '{db_name_for_checks}'.")
              abort(404, description=f"Table '{table_name}' not found. Cannot update schema.")
 
-        required_item_ids = []
-        collect_items(form_json.get('Elements', []), required_item_ids)
+        # 補建巡檢紀錄查詢所需的索引 (舊資料表可能尚未建立)
+        created_indexes = _ensure_record_indexes(cursor, table_name, storage_options, catalog_changes)
+
+        compiled = get_compiled_schema(form_json)
         
-        if not required_item_ids:
+        # 沒有任何項目時不做比對，避免解析失敗的空白結構刪除所有欄位
+        if not compiled.item_ids and storage_options is None:
+            commit_catalog_changes()
             current_app.logger.info(f"No items in formJson for '{table_name}'. No schema changes.")
-            return {"message": "No items in JSON, no schema changes.", "added_columns": []}
-
-        # 查詢 INFORMATION_SCHEMA.COLUMNS 時，TABLE_CATALOG 使用配置的 DB_NAME
-        cursor.execute(f"""
-            SELECT COLUMN_NAME 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_SCHEMA = 'dbo' AND TABLE_NAME = ? 
-            AND COLUMN_NAME LIKE 'Item[0-9]%' AND COLUMN_NAME NOT LIKE '%_Remark'
-            AND TABLE_CATALOG = ?
-        """, (table_name, db_name_for_checks))
-        existing_item_columns = {row[0] for row in cursor.fetchall()}
-        
-        columns_to_add_sql = []
-        added_column_names_log = []
-        for item_id in required_item_ids:
-            col_name = f"Item{item_id}"
-            remark_col_name = f"Item{item_id}_Remark"
-            if col_name not in existing_item_columns:
-                columns_to_add_sql.append(f"[{col_name}] [nvarchar](max) NULL")
-                columns_to_add_sql.append(f"[{remark_col_name}] [nvarchar](max) NULL")
-                added_column_names_log.extend([col_name, remark_col_name])
-
-        if columns_to_add_sql:
-            # ALTER TABLE 在當前資料庫執行
-            alter_sql = f"ALTER TABLE [dbo].[{table_name}] ADD {', '.join(columns_to_add_sql)}"
-            current_app.logger.info(f"Executing schema update for {table_name}: Adding {added_column_names_log}")
-            cursor.execute(alter_sql)
-            if not existing_cursor: db.commit()
-            current_app.logger.info(f"Successfully added columns to {table_name}: {added_column_names_log}")
+            return {"message": "No items in JSON, no schema changes.", "added_columns": [], "created_indexes": created_indexes}
+
+        previous = None
+        if isinstance(previous_form_json, (dict, str)):
+            previous = get_compiled_schema(previous_form_json)
+        # 只調整儲存選項 (沒有任何項目) 時不移除既有欄位
+        plan = plan_schema_changes(cursor, table_name, compiled, previous, storage_options,
+                                   drop_removed=drop_removed and bool(compiled.item_ids), only_items=only_items)
+
+        # 先讓既有資料表符合儲存選項，之後新增的欄位才能使用相同的設定
+        storage_changes = []
+        if storage_options is not None:
+            storage_changes = _apply_storage_options(cursor, plan["tables"], storage_options, catalog_changes)
+        catalog_changes.extend(plan["catalog_changes"])
+
+        added_column_names_log = [name for item_id in plan["added"] for name in (f"Item{item_id}", f"Item{item_id}_Remark")]
+        if plan["statements"]:
+            current_app.logger.info(
+                f"Executing schema migration for {table_name}: added={plan['added']}, removed={plan['removed']}, "
+                f"retyped={[change['id'] for change in plan['retyped']]}, renamed={plan['renamed']}"
+            )
+            cursor.execute(build_migration_batch(plan))
+            commit_catalog_changes()
+            current_app.logger.info(f"Successfully migrated schema of {table_name} in one batch ({len(plan['statements'])} statements)")
         else:
-            current_app.logger.info(f"No new columns needed for table '{table_name}'.")
+            commit_catalog_changes()
+            current_app.logger.info(f"No schema changes needed for table '{table_name}'.")
 
-        return {"message": f"Schema update for {table_name} completed.", "added_columns": added_column_names_log}
+        return {
+            "message": f"Schema update for {table_name} completed.",
+            "added_columns": added_column_names_log,
+            "removed_items": plan["removed"],
+            "retained_items": plan["retained"],
+            "retyped_items": plan["retyped"],
+            "renamed_items": plan["renamed"],
+            "created_indexes": created_indexes,
+            "partition_tables": plan["created_tables"],
+            "storage_changes": storage_changes
+        }
     except Exception as e:
-        if not existing_cursor: db.rollback()
+        if not existing_cursor:
+            db.rollback()
+            invalidate_table_catalog()
         current_app.logger.error(f"Error updating schema for table {table_name}: {str(e)}")
         if existing_cursor: raise e 
         else: abort(500, description=f"Error updating table schema: {str(e)}")
     finally:
-        if not existing_cursor and cursor: cursor.close()
\ No newline at end of file
+        if not existing_cursor and cursor: cursor.close()
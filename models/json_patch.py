@@ -0,0 +1,147 @@
+"""
+JSON Patch (RFC 6902) 與 JSON Pointer (RFC 6901)
+
+用於 PATCH /api/forms/<id>：只上傳變更的操作，而不是整份 formJson。
+apply_json_patch 不會修改傳入的文件 (通常是結構快取中共用的解析結果)。
+"""
+import copy
+
+JSON_PATCH_OPS = ("add", "remove", "replace", "move", "copy", "test")
+
+
+class JsonPatchError(ValueError):
+    """操作格式錯誤、路徑不存在或 test 操作不符"""
+
+
+def parse_pointer(pointer):
+    """將 JSON Pointer 字串拆解為參照符號列表 ("" 表示整份文件)"""
+    if not isinstance(pointer, str):
+        raise JsonPatchError(f"JSON Pointer must be a string: {pointer!r}")
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"JSON Pointer must start with '/': {pointer}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(container, token, allow_end=False):
+    """解析陣列索引；allow_end 時允許 "-" 與 len(container) (新增到結尾)"""
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchError(f"Array index out of range: {token}")
+    return index
+
+
+def _resolve_parent(document, tokens, pointer):
+    """取得路徑最後一個參照符號的上層容器"""
+    node = document
+    for token in tokens[:-1]:
+        if isinstance(node, dict):
+            if token not in node:
+                raise JsonPatchError(f"Path not found: {pointer}")
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_array_index(node, token)]
+        else:
+            raise JsonPatchError(f"Path not found: {pointer}")
+    if not isinstance(node, (dict, list)):
+        raise JsonPatchError(f"Path not found: {pointer}")
+    return node
+
+
+def _get(document, pointer):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return document
+    parent = _resolve_parent(document, tokens, pointer)
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Path not found: {pointer}")
+        return parent[token]
+    return parent[_array_index(parent, token)]
+
+
+def _add(document, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent = _resolve_parent(document, tokens, pointer)
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    else:
+        parent.insert(_array_index(parent, tokens[-1], allow_end=True), value)
+    return document
+
+
+def _remove(document, pointer):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise JsonPatchError("Cannot remove the whole document")
+    parent = _resolve_parent(document, tokens, pointer)
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise JsonPatchError(f"Path not found: {pointer}")
+        return parent.pop(tokens[-1])
+    return parent.pop(_array_index(parent, tokens[-1]))
+
+
+def apply_json_patch(document, operations):
+    """
+    依序套用 JSON Patch 操作並返回結果 (先深層複製，不修改傳入的文件)。
+    任一操作失敗時拋出 JsonPatchError，整份 patch 不生效。
+    """
+    if not isinstance(operations, list):
+        raise JsonPatchError("JSON Patch must be an array of operations")
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in JSON_PATCH_OPS:
+            raise JsonPatchError(f"Invalid JSON Patch operation: {operation!r}")
+        op = operation["op"]
+        if "path" not in operation:
+            raise JsonPatchError(f"Missing 'path' in '{op}' operation")
+        path = operation["path"]
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise JsonPatchError(f"Missing 'value' in '{op}' operation")
+        if op in ("move", "copy") and "from" not in operation:
+            raise JsonPatchError(f"Missing 'from' in '{op}' operation")
+
+        if op == "add":
+            document = _add(document, path, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            _remove(document, path)
+        elif op == "replace":
+            _get(document, path)
+            if parse_pointer(path):
+                _remove(document, path)
+            document = _add(document, path, copy.deepcopy(operation["value"]))
+        elif op == "move":
+            source = operation["from"]
+            if path != source and path.startswith(source + "/"):
+                raise JsonPatchError(f"Cannot move '{source}' into its own child '{path}'")
+            value = _remove(document, source) if parse_pointer(source) else document
+            document = _add(document, path, value)
+        elif op == "copy":
+            document = _add(document, path, copy.deepcopy(_get(document, operation["from"])))
+        elif _get(document, path) != operation["value"]:
+            raise JsonPatchError(f"Test failed at '{path}'")
+    return document
+
+
+def operation_paths(operations):
+    """patch 中所有被讀取或修改的路徑 (path 與 from)"""
+    paths = []
+    for operation in operations:
+        paths.append(operation["path"])
+        if "from" in operation:
+            paths.append(operation["from"])
+    return paths
+
+
+def pointer_overlaps(pointer, other):
+    """兩個 JSON Pointer 是否相同或其中一個是另一個的上層"""
+    return pointer == other or pointer.startswith(other + "/") or other.startswith(pointer + "/") or "" in (pointer, other)
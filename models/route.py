@@ -1,6 +1,8 @@
 import json
 from flask import abort, current_app
 from db import get_db
+from .route_cache import get_route_snapshot, invalidate_route_cache, route_cache_generation, store_route_snapshot
+from .search_index import index_remove, index_upsert, invalidate_search_index, search_ids, search_loader
 
 
 """ SELECT TOP (1000) [RouteId]
@@ -10,20 +12,128 @@ from db import get_db
   FROM [RoutinInspection_dev].[dbo].[Routes] """
 
 
-def get_route_by_id(form_id):
-    """獲取特定巡檢路線"""
+def _route_from_row(row):
+    """將 [Routes] 查詢結果的一列轉為路線字典"""
+    return {
+        "RouteId": row[0],
+        "RouteName": row[1],
+        "BindingTableId": row[2],
+        "BindingTableName": row[3]
+    }
+
+# include=form：以 LEFT JOIN 在同一查詢中取得綁定表單的摘要 (已刪除的表單視為未綁定)
+ROUTE_FORM_SELECT = "r.[RouteId], r.[RouteName], r.[BindingTableId], r.[BindingTableName], t.TableManagerId, t.TableName, t.DisplayName, t.TestMode, t.SchemaVersion, t.SchemaHash"
+ROUTE_FORM_FROM = "[RoutinInspection_dev].[dbo].[Routes] r LEFT JOIN [RoutinInspection_dev].[dbo].[TableManager] t ON t.TableManagerId = r.[BindingTableId] AND t.TestMode != 3"
+
+def _routes_with_forms(cursor, rows, include_items=False):
+    """
+    將 ROUTE_FORM_SELECT 的查詢結果轉為路線字典，form 為綁定表單的摘要 (沒有時為 None)。
+    include_items 時每個表單另外附上扁平項目列表，相同表單只處理一次。
+    """
+    routes = []
+    forms = {}
+    for row in rows:
+        route = _route_from_row(row)
+        if row[4] is not None:
+            route["form"] = {
+                "id": row[4],
+                "dbName": (row[5] or "").strip(),
+                "eFormName": row[6],
+                "mode": row[7],
+                "version": row[8]
+            }
+            forms[row[4]] = row[9]
+        else:
+            route["form"] = None
+        routes.append(route)
+    if include_items and forms:
+        from .table_manager import get_form_item_indexes
+        item_indexes = get_form_item_indexes(cursor, list(forms.items()))
+        for route in routes:
+            if route["form"]:
+                route["form"]["items"] = item_indexes[route["form"]["id"]]
+    return routes
+
+# 路線快照的資料表版本：筆數與最大 RouteId 反映新增與刪除，內容的總和檢查碼反映修改
+# (包含其他 worker 行程與 API 之外的異動)；只回傳一列，比重新載入整表便宜
+ROUTE_VERSION_SQL = """
+    SELECT COUNT_BIG(*), MAX([RouteId]),
+           CHECKSUM_AGG(BINARY_CHECKSUM([RouteId], [RouteName], [BindingTableId], [BindingTableName]))
+    FROM [RoutinInspection_dev].[dbo].[Routes]
+"""
+
+def _load_route_snapshot(cursor):
+    """
+    取得路線快照 (路線列表, RouteId 索引)，未命中時以一次查詢載入整個 [Routes]。
+    每次讀取先以 ROUTE_VERSION_SQL 查詢資料表版本，與快照的版本不同 (其他行程已異動) 時重新載入。
+    資料表超過 ROUTE_CACHE_MAX_ROWS 筆 (設為 0 表示停用快取) 時返回 None，由呼叫端直接查詢資料庫。
+    """
+    max_rows = current_app.config.get('ROUTE_CACHE_MAX_ROWS', 2000)
+    if max_rows <= 0:
+        return None
+    snapshot = get_route_snapshot()
+    if snapshot is not None and snapshot[0] is None:
+        # 資料表過大：過期前不檢查版本也不載入
+        return None
+    cursor.execute(ROUTE_VERSION_SQL)
+    version = tuple(cursor.fetchone() or ())
+    if snapshot is None or snapshot[2] != version:
+        generation = route_cache_generation()
+        # 多取一筆以判斷是否超過上限
+        cursor.execute("SELECT TOP (?) [RouteId], [RouteName], [BindingTableId], [BindingTableName] FROM [RoutinInspection_dev].[dbo].[Routes] ORDER BY RouteId", max_rows + 1)
+        rows = cursor.fetchall()
+        routes = [_route_from_row(row) for row in rows] if len(rows) <= max_rows else None
+        if routes is None:
+            current_app.logger.info(f"Routes table exceeds {max_rows} rows, route cache disabled until next reload")
+        snapshot = store_route_snapshot(routes, current_app.config.get('ROUTE_CACHE_TTL', 300), generation, version)
+    return snapshot[:2] if snapshot[0] is not None else None
+
+def _route_search_text(route_name, binding_table_name):
+    """搜尋索引中的路線文字 (RouteName 與 BindingTableName，以換行分隔避免跨欄位比對)"""
+    return "\n".join(value for value in (route_name, binding_table_name) if value)
+
+@search_loader("routes")
+def _load_route_search_docs(cursor, limit):
+    cursor.execute("SELECT TOP (?) [RouteId], [RouteName], [BindingTableName] FROM [RoutinInspection_dev].[dbo].[Routes]", limit)
+    return [(row[0], _route_search_text(row[1], row[2])) for row in cursor.fetchall()]
+
+def _filter_cached_routes(routes, search=None, mode=None, route_ids=None):
+    """
+    以與 get_all_routes 的 SQL 相同的條件過濾快照中的路線 (搜尋不分大小寫)。
+    route_ids 為搜尋索引找出的 RouteId 集合，提供時取代 search 的逐筆比對。
+    """
+    if route_ids is not None:
+        routes = [route for route in routes if route["RouteId"] in route_ids]
+    elif search:
+        term = search.casefold()
+        routes = [route for route in routes
+                  if term in (route["RouteName"] or "").casefold() or term in (route["BindingTableName"] or "").casefold()]
+    if mode == '1':
+        routes = [route for route in routes if route["BindingTableId"] is not None]
+    elif mode == '0':
+        routes = [route for route in routes if route["BindingTableId"] is None]
+    return routes
+
+def get_route_by_id(form_id, include_form=False, include_items=False):
+    """
+    獲取特定巡檢路線 (優先使用路線快照的 RouteId 索引)。
+    include_form 時以同一查詢 JOIN TableManager 附上綁定表單的摘要 (form)，include_items 另外附上其項目列表。
+    """
     db = get_db()
     cursor = db.cursor()
     try:
+        if include_form or include_items:
+            cursor.execute(f"SELECT {ROUTE_FORM_SELECT} FROM {ROUTE_FORM_FROM} WHERE r.[RouteId] = ?", form_id)
+            row = cursor.fetchone()
+            return _routes_with_forms(cursor, [row], include_items)[0] if row else None
+        snapshot = _load_route_snapshot(cursor)
+        if snapshot is not None:
+            route = snapshot[1].get(form_id)
+            return dict(route) if route else None
         cursor.execute("SELECT TOP (1000) [RouteId], [RouteName], [BindingTableId], [BindingTableName] FROM [RoutinInspection_dev].[dbo].[Routes] WHERE RouteId = ?", form_id)
         row = cursor.fetchone()
         if row:
-            return {
-                "RouteId": row[0],
-                "RouteName": row[1],
-                "BindingTableId": row[2],
-                "BindingTableName": row[3]
-            }
+            return _route_from_row(row)
         else:
             return None
     except Exception as e:
@@ -32,8 +142,14 @@ def get_route_by_id(form_id):
     finally:
         cursor.close()
 
-def get_all_routes(page=1, limit=10, search=None, mode=None):
-    """獲取所有巡檢路線，支援分頁、搜尋和模式過濾"""
+def get_all_routes(page=1, limit=10, search=None, mode=None, include_form=False, include_items=False):
+    """
+    獲取所有巡檢路線，支援分頁、搜尋和模式過濾。
+    資料表不超過 ROUTE_CACHE_MAX_ROWS 筆時由路線快照過濾與分頁，否則查詢資料庫。
+    include_form 時在資料查詢中 JOIN TableManager，每條路線附上綁定表單的摘要 (form)，
+    include_items 另外附上表單的扁平項目列表，用戶端不需再逐一讀取表單。
+    """
+    include_form = include_form or include_items
     db = get_db()
     cursor = db.cursor()
 
@@ -46,7 +162,7 @@ def get_all_routes(page=1, limit=10, search=None, mode=None):
     where_clauses = []
 
     if search:
-        # 假設搜尋適用於 RouteName 和 BindingTableName
+        # 搜尋適用於 RouteName 和 BindingTableName；搜尋索引可用時改以索引找出的 RouteId 過濾 (見下方)
         where_clauses.append("([RouteName] LIKE ? OR [BindingTableName] LIKE ?)")
         search_like_term = f"%{search}%"
         filter_params.extend([search_like_term, search_like_term])
@@ -70,15 +186,32 @@ def get_all_routes(page=1, limit=10, search=None, mode=None):
         else:
             current_app.logger.warning(f"未處理的 mode 參數值: '{mode}'。將忽略 mode 過濾。")
 
-
-    where_string = ""
-    if where_clauses:
-        where_string = " WHERE " + " AND ".join(where_clauses)
-
     total_records = 0
     routes = []
 
     try:
+        matched_ids = search_ids("routes", search, cursor) if search else None
+        if matched_ids is not None:
+            if not matched_ids:
+                return {"routes": [], "total_records": 0}
+            # 以索引結果取代 LIKE '%term%' 的全表掃描 (OPENJSON 不受參數個數上限限制)
+            where_clauses[0] = "[RouteId] IN (SELECT CAST([value] AS int) FROM OPENJSON(?))"
+            filter_params[:2] = [json.dumps(sorted(matched_ids))]
+
+        where_string = ""
+        if where_clauses:
+            where_string = " WHERE " + " AND ".join(where_clauses)
+
+        # 表單摘要隨表單變更，不在路線快照中，因此 include_form 時一律查詢資料庫
+        snapshot = None if include_form else _load_route_snapshot(cursor)
+        if snapshot is not None:
+            matched = _filter_cached_routes(snapshot[0], search, mode, matched_ids)
+            offset = (page - 1) * limit
+            return {
+                "routes": [dict(route) for route in matched[offset:offset + limit]],
+                "total_records": len(matched)
+            }
+
         # 首先，獲取符合過濾條件的總記錄數
         count_sql = f"SELECT COUNT(*) FROM {from_table}{where_string}"
         current_app.logger.debug(f"執行計數查詢: {count_sql}，參數: {filter_params}")
@@ -96,7 +229,11 @@ def get_all_routes(page=1, limit=10, search=None, mode=None):
         # SQL Server 2012+ 的正確分頁語法
         pagination_clause = "OFFSET ? ROWS FETCH NEXT ? ROWS ONLY"
         
-        data_sql = f"SELECT {select_fields} FROM {from_table}{where_string} {order_by_clause} {pagination_clause}"
+        if include_form:
+            # 計數不需要 JOIN (TableManagerId 為主鍵，LEFT JOIN 不改變筆數)
+            data_sql = f"SELECT {ROUTE_FORM_SELECT} FROM {ROUTE_FORM_FROM}{where_string} {order_by_clause} {pagination_clause}"
+        else:
+            data_sql = f"SELECT {select_fields} FROM {from_table}{where_string} {order_by_clause} {pagination_clause}"
         
         # 資料查詢的參數是 filter_params 加上分頁參數
         data_params = filter_params + [offset, limit]
@@ -105,13 +242,11 @@ def get_all_routes(page=1, limit=10, search=None, mode=None):
         cursor.execute(data_sql, *data_params) # 使用 * 解包參數列表
         
         rows = cursor.fetchall()
-        for row in rows:
-            routes.append({
-                "RouteId": row[0],
-                "RouteName": row[1],
-                "BindingTableId": row[2], # 如果可為 null，則可能為 None
-                "BindingTableName": row[3] # 如果可為 null，則可能為 None
-            })
+        if include_form:
+            routes = _routes_with_forms(cursor, rows, include_items)
+        else:
+            for row in rows:
+                routes.append(_route_from_row(row)) # BindingTableId、BindingTableName 可能為 None
             
         return {
             "routes": routes,
@@ -131,9 +266,15 @@ def create_route(data):
     db = get_db()
     cursor = db.cursor()
     try:
-        cursor.execute("INSERT INTO [RoutinInspection_dev].[dbo].[Routes] ([RouteName], [BindingTableId], [BindingTableName]) VALUES (?, ?, ?)",
+        cursor.execute("INSERT INTO [RoutinInspection_dev].[dbo].[Routes] ([RouteName], [BindingTableId], [BindingTableName]) OUTPUT inserted.[RouteId] VALUES (?, ?, ?)",
                        data['RouteName'], data['BindingTableId'], data['BindingTableName'])
+        inserted = cursor.fetchone()
         db.commit()
+        invalidate_route_cache()
+        if inserted:
+            index_upsert("routes", inserted[0], _route_search_text(data['RouteName'], data['BindingTableName']))
+        else:
+            invalidate_search_index("routes")
         return {
             "success": True,
             "message": "路線創建成功"
@@ -152,7 +293,11 @@ def update_route(route_id, data):
     try:
         cursor.execute("UPDATE [RoutinInspection_dev].[dbo].[Routes] SET [RouteName] = ?, [BindingTableId] = ?, [BindingTableName] = ? WHERE RouteId = ?",
                        data['RouteName'], data['BindingTableId'], data['BindingTableName'], route_id)
+        updated = cursor.rowcount
         db.commit()
+        invalidate_route_cache()
+        if updated > 0:
+            index_upsert("routes", route_id, _route_search_text(data['RouteName'], data['BindingTableName']))
         return {
             "success": True,
             "message": "路線更新成功"
@@ -171,6 +316,8 @@ def delete_route(route_id):
     try:
         cursor.execute("DELETE FROM [RoutinInspection_dev].[dbo].[Routes] WHERE RouteId = ?", route_id)
         db.commit()
+        invalidate_route_cache()
+        index_remove("routes", route_id)
         return {
             "success": True,
             "message": "路線刪除成功"
@@ -180,4 +327,170 @@ def delete_route(route_id):
         db.rollback()
         abort(500)
     finally:
-        cursor.close()
\ No newline at end of file
+        cursor.close()
+
+# POST /api/routes/bulk：所有操作先以 fast_executemany 寫入暫存資料表，
+# 再以一個 MERGE (新增/更新) 與一個 DELETE 套用，OUTPUT 記錄每個操作實際影響的 RouteId
+ROUTE_BULK_STAGING_SQL = """
+    IF OBJECT_ID('tempdb..#RouteBulk') IS NOT NULL DROP TABLE #RouteBulk;
+    CREATE TABLE #RouteBulk (
+        Seq int NOT NULL PRIMARY KEY,
+        Op char(1) NOT NULL,
+        RouteId int NULL,
+        RouteName nvarchar(4000) NULL,
+        BindingTableId int NULL,
+        BindingTableName nvarchar(4000) NULL
+    );
+"""
+ROUTE_BULK_APPLY_SQL = """
+    SET NOCOUNT ON;
+    DECLARE @applied TABLE (Seq int, RouteId int);
+    MERGE [RoutinInspection_dev].[dbo].[Routes] AS r
+    USING (SELECT * FROM #RouteBulk WHERE Op = 'U') AS b
+    ON r.[RouteId] = b.RouteId
+    WHEN MATCHED THEN
+        UPDATE SET r.[RouteName] = b.RouteName, r.[BindingTableId] = b.BindingTableId, r.[BindingTableName] = b.BindingTableName
+    WHEN NOT MATCHED BY TARGET AND b.RouteId IS NULL THEN
+        INSERT ([RouteName], [BindingTableId], [BindingTableName]) VALUES (b.RouteName, b.BindingTableId, b.BindingTableName)
+    OUTPUT b.Seq, inserted.[RouteId] INTO @applied;
+    DELETE r
+    OUTPUT b.Seq, deleted.[RouteId] INTO @applied
+    FROM [RoutinInspection_dev].[dbo].[Routes] AS r
+    JOIN #RouteBulk AS b ON b.RouteId = r.[RouteId] AND b.Op = 'D';
+    DROP TABLE #RouteBulk;
+    SELECT Seq, RouteId FROM @applied;
+"""
+
+def _validate_bulk_upsert(item):
+    """驗證批次新增/更新的單一路線，返回錯誤訊息列表"""
+    if not isinstance(item, dict):
+        return ["必須是 JSON 物件"]
+    errors = []
+    route_id = item.get('RouteId')
+    if route_id is not None and (not isinstance(route_id, int) or isinstance(route_id, bool)):
+        errors.append("RouteId 必須是整數")
+    if not isinstance(item.get('RouteName'), str) or not item['RouteName'].strip():
+        errors.append("缺少必要字段: RouteName")
+    binding_table_id = item.get('BindingTableId')
+    if binding_table_id is not None and (not isinstance(binding_table_id, int) or isinstance(binding_table_id, bool)):
+        errors.append("BindingTableId 必須是整數或 null")
+    if item.get('BindingTableName') is not None and not isinstance(item['BindingTableName'], str):
+        errors.append("BindingTableName 必須是字串或 null")
+    return errors
+
+def bulk_apply_routes(upserts=None, deletes=None):
+    """
+    在同一交易中批次新增、更新與刪除巡檢路線。
+    upserts 中帶 RouteId 的項目為更新，其餘為新增；deletes 為要刪除的 RouteId 列表。
+    任一項目驗證失敗時不寫入，返回 {"success": False, "errors": [...]}；
+    否則返回每個項目的結果 (created / updated / deleted / not_found)，路線快取在提交後只失效一次。
+    """
+    upserts = upserts or []
+    deletes = deletes or []
+    max_items = current_app.config.get('ROUTES_BULK_MAX', 2000)
+    if not isinstance(upserts, list) or not isinstance(deletes, list):
+        return {"success": False, "errors": [{"index": None, "messages": ["upserts 與 deletes 必須是陣列"]}]}
+    if not upserts and not deletes:
+        return {"success": False, "errors": [{"index": None, "messages": ["請提供至少一個操作"]}]}
+    if len(upserts) + len(deletes) > max_items:
+        return {"success": False, "errors": [{"index": None, "messages": [f"單次最多處理 {max_items} 個操作"]}]}
+
+    errors = []
+    rows = []
+    seen_ids = set()
+    for index, item in enumerate(upserts):
+        item_errors = _validate_bulk_upsert(item)
+        route_id = item.get('RouteId') if isinstance(item, dict) else None
+        if not item_errors and route_id is not None:
+            if route_id in seen_ids:
+                item_errors.append(f"RouteId {route_id} 重複")
+            seen_ids.add(route_id)
+        if item_errors:
+            errors.append({"op": "upsert", "index": index, "messages": item_errors})
+            continue
+        rows.append((len(rows), 'U', route_id, item['RouteName'], item.get('BindingTableId'), item.get('BindingTableName')))
+    for index, route_id in enumerate(deletes):
+        if not isinstance(route_id, int) or isinstance(route_id, bool):
+            errors.append({"op": "delete", "index": index, "messages": ["RouteId 必須是整數"]})
+        elif route_id in seen_ids:
+            errors.append({"op": "delete", "index": index, "messages": [f"RouteId {route_id} 重複"]})
+        else:
+            seen_ids.add(route_id)
+            rows.append((len(rows), 'D', route_id, None, None, None))
+    if errors:
+        return {"success": False, "errors": errors}
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute(ROUTE_BULK_STAGING_SQL)
+        cursor.fast_executemany = True
+        cursor.executemany(
+            "INSERT INTO #RouteBulk (Seq, Op, RouteId, RouteName, BindingTableId, BindingTableName) VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+        cursor.execute(ROUTE_BULK_APPLY_SQL)
+        applied = {seq: route_id for seq, route_id in cursor.fetchall()}
+        db.commit()
+    except Exception as e:
+        current_app.logger.error(f"Error applying bulk route changes: {e}")
+        db.rollback()
+        abort(500, description=f"批次處理路線時發生錯誤: {str(e)}")
+    finally:
+        cursor.close()
+    invalidate_route_cache()
+
+    results = {"upserts": [], "deletes": []}
+    for seq, op, route_id, route_name, _, binding_table_name in rows:
+        if op == 'U':
+            status = "not_found" if seq not in applied else ("updated" if route_id is not None else "created")
+            results["upserts"].append({"index": len(results["upserts"]), "RouteId": applied.get(seq, route_id), "status": status})
+            if seq in applied:
+                index_upsert("routes", applied[seq], _route_search_text(route_name, binding_table_name))
+        else:
+            results["deletes"].append({"index": len(results["deletes"]), "RouteId": route_id,
+                                       "status": "deleted" if seq in applied else "not_found"})
+            if seq in applied:
+                index_remove("routes", route_id)
+    current_app.logger.info(f"Applied bulk route changes: {len(applied)} of {len(rows)} operations affected rows")
+    return {"success": True, "results": results}
+
+# Routes.BindingTableName 是 TableManager.TableName 的反正規化副本 (讀取路線時不需 JOIN)；
+# 表單改名或刪除 (TableName 改為 _oldN) 後以單一 set-based UPDATE 同步，只更新不一致的路線
+ROUTE_BINDING_REFRESH_SQL = """
+    UPDATE r
+    SET r.[BindingTableName] = RTRIM(t.TableName)
+    FROM [RoutinInspection_dev].[dbo].[Routes] AS r
+    JOIN [RoutinInspection_dev].[dbo].[TableManager] AS t ON t.TableManagerId = r.[BindingTableId]
+    WHERE (r.[BindingTableName] IS NULL OR r.[BindingTableName] <> RTRIM(t.TableName))
+"""
+
+def refresh_route_bindings(cursor, form_id=None):
+    """
+    以 TableManager 目前的 TableName 更新綁定路線的 BindingTableName，返回更新的路線數。
+    在呼叫端的交易中執行 (不提交)；提交後若有更新，呼叫端需呼叫 invalidate_route_cache() 與 invalidate_search_index("routes")。
+    form_id 為 None 時處理所有路線。
+    """
+    if form_id is None:
+        cursor.execute(ROUTE_BINDING_REFRESH_SQL)
+    else:
+        cursor.execute(ROUTE_BINDING_REFRESH_SQL + " AND t.TableManagerId = ?", form_id)
+    return max(cursor.rowcount, 0)
+
+def reconcile_route_bindings():
+    """修正所有與 TableManager 不一致的 BindingTableName (例如在 API 之外修改的表單)，返回更新的路線數"""
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        updated = refresh_route_bindings(cursor)
+        db.commit()
+    except Exception as e:
+        current_app.logger.error(f"Error reconciling route bindings: {e}")
+        db.rollback()
+        abort(500, description=f"同步路線綁定時發生錯誤: {str(e)}")
+    finally:
+        cursor.close()
+    if updated:
+        invalidate_route_cache()
+        invalidate_search_index("routes")
+    current_app.logger.info(f"Reconciled route bindings: {updated} routes updated")
+    return {"success": True, "updated": updated}
@@ -0,0 +1,57 @@
+"""
+巡檢路線的行程內快取
+
+路線每週只異動幾次，卻在每次巡檢時被讀取，因此保存 [Routes] 的完整快照與 RouteId 索引。
+create_route、update_route、delete_route 提交後立即失效 (只限處理該請求的行程)；
+其他 worker 行程或程式的異動由版本檢查發現：每次讀取先查詢 [Routes] 的版本 (筆數、最大 RouteId 與內容總和檢查碼)，
+與快照記錄的版本不同時重新載入。快照另外在 ROUTE_CACHE_TTL 秒後過期重新載入。
+"""
+import threading
+import time
+
+_route_lock = threading.Lock()
+# (到期時間, 依 RouteId 排序的路線列表, RouteId -> 路線, 載入時的資料表版本)；
+# 路線列表為 None 表示資料表超過 ROUTE_CACHE_MAX_ROWS，不使用快取
+_route_snapshot = None
+# 每次失效加 1；載入期間若已失效，載入的 (可能是舊的) 結果不寫入快取
+_route_generation = 0
+
+
+def get_route_snapshot():
+    """
+    取得 (路線列表, RouteId 索引, 資料表版本)；不存在或已過期時返回 None。
+    資料表過大時路線列表與索引皆為 None。
+    """
+    with _route_lock:
+        snapshot = _route_snapshot
+    if snapshot and snapshot[0] > time.monotonic():
+        return snapshot[1], snapshot[2], snapshot[3]
+    return None
+
+
+def route_cache_generation():
+    """目前的快取世代，載入快照前取得並傳給 store_route_snapshot"""
+    with _route_lock:
+        return _route_generation
+
+
+def store_route_snapshot(routes, ttl_seconds, generation, version=None):
+    """
+    寫入完整的路線快照 (呼叫端不可再修改 routes) 並返回 (路線列表, RouteId 索引, 資料表版本)。
+    routes 為 None 時記錄資料表過大，在過期前不再嘗試載入。
+    version 為載入前查詢的資料表版本；generation 與目前世代不同 (載入期間路線已異動) 時不寫入。
+    """
+    global _route_snapshot
+    routes_by_id = {route["RouteId"]: route for route in routes} if routes is not None else None
+    with _route_lock:
+        if generation == _route_generation:
+            _route_snapshot = (time.monotonic() + ttl_seconds, routes, routes_by_id, version)
+    return routes, routes_by_id, version
+
+
+def invalidate_route_cache():
+    """路線新增、修改或刪除後，清空路線快照"""
+    global _route_snapshot, _route_generation
+    with _route_lock:
+        _route_snapshot = None
+        _route_generation += 1
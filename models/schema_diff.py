@@ -0,0 +1,287 @@
+"""
+user_ 資料表結構比對 (schema diff)
+
+比對編譯後的表單結構 (CompiledSchema) 與實際的主表及 _pN 分割表，
+找出新增、移除、變更型別與更名 (ItemId 變更) 的項目，
+並產生可在單一批次 (一次往返) 中執行的最小遷移語句。
+"""
+import functools
+from flask import abort, current_app
+from db import get_db
+from .ddl_queue import enqueue_ddl_job
+from .form_schema import (
+    DEFAULT_STORAGE_OPTIONS, REMARK_COLUMN_LENGTH, build_item_column_definitions, build_partition_table_sql,
+    get_compiled_schema, get_form_table_name, get_items_per_table, get_partition_table_name,
+    _item_catalog_columns, _partition_number
+)
+from .table_catalog import get_table_family, load_table_catalog
+from .table_manager import get_form_schema
+
+
+def get_item_columns(cursor, table_name):
+    """
+    由 table catalog 取得主表與分割表的 Item 欄位定義。
+    返回 (依編號排序的 [(編號, 資料表名稱)], {項目 ID: {"table", "sql_type", "sparse", "has_remark"}})。
+    """
+    tables = {1: table_name}
+    columns = {}
+    remarks = set()
+    for table in get_table_family(cursor, table_name):
+        partition_table = table["name"]
+        number = _partition_number(table_name, partition_table)
+        if number is None:
+            continue
+        tables.setdefault(number, partition_table)
+        for column in table["columns"].values():
+            column_name = column["name"]
+            if not column_name.startswith("Item"):
+                continue
+            is_remark = column_name.endswith("_Remark")
+            raw_id = column_name[4:-len("_Remark")] if is_remark else column_name[4:]
+            if not raw_id.isdigit():
+                continue
+            if is_remark:
+                remarks.add(int(raw_id))
+                continue
+            columns[int(raw_id)] = {
+                "table": partition_table,
+                "sql_type": column["sql_type"],
+                "sparse": column["sparse"],
+            }
+    for item_id, column in columns.items():
+        column["has_remark"] = item_id in remarks
+    return [(number, tables[number]) for number in sorted(tables)], columns
+
+
+def _match_renames(compiled, previous, live_columns):
+    """
+    依前一版表單結構找出 ItemId 變更的項目：
+    已不在新結構中的舊項目，若新結構中恰好有一個標籤與類型相同的新項目，視為更名。
+    返回 {舊項目 ID: 新項目}。
+    """
+    if previous is None:
+        return {}
+    new_items = [item for item in compiled.items if item["id"] not in live_columns]
+    renames = {}
+    claimed = set()
+    for item_id in live_columns:
+        if item_id in compiled.items_by_id or item_id not in previous.items_by_id:
+            continue
+        old_item = previous.items_by_id[item_id]
+        if old_item["label"] is None:
+            continue
+        candidates = [
+            item for item in new_items
+            if item["id"] not in claimed and (item["label"], item["type"]) == (old_item["label"], old_item["type"])
+        ]
+        if len(candidates) == 1:
+            renames[item_id] = candidates[0]
+            claimed.add(candidates[0]["id"])
+    return renames
+
+
+def plan_schema_changes(cursor, table_name, compiled, previous=None, storage_options=None, drop_removed=True,
+                        only_items=None):
+    """
+    比對表單結構與實際資料表，返回遷移計畫 (不執行)：
+    {"table_name", "added", "removed", "retained", "retyped", "renamed", "created_tables", "statements", "tables",
+     "catalog_changes"}。
+    previous 為前一版的 CompiledSchema，用於辨識 ItemId 變更 (更名) 以保留資料；
+    drop_removed 為 False 時不移除已不在表單中的項目欄位 (保留巡檢紀錄)，這些項目列在 retained；
+    only_items 為項目 ID 集合時只比對這些項目 (例如 JSON Patch 修改到的項目)，其餘欄位維持不變。
+    語句依 變更型別 -> 更名 -> 移除 -> 新增 -> 建立分割表 的順序排列，可直接組成單一批次。
+    """
+    def in_scope(item_id):
+        return only_items is None or item_id in only_items
+
+    tables, live_columns = get_item_columns(cursor, table_name)
+    renames = {
+        old_id: item for old_id, item in _match_renames(compiled, previous, live_columns).items()
+        if in_scope(old_id)
+    }
+    renamed_targets = {item["id"] for item in renames.values()}
+
+    # 未指定儲存選項時，新欄位沿用既有欄位的 SPARSE 設定；有指定時既有欄位也會調整為該設定
+    sparse_override = storage_options["sparse"] if storage_options is not None else None
+    if storage_options is None:
+        sparse = any(column["sparse"] for column in live_columns.values())
+        storage_options = dict(DEFAULT_STORAGE_OPTIONS, sparse=sparse)
+    sparse = storage_options["sparse"]
+
+    plan = {
+        "table_name": table_name,
+        "added": [],
+        "removed": [],
+        "retained": [],
+        "retyped": [],
+        "renamed": [],
+        "created_tables": [],
+        "statements": [],
+        "catalog_changes": []
+    }
+    statements = plan["statements"]
+    # 遷移提交後對 table catalog 的變更
+    changes = plan["catalog_changes"]
+
+    # 1. 變更型別 (以目前的欄位名稱執行，之後再更名)
+    #    有前一版結構且該項目的類型定義未變更時不調整 (例如型別推斷之前建立的 nvarchar(max) 欄位)，
+    #    避免每次儲存都轉換既有資料
+    for item_id, column in live_columns.items():
+        item = compiled.items_by_id.get(item_id) or renames.get(item_id)
+        if item is None or item["sql_type"] == column["sql_type"] or not in_scope(item_id):
+            continue
+        previous_item = previous.items_by_id.get(item_id) if previous is not None else None
+        if previous_item is not None and previous_item["sql_type"] == item["sql_type"]:
+            continue
+        column_sparse = column["sparse"] if sparse_override is None else sparse_override
+        null_spec = "SPARSE NULL" if column_sparse else "NULL"
+        statements.append(f"ALTER TABLE [dbo].[{column['table']}] ALTER COLUMN [Item{item_id}] {item['sql_type']} {null_spec};")
+        changes.append(("alter_column", column["table"], f"Item{item_id}", item["sql_type"], column_sparse))
+        plan["retyped"].append({"id": item["id"], "from": column["sql_type"], "to": item["sql_type"]})
+
+    # 2. 更名 (ItemId 變更)，保留原有資料
+    for old_id, item in renames.items():
+        table = live_columns[old_id]["table"]
+        statements.append(f"EXEC sp_rename N'[dbo].[{table}].[Item{old_id}]', N'Item{item['id']}', 'COLUMN';")
+        changes.append(("rename_column", table, f"Item{old_id}", f"Item{item['id']}"))
+        if live_columns[old_id]["has_remark"]:
+            statements.append(f"EXEC sp_rename N'[dbo].[{table}].[Item{old_id}_Remark]', N'Item{item['id']}_Remark', 'COLUMN';")
+            changes.append(("rename_column", table, f"Item{old_id}_Remark", f"Item{item['id']}_Remark"))
+        plan["renamed"].append({"from": old_id, "to": item["id"]})
+
+    # 3. 移除已不在表單中的項目欄位
+    table_counts = {table: 0 for _, table in tables}
+    drops = {}
+    for item_id, column in live_columns.items():
+        if item_id in compiled.items_by_id or item_id in renames or not drop_removed or not in_scope(item_id):
+            table_counts[column["table"]] += 1
+            if item_id not in compiled.items_by_id and item_id not in renames and in_scope(item_id):
+                plan["retained"].append(item_id)
+            continue
+        drops.setdefault(column["table"], []).append(f"[Item{item_id}]")
+        changes.append(("drop_column", column["table"], f"Item{item_id}"))
+        if column["has_remark"]:
+            drops[column["table"]].append(f"[Item{item_id}_Remark]")
+            changes.append(("drop_column", column["table"], f"Item{item_id}_Remark"))
+        plan["removed"].append(item_id)
+    for table, dropped_columns in drops.items():
+        statements.append(f"ALTER TABLE [dbo].[{table}] DROP COLUMN {', '.join(dropped_columns)};")
+
+    # 4. 新增項目：放入第一個仍有空間的資料表，全部額滿時建立下一個分割表
+    items_per_table = get_items_per_table()
+    additions = {}
+    for item_id, column in live_columns.items():
+        # 補上缺少的 Item{n}_Remark 欄位 (更名時以新名稱建立)
+        target_id = renames[item_id]["id"] if item_id in renames else item_id
+        if target_id in compiled.items_by_id and not column["has_remark"] and in_scope(item_id):
+            column_sparse = column["sparse"] if sparse_override is None else sparse_override
+            null_spec = "SPARSE NULL" if column_sparse else "NULL"
+            additions.setdefault(column["table"], []).append(
+                ("column", f"[Item{target_id}_Remark] [nvarchar]({REMARK_COLUMN_LENGTH}) {null_spec}")
+            )
+            changes.append(("add_column", column["table"], f"Item{target_id}_Remark",
+                            f"[nvarchar]({REMARK_COLUMN_LENGTH})", column_sparse))
+    for item in compiled.items:
+        if item["id"] in live_columns or item["id"] in renamed_targets or not in_scope(item["id"]):
+            continue
+        target = next((table for _, table in tables if table_counts[table] < items_per_table), None)
+        if target is None:
+            next_number = tables[-1][0] + 1
+            target = get_partition_table_name(table_name, next_number)
+            tables.append((next_number, target))
+            table_counts[target] = 0
+            plan["created_tables"].append(target)
+        table_counts[target] += 1
+        additions.setdefault(target, []).append(("item", item))
+        plan["added"].append(item["id"])
+
+    for table, entries in additions.items():
+        if table in plan["created_tables"]:
+            continue
+        definitions = []
+        for kind, entry in entries:
+            if kind != "item":
+                definitions.append(entry)
+                continue
+            definitions.extend(build_item_column_definitions(entry, sparse))
+            changes.extend(("add_column", table, column, sql_type, column_sparse)
+                           for column, sql_type, column_sparse in _item_catalog_columns([entry], sparse))
+        statements.append(f"ALTER TABLE [dbo].[{table}] ADD {', '.join(definitions)};")
+
+    # 5. 建立新的分割表
+    for table in plan["created_tables"]:
+        items = [entry for _, entry in additions[table]]
+        statements.append(build_partition_table_sql(table_name, table, items, storage_options).strip() + ";")
+        id_column = f"{table_name}Id"
+        changes.append(("create_table", table, table_name,
+                        [(id_column, "[int]", False)] + _item_catalog_columns(items, sparse),
+                        [id_column], storage_options["compression"]))
+
+    plan["tables"] = [table for _, table in tables if table not in plan["created_tables"]]
+    return plan
+
+
+def build_migration_batch(plan):
+    """將遷移計畫組成單一批次；XACT_ABORT 讓任何錯誤都中止並回復整個批次"""
+    if not plan["statements"]:
+        return ""
+    return "\n".join(["SET XACT_ABORT ON;"] + plan["statements"])
+
+
+def plan_form_table_migration(form_id, form_json=None, drop_removed=False):
+    """
+    產生表單資料表的遷移計畫 (dry-run，不執行)。
+    form_json 為擬更新的表單結構，未提供時比對目前儲存的結構與實際資料表 (例如找出遺留的欄位)。
+    drop_removed 與 migrate_form_table 相同：預設保留已不在表單中的項目欄位 (列在 retained)，
+    為 True 時列在 removed 並產生 DROP COLUMN；計畫中的 dropRemoved 為採用的設定。
+    比對前重新載入 table catalog，不使用可能過期 (其他 worker 行程執行過 DDL) 的快取。
+    返回 None (表單不存在) 或遷移計畫 (含 "sql" 批次內容)。
+    """
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+    stored_json = form["formJson"] if isinstance(form["formJson"], dict) else None
+    target_json = form_json if form_json is not None else stored_json
+    if not isinstance(target_json, dict):
+        abort(400, description="formJson must be a valid JSON object.")
+
+    compiled = get_compiled_schema(target_json)
+    previous = get_compiled_schema(stored_json, content_hash=form["schemaHash"]) if stored_json is not None else None
+    table_name = get_form_table_name(form["formIdentifier"])
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        load_table_catalog(cursor)
+        plan = plan_schema_changes(cursor, table_name, compiled, previous, drop_removed=drop_removed)
+        plan["sql"] = build_migration_batch(plan)
+        plan["dropRemoved"] = drop_removed
+        # dry-run 不會變更 catalog
+        plan.pop("catalog_changes")
+        return plan
+    except Exception as e:
+        current_app.logger.error(f"Error planning schema migration for '{table_name}': {str(e)}")
+        abort(500, description=f"Error planning schema migration: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def migrate_form_table(form_id, drop_removed=False):
+    """
+    讓表單的 user_ 資料表符合目前儲存的表單結構，遷移以單一批次執行。
+    與 plan_form_table_migration 相同，以儲存的結構作為前一版，兩者產生相同的語句。
+    已不在表單中的項目欄位 (連同其巡檢紀錄) 只在 drop_removed=True 時移除。
+    遷移由 DDL 佇列執行 (與其他 DDL 依序執行，並以最新的 table catalog 比對) 並等待完成。
+    返回 None (表單不存在) 或工作狀態 (result 為 update_form_table_schema 的結果)。
+    """
+    from .form_schema import update_form_table_schema
+
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+    if not isinstance(form["formJson"], dict):
+        abort(400, description=f"Form definition {form_id} has no valid schema.")
+    migrate = functools.partial(update_form_table_schema, previous_form_json=form["formJson"],
+                                drop_removed=drop_removed)
+    return enqueue_ddl_job("migrate_schema", form_id, migrate, form["formIdentifier"], form["formJson"], wait=True)
@@ -0,0 +1,190 @@
+"""
+路線、表單與使用者即時搜尋的行程內 n-gram 反向索引
+
+每個文件的文字 (不分大小寫) 拆成長度 1 到 NGRAM_SIZE 的所有子字串作為索引鍵。
+查詢字串不超過 NGRAM_SIZE 個字元時 (例如兩個字的中文名稱) 直接查表；
+較長的查詢取各個 trigram 的文件集合交集後再以子字串比對確認，不需掃描整個資料表。
+
+索引在啟動時 (rebuild_search_indexes) 或第一次搜尋時以一次查詢載入，寫入時逐筆更新；
+另外在 SEARCH_INDEX_TTL 秒後重新載入，涵蓋在 API 之外以及其他 worker 行程的修改。
+文件數超過 SEARCH_INDEX_MAX_DOCS (設為 0 表示停用) 時不建立索引，search_ids 返回 None，
+由呼叫端改用原本的查詢方式。
+"""
+import threading
+import time
+from flask import current_app
+from db import get_db
+
+NGRAM_SIZE = 3
+
+# 索引名稱 -> 載入函數 loader(cursor, limit)，返回最多 limit 筆 (文件 ID, 文字)
+_loaders = {}
+
+
+def _ngrams(text):
+    return {text[start:start + size] for size in range(1, NGRAM_SIZE + 1) for start in range(len(text) - size + 1)}
+
+
+class NgramIndex:
+    """單一實體的 n-gram 反向索引 (執行緒安全)"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._postings = {}  # n-gram -> 文件 ID 集合
+        self._texts = {}  # 文件 ID -> 正規化後的文字
+        self._expires_at = None  # None 表示尚未載入
+        self._oversized = False
+        # 每次寫入或失效加 1；載入期間有寫入時，載入的 (可能是舊的) 結果不保存
+        self.generation = 0
+
+    @staticmethod
+    def normalize(text):
+        return (text or "").casefold()
+
+    def _add(self, doc_id, text):
+        self._texts[doc_id] = text
+        for gram in _ngrams(text):
+            self._postings.setdefault(gram, set()).add(doc_id)
+
+    def _discard(self, doc_id):
+        text = self._texts.pop(doc_id, None)
+        if text is None:
+            return
+        for gram in _ngrams(text):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def is_fresh(self):
+        """索引已載入且未過期"""
+        with self._lock:
+            return self._expires_at is not None and self._expires_at > time.monotonic()
+
+    def load(self, docs, ttl_seconds, generation):
+        """
+        以 (文件 ID, 文字) 列表重建索引；docs 為 None 表示文件數超過上限。
+        generation 與目前世代不同 (載入期間有寫入) 時不保存並返回 False。
+        """
+        with self._lock:
+            if generation != self.generation:
+                return False
+            self._postings = {}
+            self._texts = {}
+            self._oversized = docs is None
+            for doc_id, text in docs or ():
+                self._add(doc_id, self.normalize(text))
+            self._expires_at = time.monotonic() + ttl_seconds
+            return True
+
+    def upsert(self, doc_id, text):
+        """新增或更新一個文件 (索引尚未載入時只遞增世代)"""
+        with self._lock:
+            self.generation += 1
+            if self._expires_at is None or self._oversized:
+                return
+            self._discard(doc_id)
+            self._add(doc_id, self.normalize(text))
+
+    def remove(self, doc_id):
+        """移除一個文件"""
+        with self._lock:
+            self.generation += 1
+            self._discard(doc_id)
+
+    def invalidate(self):
+        """清空索引，下次搜尋時重新載入 (用於無法逐筆更新的批次修改)"""
+        with self._lock:
+            self.generation += 1
+            self._postings = {}
+            self._texts = {}
+            self._expires_at = None
+            self._oversized = False
+
+    def search(self, query):
+        """返回文字包含 query 的文件 ID 集合；索引未載入或文件數超過上限時返回 None"""
+        term = self.normalize(query)
+        with self._lock:
+            if self._expires_at is None or self._oversized:
+                return None
+            if not term:
+                return set(self._texts)
+            if len(term) <= NGRAM_SIZE:
+                return set(self._postings.get(term, ()))
+            postings = sorted(
+                (self._postings.get(term[start:start + NGRAM_SIZE], set()) for start in range(len(term) - NGRAM_SIZE + 1)),
+                key=len
+            )
+            candidates = postings[0].intersection(*postings[1:])
+            return {doc_id for doc_id in candidates if term in self._texts[doc_id]}
+
+
+_indexes = {name: NgramIndex(name) for name in ("routes", "forms", "users")}
+
+
+def search_loader(name):
+    """註冊索引的載入函數 (裝飾器)：loader(cursor, limit) 返回最多 limit 筆 (文件 ID, 文字)"""
+    def register(loader):
+        _loaders[name] = loader
+        return loader
+    return register
+
+
+def _load_index(name, cursor, max_docs):
+    """以註冊的載入函數重建索引，返回是否已保存"""
+    index = _indexes[name]
+    generation = index.generation
+    # 多取一筆以判斷是否超過上限
+    docs = _loaders[name](cursor, max_docs + 1)
+    if len(docs) > max_docs:
+        current_app.logger.info(f"Search index '{name}' exceeds {max_docs} documents, falling back to queries")
+        docs = None
+    return index.load(docs, current_app.config.get('SEARCH_INDEX_TTL', 60), generation)
+
+
+def search_ids(name, query, cursor):
+    """
+    返回文字包含 query (不分大小寫) 的文件 ID 集合。
+    索引尚未載入或已過期時以 cursor 載入；索引停用、文件數超過上限或載入期間有寫入時返回 None。
+    """
+    max_docs = current_app.config.get('SEARCH_INDEX_MAX_DOCS', 100000)
+    if max_docs <= 0:
+        return None
+    index = _indexes[name]
+    if not index.is_fresh() and not _load_index(name, cursor, max_docs):
+        return None
+    return index.search(query)
+
+
+def index_upsert(name, doc_id, text):
+    """寫入後更新索引中的單一文件"""
+    _indexes[name].upsert(doc_id, text)
+
+
+def index_remove(name, doc_id):
+    """刪除後從索引移除單一文件"""
+    _indexes[name].remove(doc_id)
+
+
+def invalidate_search_index(name=None):
+    """清空指定索引 (name 為 None 時清空全部)，下次搜尋時重新載入"""
+    for index_name, index in _indexes.items():
+        if name is None or index_name == name:
+            index.invalidate()
+
+
+def rebuild_search_indexes():
+    """啟動時載入所有已註冊的索引 (需在 app context 中執行)"""
+    max_docs = current_app.config.get('SEARCH_INDEX_MAX_DOCS', 100000)
+    if max_docs <= 0:
+        return
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        for name in _loaders:
+            _load_index(name, cursor, max_docs)
+            current_app.logger.info(f"Search index '{name}' loaded")
+    finally:
+        cursor.close()
@@ -0,0 +1,256 @@
+"""
+user_ 資料表的中繼資料快取 (table catalog)
+
+以一次往返 (兩個結果集) 從 sys.tables / sys.columns / sys.foreign_keys / sys.partitions / sys.indexes
+載入所有 user_% 資料表的欄位定義、分割表關係、資料壓縮設定與索引的第一個鍵欄位。
+應用程式執行 DDL 並提交後以 apply_catalog_changes 就地更新，並依 TABLE_CATALOG_TTL 定期重新載入
+(以反映應用程式以外的變更)，結構相關的操作不必每次再查詢 INFORMATION_SCHEMA。
+catalog 中找不到資料表時以 OBJECT_ID 確認，資料表存在時重新載入：多個 worker 行程時，
+DDL 只會更新執行它的行程的 catalog，其他行程的快取可能尚未包含剛建立或改名的資料表。
+欄位定義同樣可能過期，因此 DDL 工作 (見 ddl_queue) 與遷移計畫在比對結構前會以 load_table_catalog 重新載入，
+不依賴 TTL 內的快取。
+"""
+import threading
+import time
+from flask import current_app
+
+CATALOG_LOAD_SQL = """
+    SELECT t.name, c.name, TYPE_NAME(c.user_type_id), c.max_length, c.precision, c.scale, c.is_sparse,
+           OBJECT_NAME(fk.referenced_object_id), p.data_compression_desc
+    FROM sys.tables t
+    JOIN sys.columns c ON c.object_id = t.object_id
+    OUTER APPLY (SELECT TOP (1) f.referenced_object_id FROM sys.foreign_keys f
+                 WHERE f.parent_object_id = t.object_id) fk
+    OUTER APPLY (SELECT TOP (1) sp.data_compression_desc FROM sys.partitions sp
+                 WHERE sp.object_id = t.object_id AND sp.index_id IN (0, 1)) p
+    WHERE t.schema_id = SCHEMA_ID('dbo') AND t.name LIKE 'user[_]%'
+    ORDER BY t.name, c.column_id;
+
+    SELECT t.name, COL_NAME(ic.object_id, ic.column_id)
+    FROM sys.tables t
+    JOIN sys.index_columns ic ON ic.object_id = t.object_id AND ic.key_ordinal = 1
+    WHERE t.schema_id = SCHEMA_ID('dbo') AND t.name LIKE 'user[_]%';
+"""
+
+_catalog_lock = threading.Lock()
+# 資料表名稱 (小寫) -> {"name", "columns": {欄位名稱 (小寫): {"name", "sql_type", "sparse"}},
+#                      "references", "compression", "indexed_columns"}
+_catalog_tables = None
+_catalog_loaded_at = 0.0
+
+
+def _live_sql_type(type_name, max_length, precision, scale):
+    """將 sys.columns 的型別資訊轉換為與 CompiledSchema.sql_type 相同的格式 (例如 [nvarchar](255))"""
+    type_name = (type_name or "").lower()
+    if type_name in ("nvarchar", "nchar"):
+        return f"[{type_name}]({'max' if max_length == -1 else max_length // 2})"
+    if type_name in ("varchar", "char", "varbinary", "binary"):
+        return f"[{type_name}]({'max' if max_length == -1 else max_length})"
+    if type_name in ("decimal", "numeric"):
+        return f"[{type_name}]({precision}, {scale})"
+    return f"[{type_name}]"
+
+
+def _new_table(name, references=None, compression="NONE"):
+    return {"name": name, "columns": {}, "references": references,
+            "compression": compression or "NONE", "indexed_columns": set()}
+
+
+def _replace_catalog(column_rows, index_rows):
+    """
+    以查詢結果建立並替換整個 catalog。
+    column_rows 為 (資料表, 欄位, 型別, max_length, precision, scale, is_sparse, 參照的主表, 壓縮設定)，
+    index_rows 為 (資料表, 索引的第一個鍵欄位)。
+    """
+    global _catalog_tables, _catalog_loaded_at
+    tables = {}
+    for table, column, type_name, max_length, precision, scale, is_sparse, references, compression in column_rows:
+        entry = tables.get(table.lower())
+        if entry is None:
+            entry = tables[table.lower()] = _new_table(table, references, compression)
+        entry["columns"][column.lower()] = {
+            "name": column,
+            "sql_type": _live_sql_type(type_name, max_length, precision, scale),
+            "sparse": bool(is_sparse),
+        }
+    for table, column in index_rows:
+        entry = tables.get(table.lower())
+        if entry is not None and column:
+            entry["indexed_columns"].add(column)
+    with _catalog_lock:
+        _catalog_tables = tables
+        _catalog_loaded_at = time.monotonic()
+    return tables
+
+
+def load_table_catalog(cursor):
+    """以一次往返重新載入所有 user_% 資料表的中繼資料"""
+    cursor.execute(CATALOG_LOAD_SQL)
+    column_rows = cursor.fetchall()
+    index_rows = cursor.fetchall() if cursor.nextset() else []
+    tables = _replace_catalog(column_rows, index_rows)
+    current_app.logger.debug(f"Loaded table catalog: {len(tables)} user_ tables")
+    return tables
+
+
+def get_table_catalog(cursor):
+    """取得 catalog (尚未載入或超過 TABLE_CATALOG_TTL 秒時重新載入)；返回的內容不可修改"""
+    ttl_seconds = current_app.config.get('TABLE_CATALOG_TTL', 300)
+    with _catalog_lock:
+        tables = _catalog_tables
+        fresh = tables is not None and time.monotonic() - _catalog_loaded_at < ttl_seconds
+    if fresh:
+        return tables
+    return load_table_catalog(cursor)
+
+
+def _object_exists(cursor, table_name):
+    """以 OBJECT_ID 直接查詢 dbo 資料表是否存在"""
+    cursor.execute("SELECT OBJECT_ID(?, N'U')", (f"[dbo].[{table_name}]",))
+    row = cursor.fetchone()
+    return bool(row and row[0] is not None)
+
+
+def invalidate_table_catalog():
+    """清空 catalog，下次使用時重新載入 (用於無法確定 DDL 結果的情況)"""
+    global _catalog_tables
+    with _catalog_lock:
+        _catalog_tables = None
+
+
+def get_catalog_table(cursor, table_name):
+    """
+    取得單一資料表的中繼資料，不存在時返回 None。
+    catalog 中沒有該資料表但資料庫中存在時 (其他行程剛建立或改名)，重新載入 catalog。
+    """
+    key = table_name.lower()
+    entry = get_table_catalog(cursor).get(key)
+    if entry is None and _object_exists(cursor, table_name):
+        entry = load_table_catalog(cursor).get(key)
+    return entry
+
+
+def table_exists(cursor, table_name):
+    """
+    檢查 dbo 資料表是否存在。
+    catalog 只涵蓋 user_% 資料表，其他名稱直接查詢 OBJECT_ID。
+    """
+    if not table_name.lower().startswith("user_"):
+        return _object_exists(cursor, table_name)
+    return get_catalog_table(cursor, table_name) is not None
+
+
+def get_table_family(cursor, table_name):
+    """返回主表 (若存在) 與以外鍵參照主表的分割表的中繼資料列表 (catalog 中沒有主表時同 get_catalog_table 確認)"""
+    key = table_name.lower()
+    tables = get_table_catalog(cursor)
+    if key not in tables and _object_exists(cursor, table_name):
+        tables = load_table_catalog(cursor)
+    return [
+        entry for name, entry in tables.items()
+        if name == key or (entry["references"] or "").lower() == key
+    ]
+
+
+def find_table_names(cursor, prefix):
+    """返回名稱以 prefix 開頭 (不分大小寫) 的資料表名稱；非 user_ 前綴直接查詢 sys.tables"""
+    if not prefix.lower().startswith("user_"):
+        cursor.execute("SELECT name FROM sys.tables WHERE schema_id = SCHEMA_ID('dbo') AND LEFT(name, ?) = ?",
+                       (len(prefix), prefix))
+        return [row[0] for row in cursor.fetchall()]
+    prefix = prefix.lower()
+    return [entry["name"] for name, entry in get_table_catalog(cursor).items() if name.startswith(prefix)]
+
+
+def apply_catalog_changes(changes):
+    """
+    在 DDL 提交後就地更新 catalog。每個變更為 tuple：
+    ("create_table", 名稱, 參照的主表, [(欄位, 型別, sparse)], [索引欄位], 壓縮設定)、("drop_table", 名稱)、
+    ("rename_table", 舊名稱, 新名稱)、("add_column", 資料表, 欄位, 型別, sparse)、("drop_column", 資料表, 欄位)、
+    ("rename_column", 資料表, 舊名稱, 新名稱)、("alter_column", 資料表, 欄位, 型別或 None, sparse 或 None)、
+    ("add_index", 資料表, 欄位)、("set_compression", 資料表, 壓縮設定)。
+    catalog 尚未載入時忽略 (下次載入即為最新狀態)。
+    """
+    global _catalog_tables
+    if not changes:
+        return
+    with _catalog_lock:
+        if _catalog_tables is None:
+            return
+        # 複製後再替換，讀取中的呼叫端不受影響
+        tables = dict(_catalog_tables)
+        copied = set()
+
+        def editable(table_name):
+            key = table_name.lower()
+            if key not in tables:
+                return None
+            if key not in copied:
+                entry = dict(tables[key])
+                entry["columns"] = {name: dict(column) for name, column in entry["columns"].items()}
+                entry["indexed_columns"] = set(entry["indexed_columns"])
+                tables[key] = entry
+                copied.add(key)
+            return tables[key]
+
+        for change in changes:
+            op = change[0]
+            if op == "create_table":
+                _, name, references, columns, indexed_columns, compression = change
+                entry = _new_table(name, references, compression)
+                for column, sql_type, sparse in columns:
+                    entry["columns"][column.lower()] = {"name": column, "sql_type": sql_type, "sparse": sparse}
+                entry["indexed_columns"].update(indexed_columns)
+                tables[name.lower()] = entry
+                copied.add(name.lower())
+            elif op == "drop_table":
+                tables.pop(change[1].lower(), None)
+                copied.discard(change[1].lower())
+            elif op == "rename_table":
+                entry = editable(change[1])
+                if entry is None:
+                    continue
+                del tables[change[1].lower()]
+                copied.discard(change[1].lower())
+                entry["name"] = change[2]
+                tables[change[2].lower()] = entry
+                copied.add(change[2].lower())
+                # 分割表參照的主表名稱一併更新
+                for key in list(tables):
+                    if (tables[key]["references"] or "").lower() == change[1].lower():
+                        editable(tables[key]["name"])["references"] = change[2]
+            elif op == "add_column":
+                entry = editable(change[1])
+                if entry is not None:
+                    entry["columns"][change[2].lower()] = {"name": change[2], "sql_type": change[3], "sparse": change[4]}
+            elif op == "drop_column":
+                entry = editable(change[1])
+                if entry is not None:
+                    entry["columns"].pop(change[2].lower(), None)
+                    entry["indexed_columns"].discard(change[2])
+            elif op == "rename_column":
+                entry = editable(change[1])
+                if entry is not None and change[2].lower() in entry["columns"]:
+                    column = entry["columns"].pop(change[2].lower())
+                    column["name"] = change[3]
+                    entry["columns"][change[3].lower()] = column
+                    if change[2] in entry["indexed_columns"]:
+                        entry["indexed_columns"].discard(change[2])
+                        entry["indexed_columns"].add(change[3])
+            elif op == "alter_column":
+                entry = editable(change[1])
+                column = entry["columns"].get(change[2].lower()) if entry is not None else None
+                if column is not None:
+                    if change[3] is not None:
+                        column["sql_type"] = change[3]
+                    if change[4] is not None:
+                        column["sparse"] = change[4]
+            elif op == "add_index":
+                entry = editable(change[1])
+                if entry is not None:
+                    entry["indexed_columns"].add(change[2])
+            elif op == "set_compression":
+                entry = editable(change[1])
+                if entry is not None:
+                    entry["compression"] = change[2]
+        _catalog_tables = tables
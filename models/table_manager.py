@@ -1,12 +1,56 @@
+import functools
 import json
 import logging
 from flask import abort, current_app
+from werkzeug.exceptions import HTTPException
 from db import get_db
+from .form_cache import (
+    get_cached_schema, store_cached_schema,
+    schema_content_hash, is_schema_validated, mark_schema_validated,
+    get_department_forms, store_department_forms, invalidate_department_index, department_index_generation
+)
+from .table_catalog import apply_catalog_changes, find_table_names, table_exists
+from .ddl_queue import enqueue_ddl_job
+from .route import refresh_route_bindings
+from .route_cache import invalidate_route_cache
+from .search_index import index_remove, index_upsert, invalidate_search_index, search_ids, search_loader
+
+# 表單結構的內容雜湊，參照 SchemaBlob (內容定址的結構儲存)，也是結構快取的鍵
+SCHEMA_HASH_SQL = "SchemaHash"
+
+# 寫入 SchemaBlob：相同內容只保存一份，已存在時不重複寫入。
+# 參數為 (雜湊, 雜湊, 內容)；放在同一批次中寫入 TableManager 之前執行
+SCHEMA_BLOB_UPSERT_SQL = """
+    IF NOT EXISTS (SELECT 1 FROM SchemaBlob WITH (UPDLOCK, HOLDLOCK) WHERE SchemaHash = ?)
+        INSERT INTO SchemaBlob (SchemaHash, SchemaContent) VALUES (?, ?);
+"""
+
+def _schema_blob_params(schema_content_str, content_hash):
+    """SCHEMA_BLOB_UPSERT_SQL 的參數"""
+    return (content_hash, content_hash, schema_content_str)
+
+def _form_search_text(display_name, table_name):
+    """搜尋索引中的表單文字 (DisplayName 與 TableName，以換行分隔避免跨欄位比對)"""
+    return "\n".join(value for value in (display_name, (table_name or "").strip()) if value)
+
+@search_loader("forms")
+def _load_form_search_docs(cursor, limit):
+    cursor.execute("SELECT TOP (?) TableManagerId, DisplayName, TableName FROM TableManager WHERE TestMode != 3", (limit,))
+    return [(row[0], _form_search_text(row[1], row[2])) for row in cursor.fetchall()]
 
 def add_form(form_data):
-    """添加新表單定義到 TableManager"""
-    db = get_db()
-    cursor = db.cursor()
+    """
+    添加新表單定義到 TableManager，並建立對應的 user_ 資料表。
+    兩者在同一個交易批次中完成 (見 create_form_with_table)，由 DDL 佇列依序執行並等待結果；
+    返回內容的 ddlJob 為該工作的狀態。等待逾時 (DDL_WAIT_TIMEOUT) 時 id 為 None，
+    ddlJob 仍為 queued / running，完成後的表單 ID 在工作結果中。
+    """
+    from .form_schema import normalize_storage_options
+    try:
+        storage_options = normalize_storage_options(form_data.get('storageOptions'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
     try:
         # 處理 formJson: 如果是字串則解析，取得 SchemaContent
         form_json = form_data.get('formJson')
@@ -14,7 +58,9 @@ def add_form(form_data):
             try:
                 form_json = json.loads(form_json)
             except json.JSONDecodeError:
-                form_json = {}
+                abort(400, description="Invalid JSON in formJson for table creation.")
+        if not isinstance(form_json, dict):
+            abort(400, description="formJson must be a valid JSON object.")
         
         # 使用 formJson 或 items 作為 SchemaContent
         schema_content = form_json or form_data.get('items', {})
@@ -23,37 +69,77 @@ def add_form(form_data):
              schema_content = {} # 或其他預設值
         schema_content_str = json.dumps(schema_content)
         
-        cursor.execute("""
-            INSERT INTO TableManager (TableName, DisplayName, SchemaContent, ItemsCnt)
-            VALUES (?, ?, ?, ?)
-        """, (form_data['formIdentifier'], form_data['formDisplayName'], schema_content_str, form_data.get('itemsCnt', 0)))
-        db.commit()
-        # 使用 SELECT @@IDENTITY 來獲取新插入的 ID
-        cursor.execute("SELECT @@IDENTITY AS id")
-        form_id = int(cursor.fetchone()[0])
-        current_app.logger.info(f"Added form definition with ID: {form_id}")
-        
-        # 創建對應的資料表
-        from .form_schema import create_form_table
-        try:
-            create_result = create_form_table(form_data)
-            if not create_result.get("success", False):
-                db.rollback()
-                current_app.logger.error(f"Failed to create table for form ID {form_id}: {create_result.get('message', 'Unknown error')}")
-                abort(500, description=f"Failed to create table: {create_result.get('message', 'Unknown error')}")
-            table_name = create_result.get("table_name", "")
-        except Exception as e:
-            db.rollback()
-            current_app.logger.error(f"Error creating table for form ID {form_id}: {str(e)}")
-            abort(500, description=f"Error creating table: {str(e)}")
+        # 表單 ID 在交易中才產生，工作的 formId 因此為 None
+        create_job = enqueue_ddl_job("create_table", None, create_form_with_table, form_data, form_json,
+                                     schema_content_str, storage_options, wait=True)
+        if create_job["status"] == "failed":
+            abort(500, description=create_job["error"])
+        if create_job["status"] != "succeeded":
+            # 工作仍在佇列中：搜尋索引在下次重新載入時補上新表單
+            invalidate_department_index()
+            return {
+                "id": None,
+                "success": True,
+                "formIdentifier": form_data['formIdentifier'],
+                "formDisplayName": form_data['formDisplayName'],
+                "table_name": None,
+                "version": 1,
+                "ddlJob": create_job
+            }
+        created = create_job["result"]
+        form_id = created["id"]
+        _remember_written_schema(schema_content_str, schema_content)
+        invalidate_department_index()
+        index_upsert("forms", form_id, _form_search_text(form_data['formDisplayName'], form_data['formIdentifier']))
         
         return {
             "id": form_id,
             "success": True,
             "formIdentifier": form_data['formIdentifier'],
             "formDisplayName": form_data['formDisplayName'],
-            "table_name": table_name
+            "table_name": created["table_name"],
+            "version": 1,
+            "ddlJob": create_job
         }
+    except HTTPException:
+        # 無效的 formJson (400) 與建立工作的錯誤保留原本的狀態碼
+        raise
+    except Exception as e:
+        current_app.logger.error(f"Error adding form definition: {str(e)}")
+        abort(500, description=f"Error adding form definition: {str(e)}")
+
+def create_form_with_table(form_data, form_json, schema_content_str, storage_options):
+    """
+    以單一 T-SQL 批次新增 TableManager 紀錄並建立對應的 user_ 資料表 (含索引與分割表)：
+    寫入 SchemaBlob (內容已存在時略過)，INSERT ... OUTPUT 取得新 ID，接著刪除同名舊表並建立新表，最後只提交一次。
+    XACT_ABORT 使任一語句失敗時整個交易回滾，不會留下沒有資料表的表單定義。
+    """
+    from .form_schema import build_form_table_sql, get_compiled_schema
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        table_sql = build_form_table_sql(cursor, form_data['formIdentifier'], get_compiled_schema(form_json), storage_options)
+        content_hash = schema_content_hash(schema_content_str)
+        cursor.execute(f"""
+            SET XACT_ABORT ON;
+            SET NOCOUNT ON;
+            DECLARE @inserted TABLE (TableManagerId int);
+            {SCHEMA_BLOB_UPSERT_SQL}
+            INSERT INTO TableManager (TableName, DisplayName, SchemaHash, ItemsCnt, SparseItems, DataCompression)
+            OUTPUT inserted.TableManagerId INTO @inserted
+            VALUES (?, ?, ?, ?, ?, ?);
+            {table_sql["drop_sql"]};
+            {table_sql["create_sql"]}
+            SET XACT_ABORT OFF;
+            SELECT TableManagerId FROM @inserted;
+        """, _schema_blob_params(schema_content_str, content_hash) + (
+            form_data['formIdentifier'], form_data['formDisplayName'], content_hash,
+            form_data.get('itemsCnt', 0), storage_options['sparse'], storage_options['compression']))
+        form_id = int(cursor.fetchone()[0])
+        db.commit()
+        apply_catalog_changes(table_sql["catalog_changes"])
+        current_app.logger.info(f"Added form definition with ID: {form_id} and created table '{table_sql['table_name']}'")
+        return {"id": form_id, "table_name": table_sql["table_name"], "partition_tables": table_sql["partition_tables"]}
     except Exception as e:
         db.rollback()
         current_app.logger.error(f"Error adding form definition: {str(e)}")
@@ -62,44 +148,182 @@ def add_form(form_data):
         if cursor:
             cursor.close()
 
-def get_all_forms(page=1, limit=10):
-    """獲取所有表單定義，支援分頁，排除TestMode為3的資料"""
+def clone_form(form_id, clone_data):
+    """
+    在伺服器端複製表單：複製 TableManager 紀錄 (共用同一份 SchemaBlob) 並建立新的 user_ 資料表，
+    結構內容不經過用戶端往返。clone_data 包含 formIdentifier (必填)、formDisplayName (預設沿用來源)
+    與 copyRecords (是否一併複製巡檢紀錄)。
+    紀錄複製在新資料表建立後另外加入 DDL 佇列分批執行，返回內容的 copyJob 為該工作的狀態。
+    等待建立工作逾時 (DDL_WAIT_TIMEOUT) 時 id 為 None，ddlJob 仍為 queued / running。
+    來源表單不存在時返回 None。
+    """
+    from .form_schema import get_form_table_name
+    from .form_records import copy_form_records
+
+    form_identifier = (clone_data.get('formIdentifier') or "").strip()
+    if not form_identifier:
+        abort(400, description="formIdentifier is required.")
+    source = get_form_schema(form_id)
+    if not source:
+        return None
+    table_name = get_form_table_name(form_identifier)
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        # 不覆蓋既有資料表 (新增表單會刪除同名舊表，複製時視為衝突)
+        if table_exists(cursor, table_name):
+            abort(409, description=f"Target table name '{table_name}' already exists.")
+    finally:
+        if cursor:
+            cursor.close()
+
+    create_job = enqueue_ddl_job("clone_table", form_id, create_cloned_form_with_table, form_id, source,
+                                 form_identifier, clone_data.get('formDisplayName'), wait=True)
+    if create_job["status"] == "failed":
+        abort(500, description=create_job["error"])
+    if create_job["status"] != "succeeded":
+        # 等待逾時：紀錄複製排在建立工作之後，建立失敗時複製工作也會失敗
+        invalidate_department_index()
+        result = {"id": None, "success": True, "sourceId": form_id, "formIdentifier": form_identifier,
+                  "table_name": table_name, "version": 1, "ddlJob": create_job}
+        if clone_data.get('copyRecords'):
+            result["copyJob"] = enqueue_ddl_job("copy_records", None, copy_form_records,
+                                                get_form_table_name(source["formIdentifier"]), table_name,
+                                                form_identifier)
+        return result
+    created = create_job["result"]
+    invalidate_department_index()
+    index_upsert("forms", created["id"], _form_search_text(created["display_name"], form_identifier))
+
+    result = {
+        "id": created["id"],
+        "success": True,
+        "sourceId": form_id,
+        "formIdentifier": form_identifier,
+        "table_name": created["table_name"],
+        "version": 1,
+        "ddlJob": create_job
+    }
+    if clone_data.get('copyRecords'):
+        result["copyJob"] = enqueue_ddl_job("copy_records", created["id"], copy_form_records,
+                                            get_form_table_name(source["formIdentifier"]), created["table_name"],
+                                            form_identifier)
+    return result
+
+def create_cloned_form_with_table(form_id, source, form_identifier, display_name=None):
+    """
+    以單一 T-SQL 批次複製 TableManager 紀錄 (INSERT ... SELECT，沿用來源的 SchemaHash 與儲存選項) 並建立新的 user_ 資料表。
+    來源紀錄在批次執行前被刪除時以 THROW 中止，整個交易回滾。
+    source 為 get_form_schema 的結果；display_name 為 None 時沿用來源的 DisplayName。
+    """
+    from .form_schema import build_form_table_sql, get_compiled_schema
     db = get_db()
     cursor = db.cursor()
     try:
-        offset = (page - 1) * limit
-        # 確保選取的欄位順序和索引是正確的
         cursor.execute("""
-            SELECT TableManagerId, TableName, SchemaContent, TableName, DisplayName, TestMode 
+            SELECT SparseItems, DataCompression
+            FROM TableManager
+            WHERE TableManagerId = ? AND TestMode != 3
+        """, (form_id,))
+        row = cursor.fetchone()
+        if not row:
+            abort(404, description=f"Form definition with ID {form_id} not found.")
+        storage_options = {"sparse": bool(row[0]), "compression": (row[1] or "NONE").strip().upper()}
+        compiled = get_compiled_schema(source["formJson"] or {}, content_hash=source["schemaHash"])
+        table_sql = build_form_table_sql(cursor, form_identifier, compiled, storage_options)
+        # 不執行 drop_sql：目標資料表若在此期間被建立，CREATE TABLE 失敗並回滾，不會覆蓋既有資料
+        cursor.execute(f"""
+            SET XACT_ABORT ON;
+            SET NOCOUNT ON;
+            DECLARE @inserted TABLE (TableManagerId int, DisplayName nvarchar(max));
+            INSERT INTO TableManager (TableName, DisplayName, SchemaHash, ItemsCnt, SparseItems, DataCompression)
+            OUTPUT inserted.TableManagerId, inserted.DisplayName INTO @inserted
+            SELECT ?, COALESCE(?, DisplayName), SchemaHash, ItemsCnt, SparseItems, DataCompression
+            FROM TableManager
+            WHERE TableManagerId = ? AND TestMode != 3;
+            IF @@ROWCOUNT = 0
+                THROW 50000, 'Source form definition not found.', 1;
+            {table_sql["create_sql"]}
+            SET XACT_ABORT OFF;
+            SELECT TableManagerId, DisplayName FROM @inserted;
+        """, (form_identifier, display_name, form_id))
+        new_id, new_display_name = cursor.fetchone()
+        new_id = int(new_id)
+        db.commit()
+        apply_catalog_changes(table_sql["catalog_changes"])
+        current_app.logger.info(f"Cloned form definition {form_id} as ID {new_id} with table '{table_sql['table_name']}'")
+        return {"id": new_id, "display_name": new_display_name, "table_name": table_sql["table_name"],
+                "partition_tables": table_sql["partition_tables"]}
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error cloning form definition ID {form_id}: {str(e)}")
+        abort(500, description=f"Error cloning form definition: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+# 表單列表可選擇的回應欄位與對應的 TableManager 欄位 (formJson 另外處理)
+FORM_LIST_FIELDS = {
+    "id": "TableManagerId",
+    "dbName": "TableName",
+    "eFormName": "DisplayName",
+    "mode": "TestMode",
+}
+
+def get_all_forms(page=1, limit=10, include_schema=False, fields=None, search=None):
+    """
+    獲取所有表單定義，支援分頁，排除TestMode為3的資料。
+    預設不讀取 SchemaContent；include_schema=True 時才返回 formJson。
+    fields 可指定要返回的欄位 (見 FORM_LIST_FIELDS)，id 一律返回。
+    search 以不分大小寫的子字串比對 DisplayName 與 TableName，優先使用搜尋索引。
+    """
+    selected_fields = [name for name in FORM_LIST_FIELDS if fields is None or name in fields or name == "id"]
+    columns = [FORM_LIST_FIELDS[name] for name in selected_fields]
+    if include_schema:
+        # 只取回 SchemaContent 的雜湊，未命中快取的內容再另外讀取
+        columns.append(SCHEMA_HASH_SQL)
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        offset = (page - 1) * limit
+        where_string = "TestMode != 3"
+        filter_params = ()
+        if search:
+            matched_ids = search_ids("forms", search, cursor)
+            if matched_ids is not None:
+                if not matched_ids:
+                    return {"forms": [], "total": 0}
+                where_string += " AND TableManagerId IN (SELECT CAST([value] AS int) FROM OPENJSON(?))"
+                filter_params = (json.dumps(sorted(matched_ids)),)
+            else:
+                search_like_term = '%' + _escape_like(search) + '%'
+                where_string += " AND (DisplayName LIKE ? ESCAPE '\\' OR TableName LIKE ? ESCAPE '\\')"
+                filter_params = (search_like_term, search_like_term)
+
+        cursor.execute(f"""
+            SELECT {", ".join(columns)}
             FROM TableManager 
-            WHERE TestMode != 3 
+            WHERE {where_string} 
             ORDER BY TableManagerId 
             OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
-        """, (offset, limit))
+        """, filter_params + (offset, limit))
         forms = cursor.fetchall()
         
-        cursor.execute("SELECT COUNT(*) FROM TableManager WHERE TestMode != 3")
+        cursor.execute(f"SELECT COUNT(*) FROM TableManager WHERE {where_string}", filter_params)
         total = cursor.fetchone()[0]
         
-        # 修正索引以匹配 SELECT 查詢
+        schemas = {}
+        if include_schema:
+            schemas = _resolve_schemas(cursor, [(row[0], row[-1]) for row in forms])
+
         result_forms = []
         for row in forms:
-             form_json_str = row[2]
-             form_json_obj = None
-             try:
-                 if form_json_str:
-                      form_json_obj = json.loads(form_json_str)
-             except json.JSONDecodeError:
-                 current_app.logger.warning(f"Could not parse SchemaContent for form ID {row[0]}")
-                 form_json_obj = {} # 或者 None，取決於前端期望
-
-             result_forms.append({
-                 "id": row[0], 
-                 "dbName": row[3], # 使用 TableName 作為 dbName
-                 "eFormName": row[4], # 使用 DisplayName 作為 eFormName
-                 "mode": row[5], 
-                 "formJson": form_json_obj # 返回解析後的 JSON 物件
-             })
+            form = dict(zip(selected_fields, row))
+            if include_schema:
+                form["formJson"] = schemas.get(row[0]) # 返回解析後的 JSON 物件
+            result_forms.append(form)
 
         return {
             "forms": result_forms,
@@ -117,30 +341,21 @@ def get_form_by_id(form_id):
     db = get_db()
     cursor = db.cursor()
     try:
-        # 確保選取的欄位順序和索引是正確的
-        cursor.execute("""
-            SELECT TableManagerId, TableName, SchemaContent, TableName, DisplayName, TestMode 
+        cursor.execute(f"""
+            SELECT TableManagerId, TableName, DisplayName, TestMode, {SCHEMA_HASH_SQL}
             FROM TableManager 
             WHERE TableManagerId = ? AND TestMode != 3
         """, (form_id,))
         form = cursor.fetchone()
         if form:
-            form_json_str = form[2]
-            form_json_obj = None
-            try:
-                if form_json_str:
-                    form_json_obj = json.loads(form_json_str)
-            except json.JSONDecodeError:
-                current_app.logger.warning(f"Could not parse SchemaContent for form ID {form[0]}")
-                form_json_obj = {} # 或 None
-
+            schemas = _resolve_schemas(cursor, [(form[0], form[4])])
             # 返回與 get_all_forms 類似的結構以便前端使用
             return {
                 "id": form[0], 
-                "dbName": form[3], # TableName
-                "eFormName": form[4], # DisplayName
-                "mode": form[5],
-                "formJson": form_json_obj # Parsed JSON
+                "dbName": form[1], # TableName
+                "eFormName": form[2], # DisplayName
+                "mode": form[3],
+                "formJson": schemas.get(form[0]) # Parsed JSON
             }
         return None # 如果找不到表單
     except Exception as e:
@@ -150,8 +365,194 @@ def get_form_by_id(form_id):
         if cursor:
             cursor.close()
 
+def get_form_schema(form_id):
+    """
+    獲取表單的識別符與解析後的 SchemaContent (使用結構快取)，排除TestMode為3的資料。
+    返回 {"id", "formIdentifier", "schemaHash", "version", "formJson"} 或 None。
+    formJson 可能是快取中共用的物件，呼叫端不可修改。
+    """
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT TableManagerId, TableName, {SCHEMA_HASH_SQL}, SchemaVersion
+            FROM TableManager 
+            WHERE TableManagerId = ? AND TestMode != 3
+        """, (form_id,))
+        form = cursor.fetchone()
+        if not form:
+            return None
+        schemas = _resolve_schemas(cursor, [(form[0], form[2])])
+        return {
+            "id": form[0],
+            "formIdentifier": (form[1] or "").strip(),
+            "schemaHash": form[2],
+            "version": form[3],
+            "formJson": schemas.get(form[0])
+        }
+    except Exception as e:
+        current_app.logger.error(f"Error getting form schema by ID {form_id}: {str(e)}")
+        abort(500, description=f"Error retrieving form schema: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+def get_form_items(form_id):
+    """
+    獲取表單項目的扁平列表 (依 formJson 中出現的順序)，不需用戶端自行走訪巢狀的 Elements。
+    項目取自以 SchemaHash 為鍵的編譯結構快取，每個項目包含 id、label、type、path (JSON Pointer)。
+    返回 {"id", "version", "items"}，表單不存在時返回 None。
+    """
+    from .form_schema import get_compiled_schema
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+    compiled = get_compiled_schema(form["formJson"] or {}, content_hash=form["schemaHash"])
+    return {"id": form["id"], "version": form["version"], "items": _item_index(compiled)}
+
+def _item_index(compiled):
+    """CompiledSchema 的扁平項目列表 (id、label、type、path)"""
+    return [
+        {"id": item["id"], "label": item["label"], "type": item["type"], "path": item["path"]}
+        for item in compiled.items
+    ]
+
+def get_form_item_indexes(cursor, id_hash_pairs):
+    """
+    批次取得多個表單的扁平項目列表，返回 {TableManagerId: 項目列表}。
+    id_hash_pairs 為 (TableManagerId, SchemaHash)；結構內容優先使用快取，未命中者以單一查詢讀取。
+    """
+    from .form_schema import get_compiled_schema
+    schemas = _resolve_schemas(cursor, id_hash_pairs)
+    indexes = {}
+    for form_id, content_hash in id_hash_pairs:
+        schema = schemas.get(form_id)
+        if schema is None:
+            # 沒有結構內容時不以該雜湊寫入編譯快取
+            indexes[form_id] = []
+        else:
+            indexes[form_id] = _item_index(get_compiled_schema(schema, content_hash=content_hash))
+    return indexes
+
+def get_form_raw_by_id(form_id, known_version=None):
+    """
+    根據ID獲取單個表單定義，SchemaContent 以原始 JSON 字串返回 (不解析)。
+    返回 (表單資訊, SchemaContent 字串) 或 None；表單資訊的 version 為 SchemaVersion。
+    known_version 與目前版本相同時 (用戶端快取仍有效) 不讀取 SchemaContent，內容返回 None。
+    每個內容版本只在第一次讀取 (或寫入) 時驗證一次是否為合法 JSON。
+    """
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SELECT t.TableManagerId, t.TableName, t.DisplayName, t.TestMode,
+                   CASE WHEN t.SchemaVersion = ? THEN NULL ELSE b.SchemaContent END AS SchemaContent,
+                   t.SchemaHash, t.SchemaVersion
+            FROM TableManager t
+            LEFT JOIN SchemaBlob b ON b.SchemaHash = t.SchemaHash
+            WHERE t.TableManagerId = ? AND t.TestMode != 3
+        """, (known_version or 0, form_id))
+        form = cursor.fetchone()
+        if not form:
+            return None
+
+        schema_content_str, content_hash = form[4], form[5]
+        if form[6] == known_version:
+            schema_content_str = None
+        elif not schema_content_str:
+            schema_content_str = None
+        elif not is_schema_validated(content_hash):
+            try:
+                parsed = json.loads(schema_content_str)
+            except json.JSONDecodeError:
+                current_app.logger.warning(f"Could not parse SchemaContent for form ID {form[0]}")
+                # 與 get_form_by_id 一致，無法解析的內容返回空物件
+                schema_content_str = "{}"
+            else:
+                store_cached_schema(content_hash, parsed)
+                mark_schema_validated(content_hash)
+
+        form_info = {
+            "id": form[0],
+            "dbName": form[1], # TableName
+            "eFormName": form[2], # DisplayName
+            "mode": form[3],
+            "version": form[6]
+        }
+        return form_info, schema_content_str
+    except Exception as e:
+        current_app.logger.error(f"Error getting raw form definition by ID {form_id}: {str(e)}")
+        abort(500, description=f"Error retrieving form definition: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+
+def _remember_written_schema(schema_content_str, parsed_schema):
+    """寫入 SchemaBlob 後記錄其雜湊：內容由 json.dumps 產生，寫入時即已驗證"""
+    content_hash = schema_content_hash(schema_content_str)
+    store_cached_schema(content_hash, parsed_schema)
+    mark_schema_validated(content_hash)
+
+def _parse_schema_content(form_id, schema_content_str):
+    """解析 SchemaContent 字串，無法解析時返回空物件"""
+    if not schema_content_str:
+        return None
+    try:
+        return json.loads(schema_content_str)
+    except json.JSONDecodeError:
+        current_app.logger.warning(f"Could not parse SchemaContent for form ID {form_id}")
+        return {} # 或者 None，取決於前端期望
+
+def _resolve_schemas(cursor, id_hash_pairs):
+    """
+    根據 (TableManagerId, 內容雜湊) 取得解析後的 SchemaContent。
+    快取命中者直接使用，其餘以單一查詢從 SchemaBlob 讀取 (相同內容只讀取、解析一次) 並寫入快取。
+    """
+    schemas = {}
+    missing = {}  # 內容雜湊 -> 使用該內容的表單 ID
+    for form_id, content_hash in id_hash_pairs:
+        if content_hash is None:
+            # 沒有表單結構
+            schemas[form_id] = None
+            continue
+        cached = get_cached_schema(content_hash)
+        if cached is not None:
+            schemas[form_id] = cached
+        else:
+            missing.setdefault(content_hash, []).append(form_id)
+
+    if missing:
+        placeholders = ", ".join("?" for _ in missing)
+        cursor.execute(f"""
+            SELECT SchemaHash, SchemaContent
+            FROM SchemaBlob
+            WHERE SchemaHash IN ({placeholders})
+        """, list(missing))
+        for content_hash, schema_content_str in cursor.fetchall():
+            form_ids = missing[content_hash]
+            parsed = _parse_schema_content(form_ids[0], schema_content_str)
+            store_cached_schema(content_hash, parsed)
+            for form_id in form_ids:
+                schemas[form_id] = parsed
+    return schemas
+
 def update_form(form_id, form_data):
-    """更新 TableManager 中的表單定義數據"""
+    """
+    更新 TableManager 中的表單定義數據。
+    form_data 含 storageOptions 時一併更新儲存選項，並讓既有的 user_ 資料表套用新設定。
+    formIdentifier 變更時重新命名 user_ 資料表 (含分割表) 並更新結構；只有結構變更時比對並遷移資料表。
+    資料表的 DDL 由 DDL 佇列執行，返回內容的 ddlJob 為該工作的狀態。
+    內容雜湊與其他欄位都未變更時不寫入 (返回 unchanged=True)；有變更時 SchemaVersion 加 1，返回的 version 為新版本。
+    """
+    from .form_schema import (normalize_storage_options, apply_table_storage_options, rename_and_update_form_table,
+                              update_form_table_schema)
+    storage_options = None
+    if form_data.get('storageOptions') is not None:
+        try:
+            storage_options = normalize_storage_options(form_data['storageOptions'])
+        except ValueError as e:
+            abort(400, description=str(e))
+
     db = get_db()
     cursor = db.cursor()
     try:
@@ -168,24 +569,85 @@ def update_form(form_id, form_data):
         
         # 使用 formJson 作為 SchemaContent
         schema_content_str = json.dumps(form_json)
+        content_hash = schema_content_hash(schema_content_str)
+        new_identifier = form_data.get('formIdentifier', '')
         
+        # 先以主鍵讀取目前的定義 (不含 SchemaContent)，內容雜湊與其他欄位都相同時不需寫入
         cursor.execute("""
-            UPDATE TableManager
-            SET TableName = ?, DisplayName = ?, SchemaContent = ?, ItemsCnt = ?
+            SELECT TableName, DisplayName, ItemsCnt, SparseItems, DataCompression, SchemaHash, SchemaVersion
+            FROM TableManager
             WHERE TableManagerId = ? AND TestMode != 3
-        """, (
-            form_data.get('formIdentifier', ''), 
-            form_data.get('formDisplayName', ''), 
-            schema_content_str, 
-            form_data.get('itemsCnt', 0), 
-            form_id
-        ))
-        db.commit()
+        """, (form_id,))
+        current = cursor.fetchone()
         
-        if cursor.rowcount > 0:
-            current_app.logger.info(f"Updated form definition for ID: {form_id}")
+        if current is not None:
+            old_identifier = (current[0] or '').strip()
+            unchanged = (
+                current[5] == content_hash
+                and old_identifier == new_identifier
+                and current[1] == form_data.get('formDisplayName', '')
+                and current[2] == form_data.get('itemsCnt', 0)
+                and (storage_options is None or (bool(current[3]), current[4]) == (storage_options['sparse'], storage_options['compression']))
+            )
+            if unchanged:
+                current_app.logger.info(f"Form definition ID {form_id} unchanged (version {current[6]}); skipping update")
+                return {"id": form_id, "success": True, **form_data, "version": current[6], "unchanged": True}
+
+            # 更新前的結構，讓資料表遷移與 /schema/plan 以相同的前一版比對
+            schema_changed = current[5] != content_hash
+            previous_json = _resolve_schemas(cursor, [(form_id, current[5])]).get(form_id) if schema_changed else form_json
+
+            # SchemaVersion 條件避免覆寫讀取後被其他請求修改的定義
+            cursor.execute(f"""
+                SET NOCOUNT ON;
+                {SCHEMA_BLOB_UPSERT_SQL}
+                UPDATE TableManager
+                SET TableName = ?, DisplayName = ?, ItemsCnt = ?,
+                    SparseItems = COALESCE(?, SparseItems), DataCompression = COALESCE(?, DataCompression),
+                    SchemaHash = ?, SchemaVersion = SchemaVersion + 1
+                OUTPUT inserted.SchemaVersion
+                WHERE TableManagerId = ? AND TestMode != 3 AND SchemaVersion = ?
+            """, _schema_blob_params(schema_content_str, content_hash) + (
+                new_identifier, 
+                form_data.get('formDisplayName', ''), 
+                form_data.get('itemsCnt', 0), 
+                storage_options['sparse'] if storage_options else None,
+                storage_options['compression'] if storage_options else None,
+                content_hash,
+                form_id,
+                current[6]
+            ))
+            updated_version = cursor.fetchone()
+            if updated_version is None:
+                db.rollback()
+                abort(409, description=f"Form definition with ID {form_id} was modified concurrently.")
+            # 表單改名時，在同一交易中同步綁定路線的 BindingTableName
+            renamed_routes = refresh_route_bindings(cursor, form_id) if old_identifier != new_identifier else 0
+            db.commit()
+            invalidate_department_index()
+            index_upsert("forms", form_id, _form_search_text(form_data.get('formDisplayName', ''), new_identifier))
+            if renamed_routes:
+                invalidate_route_cache()
+                invalidate_search_index("routes")
+            
+            current_app.logger.info(f"Updated form definition for ID: {form_id} (version {updated_version[0]})")
+            _remember_written_schema(schema_content_str, form_json)
+            ddl_job = None
+            if old_identifier and new_identifier and old_identifier != new_identifier:
+                ddl_job = enqueue_ddl_job("rename_table", form_id, rename_and_update_form_table,
+                                          old_identifier, new_identifier, form_json, storage_options, previous_json)
+            elif schema_changed and new_identifier:
+                migrate = functools.partial(update_form_table_schema, storage_options=storage_options,
+                                            previous_form_json=previous_json)
+                ddl_job = enqueue_ddl_job("update_schema", form_id, migrate, new_identifier, form_json)
+            elif storage_options:
+                ddl_job = enqueue_ddl_job("storage_options", form_id, apply_table_storage_options,
+                                          new_identifier, storage_options)
             # 返回更新後的部分數據，或者可以重新查詢一次以獲取完整數據
-            return {"id": form_id, "success": True, **form_data} 
+            updated = {"id": form_id, "success": True, **form_data, "version": updated_version[0]}
+            if ddl_job is not None:
+                updated["ddlJob"] = ddl_job
+            return updated
         else:
             # 檢查表單是否存在但 TestMode=3 或 ID 不存在
             cursor.execute("SELECT COUNT(*) FROM TableManager WHERE TableManagerId = ?", (form_id,))
@@ -198,6 +660,10 @@ def update_form(form_id, form_data):
                  # 可以選擇返回 None 或特定的錯誤訊息
                  return None # 或 abort(403, ...)
             
+    except HTTPException:
+        # 版本衝突 (409) 與表單不存在 (404) 保留原本的狀態碼
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         current_app.logger.error(f"Error updating form definition ID {form_id}: {str(e)}")
@@ -206,8 +672,86 @@ def update_form(form_id, form_data):
         if cursor:
             cursor.close()
 
+def patch_form(form_id, operations, expected_version=None):
+    """
+    以 JSON Patch (RFC 6902) 操作更新表單結構，不需上傳整份 formJson。
+    操作套用在結構快取中已解析的內容 (複本) 上；expected_version (If-Match) 與目前版本不同時返回 412。
+    寫入時以讀取到的 SchemaVersion 為條件，期間被其他請求修改同樣返回 412。
+    資料表只比對被操作修改到的項目，由 DDL 佇列執行。
+    返回 {"id", "success", "version", "touchedItems", "ddlJob"}，表單不存在時返回 None。
+    """
+    from .form_schema import get_compiled_schema, update_form_table_schema
+    from .json_patch import JsonPatchError, apply_json_patch, operation_paths, pointer_overlaps
+
+    form = get_form_schema(form_id)
+    if not form:
+        return None
+    if expected_version is not None and form["version"] != expected_version:
+        abort(412, description=f"Form definition version is {form['version']}, not {expected_version}.")
+    current_json = form["formJson"] if isinstance(form["formJson"], dict) else {}
+
+    try:
+        patched_json = apply_json_patch(current_json, operations)
+    except JsonPatchError as e:
+        abort(400, description=str(e))
+    if not isinstance(patched_json, dict):
+        abort(400, description="formJson must be a valid JSON object.")
+
+    schema_content_str = json.dumps(patched_json)
+    content_hash = schema_content_hash(schema_content_str)
+    if content_hash == form["schemaHash"]:
+        return {"id": form_id, "success": True, "version": form["version"], "touchedItems": [], "unchanged": True}
+
+    # 路徑與任一操作重疊的項目 (修改前或修改後) 才需要比對資料表
+    paths = operation_paths(operations)
+    previous = get_compiled_schema(current_json, content_hash=form["schemaHash"])
+    compiled = get_compiled_schema(patched_json, content_hash=content_hash)
+    touched_items = sorted({
+        item["id"] for schema in (previous, compiled) for item in schema.items
+        if any(pointer_overlaps(item["path"], path) for path in paths)
+    })
+
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"""
+            SET NOCOUNT ON;
+            {SCHEMA_BLOB_UPSERT_SQL}
+            UPDATE TableManager
+            SET SchemaHash = ?, ItemsCnt = ?, SchemaVersion = SchemaVersion + 1
+            OUTPUT inserted.SchemaVersion
+            WHERE TableManagerId = ? AND TestMode != 3 AND SchemaVersion = ?
+        """, _schema_blob_params(schema_content_str, content_hash) + (content_hash, len(compiled.items), form_id, form["version"]))
+        updated_version = cursor.fetchone()
+        if updated_version is None:
+            db.rollback()
+        else:
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error patching form definition ID {form_id}: {str(e)}")
+        abort(500, description=f"Error patching form definition: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+    if updated_version is None:
+        abort(412, description=f"Form definition with ID {form_id} was modified concurrently.")
+
+    current_app.logger.info(f"Patched form definition ID {form_id} (version {updated_version[0]}), touched items: {touched_items}")
+    _remember_written_schema(schema_content_str, patched_json)
+    invalidate_department_index()
+
+    result = {"id": form_id, "success": True, "version": updated_version[0], "touchedItems": touched_items}
+    if touched_items:
+        migrate = functools.partial(update_form_table_schema, previous_form_json=current_json, only_items=set(touched_items))
+        result["ddlJob"] = enqueue_ddl_job("patch_schema", form_id, migrate, form["formIdentifier"], patched_json)
+    return result
+
 def delete_form(form_id):
-    """從 TableManager 刪除表單定義 (邏輯刪除，設定 TestMode=3 並重新命名資料表)"""
+    """
+    從 TableManager 刪除表單定義 (邏輯刪除，設定 TestMode=3 並重新命名資料表)。
+    資料表改名由 DDL 佇列執行；成功時返回該工作的狀態，表單不存在時返回 False。
+    """
     db = get_db()
     cursor = db.cursor()
     try:
@@ -233,33 +777,21 @@ def delete_form(form_id):
         # 儲存 UPDATE 操作影響的行數
         update_rowcount = cursor.rowcount
         
-        # 4. 重新命名實際的資料表
-        try:
-            # 檢查原始表是否存在
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_NAME = ? AND TABLE_SCHEMA = 'dbo'
-            """, (table_name,))
-            table_exists = cursor.fetchone()[0] > 0
-            
-            if table_exists:
-                # 執行表名重新命名
-                rename_sql = f"EXEC sp_rename '{table_name}', '{new_table_name}'"
-                cursor.execute(rename_sql)
-                current_app.logger.info(f"Renamed table from {table_name} to {new_table_name}")
-            else:
-                current_app.logger.warning(f"Table {table_name} does not exist, skipping rename")
-        except Exception as rename_error:
-            current_app.logger.error(f"Error renaming table {table_name} to {new_table_name}: {str(rename_error)}")
-            # 即使重新命名失敗，我們也繼續進行邏輯刪除
-        
+        # 在同一交易中讓綁定路線的 BindingTableName 改為封存後的名稱
+        renamed_routes = refresh_route_bindings(cursor, form_id) if update_rowcount > 0 else 0
         db.commit()
+        invalidate_department_index()
+        index_remove("forms", form_id)
+        if renamed_routes:
+            invalidate_route_cache()
+            invalidate_search_index("routes")
         
         # 使用儲存的 UPDATE 操作行數檢查
         if update_rowcount > 0:
-            current_app.logger.info(f"Logically deleted form definition ID: {form_id}, renamed table to: {new_table_name}")
-            return True
+            # 4. 重新命名實際的資料表：sp_rename 由 DDL 佇列執行，邏輯刪除不需等待
+            archive_job = enqueue_ddl_job("archive_table", form_id, archive_form_table, table_name, new_table_name)
+            current_app.logger.info(f"Logically deleted form definition ID: {form_id}, renaming table to: {new_table_name}")
+            return archive_job
         else:
             current_app.logger.warning(f"No rows affected when deleting form definition ID: {form_id}")
             return False
@@ -272,44 +804,77 @@ def delete_form(form_id):
         if cursor:
             cursor.close()
 
+def archive_form_table(table_name, new_table_name):
+    """
+    將已邏輯刪除表單的資料表 (含 _pN 分割表) 改名為封存名稱 (由 DDL 佇列執行)。
+    資料表不存在時略過；返回 {"renamed": bool, "table_name": 封存名稱}。
+    """
+    from .form_schema import rename_partition_tables
+    db = get_db()
+    cursor = db.cursor()
+    catalog_changes = []
+    try:
+        # 以 table catalog 檢查原始表是否存在
+        if not table_exists(cursor, table_name):
+            current_app.logger.warning(f"Table {table_name} does not exist, skipping rename")
+            return {"renamed": False, "table_name": new_table_name}
+        # 分割表 (_p2、_p3 ...) 需在主表改名前一併改名
+        rename_partition_tables(cursor, table_name, new_table_name, catalog_changes)
+        # 執行表名重新命名
+        cursor.execute(f"EXEC sp_rename '{table_name}', '{new_table_name}'")
+        catalog_changes.append(("rename_table", table_name, new_table_name))
+        db.commit()
+        apply_catalog_changes(catalog_changes)
+        current_app.logger.info(f"Renamed table from {table_name} to {new_table_name}")
+        return {"renamed": True, "table_name": new_table_name}
+    except Exception as e:
+        db.rollback()
+        current_app.logger.error(f"Error renaming table {table_name} to {new_table_name}: {str(e)}")
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+
 def _generate_unique_table_name(cursor, original_table_name):
-    """生成唯一的表名，格式為：原名 + '_old' + 流水號"""
+    """
+    生成唯一的表名，格式為：原名 + '_old' + 流水號。
+    TableManager 中已使用的名稱以單一查詢取出，實際資料表的名稱由 table catalog 取得，再取最小的可用流水號。
+    """
+    prefix = f"{original_table_name}_old"
+    pattern = _escape_like(prefix) + '%'
+    cursor.execute("SELECT TableName FROM TableManager WHERE TableName LIKE ? ESCAPE '\\'", (pattern,))
+    used_names = [row[0] for row in cursor.fetchall()] + find_table_names(cursor, prefix)
+
+    # 資料庫定序通常不區分大小寫，因此以小寫比對前綴
+    prefix_lower = prefix.lower()
+    used_counters = set()
+    for name in used_names:
+        name = (name or "").strip()
+        suffix = name[len(prefix):]
+        if name.lower().startswith(prefix_lower) and suffix.isdigit() and str(int(suffix)) == suffix:
+            used_counters.add(int(suffix))
+
     counter = 1
-    while True:
-        new_table_name = f"{original_table_name}_old{counter}"
-        
-        # 檢查 TableManager 中是否已存在相同名稱
-        cursor.execute("SELECT COUNT(*) FROM TableManager WHERE TableName = ?", (new_table_name,))
-        manager_exists = cursor.fetchone()[0] > 0
-        
-        # 檢查實際資料表是否已存在
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_NAME = ? AND TABLE_SCHEMA = 'dbo'
-        """, (new_table_name,))
-        table_exists = cursor.fetchone()[0] > 0
-        
-        # 如果都不存在，就使用這個名稱
-        if not manager_exists and not table_exists:
-            return new_table_name
-        
-        # 如果存在衝突，流水號 +1 繼續檢查
+    while counter in used_counters:
         counter += 1
-        
-        # 防止無限循環，設定上限
-        if counter > 9999:
-            raise Exception(f"無法為表 {original_table_name} 生成唯一名稱，已達到最大嘗試次數")
-    
-    return new_table_name
+
+    # 維持原本的上限
+    if counter > 9999:
+        raise Exception(f"無法為表 {original_table_name} 生成唯一名稱，已達到最大嘗試次數")
+
+    return f"{prefix}{counter}"
 
 def update_form_mode(form_id, mode):
     """更新表單定義的模式 (TestMode)"""
     db = get_db()
     cursor = db.cursor()
     try:
-        cursor.execute("UPDATE TableManager SET TestMode = ? WHERE TableManagerId = ?", (mode, form_id))
+        # 模式也是表單定義回應的一部分，變更時同樣遞增版本 (ETag)
+        cursor.execute("UPDATE TableManager SET TestMode = ?, SchemaVersion = SchemaVersion + 1 WHERE TableManagerId = ?", (mode, form_id))
         db.commit()
+        invalidate_department_index()
+        # 模式變更可能使表單進入或離開 TestMode=3，無法逐筆判斷，重新載入表單索引
+        invalidate_search_index("forms")
         if cursor.rowcount > 0:
             current_app.logger.info(f"Updated mode for form definition ID {form_id} to {mode}")
             return True
@@ -324,39 +889,60 @@ def update_form_mode(form_id, mode):
         if cursor:
             cursor.close()
 
-def search_department(code: str):
-    """根據部門代碼 (DisplayName 前四碼) 搜尋表單定義"""
+def _escape_like(value):
+    """跳脫 LIKE 模式中的萬用字元 (搭配 ESCAPE '\\' 使用)"""
+    return (value.replace('\\', '\\\\')
+                 .replace('%', '\\%')
+                 .replace('_', '\\_')
+                 .replace('[', '\\['))
+
+def search_department(code: str, page=1, limit=10):
+    """
+    根據部門代碼 (DisplayName 前四碼) 搜尋表單定義，支援分頁。
+    同一部門代碼的結果保存在記憶體索引中，表單變更時失效。
+    page 與 limit 必須大於 0 (否則 OFFSET 為負數)。
+    """
     if len(code) != 4:
         abort(400, description="Department code must be 4 characters")
-    
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        # 使用參數化查詢防止 SQL 注入
-        # 注意: SUBSTR 在不同資料庫中可能不同 (例如 SQL Server 是 SUBSTRING)
-        # 這裡假設是 SQLite 或類似語法
-        # 對於 SQL Server: WHERE SUBSTRING(DisplayName, 1, 4) = ? AND TestMode != 3
-        cursor.execute("""
-            SELECT TableManagerId, TableName, DisplayName 
-            FROM TableManager
-            WHERE SUBSTRING(DisplayName, 1, 4) = ? AND TestMode != 3 
-        """, (code,)) # 使用 SUBSTRING for SQL Server
-        rows = cursor.fetchall()
-        
+    if page < 1 or limit < 1:
+        abort(400, description="page and limit must be positive integers")
+
+    forms = get_department_forms(code)
+    if forms is None:
+        generation = department_index_generation()
+        db = get_db()
+        cursor = db.cursor()
+        try:
+            # 使用前綴 LIKE (可使用 DisplayName 上的索引進行 seek)，
+            # 取代無法使用索引的 SUBSTRING(DisplayName, 1, 4) = ?
+            cursor.execute("""
+                SELECT TableManagerId, TableName, DisplayName, TestMode 
+                FROM TableManager
+                WHERE DisplayName LIKE ? ESCAPE '\\' AND TestMode != 3 
+                ORDER BY TableManagerId
+            """, (_escape_like(code) + '%',))
+            rows = cursor.fetchall()
+        except Exception as e:
+            current_app.logger.error(f"Error searching department code '{code}': {str(e)}")
+            abort(500, description=f"Error searching forms by department: {str(e)}")
+        finally:
+            if cursor:
+                cursor.close()
+
         # 返回與 get_all_forms 類似的結構
-        return [
+        forms = [
             {
                 "id": r[0],
                 "dbName": r[1], # TableName
                 "eFormName": r[2], # DisplayName
-                # 可以考慮加入 mode 等其他需要的欄位
+                "mode": r[3]
             }
             for r in rows
         ]
-    except Exception as e:
-        current_app.logger.error(f"Error searching department code '{code}': {str(e)}")
-        abort(500, description=f"Error searching forms by department: {str(e)}")
-    finally:
-        if cursor:
-            cursor.close()
+        store_department_forms(code, forms, current_app.config.get('DEPARTMENT_INDEX_TTL', 300), generation)
 
+    offset = (page - 1) * limit
+    return {
+        "forms": forms[offset:offset + limit],
+        "total": len(forms)
+    }
@@ -1,7 +1,15 @@
 import bcrypt
+import json
 from flask import current_app
 # 使用絕對路徑導入
 from db import execute_query, get_db
+from models.search_index import index_remove, index_upsert, search_ids, search_loader
+
+@search_loader("users")
+def _load_user_search_docs(cursor, limit):
+    """使用者搜尋索引的文件：以 UserID 搜尋 (與 GET /api/users 的 search 參數相同)"""
+    cursor.execute("SELECT TOP (?) ID, UserID FROM SysUser", (limit,))
+    return [(row[0], str(row[1] or '')) for row in cursor.fetchall()]
 
 def add_signing_data(user_id, user_name, user_id_str, department_abbr, signing_data):
     """添加或更新巡檢人員核簽資料檔
@@ -278,6 +286,7 @@ def add_user(user_data):
                 raise Exception("無法獲取新用戶的 ID (SCOPE_IDENTITY failed 且無法通過 UserID 查詢)")
         
         conn.commit() # 提交 INSERT
+        index_upsert("users", new_user_id, str(user_data.get('UserID') or ''))
         
         # 處理核簽資料（如果提供）
         signing_data = user_data.get('signingData')
@@ -324,8 +333,13 @@ def get_user_with_signing_data(user_id):
     
     # 獲取核簽資料
     signing_data = get_signing_data_by_user_id(user.get('UserID'))
+    _merge_signing_data(user, signing_data)
+    
+    return user
+
+def _merge_signing_data(user, signing_data):
+    """將核簽資料 (巡檢人員核簽資料檔的一列) 以 API 欄位名稱加入用戶信息"""
     if signing_data:
-        # 將核簽資料添加到用戶信息中
         user.update({
             'supervisorName': signing_data.get('主管姓名', ''),
             'supervisorID': signing_data.get('主管ID', ''),
@@ -347,8 +361,6 @@ def get_user_with_signing_data(user_id):
             'jobTitle': signing_data.get('職稱', ''),
             'secondDepartment': signing_data.get('第二部門', '')
         })
-    
-    return user
 
 def get_all_users_with_signing_data():
     """獲取所有用戶及其核簽資料
@@ -366,6 +378,37 @@ def get_all_users_with_signing_data():
     
     return result
 
+def get_users_with_signing_data(user_ids):
+    """以固定兩次查詢獲取多個用戶及其核簽資料 (搜尋結果不逐筆查詢)
+    
+    Args:
+        user_ids (iterable): 用戶 ID
+        
+    Returns:
+        list: 依 ID 排序的用戶列表 (不存在的 ID 略過)
+    """
+    ids = sorted(int(user_id) for user_id in user_ids)
+    if not ids:
+        return []
+    ids_json = json.dumps(ids)
+    users = execute_query(
+        'SELECT * FROM SysUser WHERE ID IN (SELECT CAST([value] AS int) FROM OPENJSON(?)) ORDER BY ID',
+        (ids_json,)
+    )
+    if not users:
+        return []
+    signing_rows = execute_query(
+        'SELECT * FROM [巡檢人員核簽資料檔] WHERE [巡檢人ID] IN '
+        '(SELECT UserID FROM SysUser WHERE ID IN (SELECT CAST([value] AS int) FROM OPENJSON(?)))',
+        (ids_json,)
+    )
+    signing_by_user_id = {}
+    for row in signing_rows:
+        signing_by_user_id.setdefault(row.get('巡檢人ID'), row)
+    for user in users:
+        _merge_signing_data(user, signing_by_user_id.get(user.get('UserID')))
+    return users
+
 def update_user(user_id, user_data):
     """更新用戶信息（同時處理SysUser和巡檢人員核簽資料檔兩張表）
     
@@ -442,6 +485,8 @@ def update_user(user_id, user_data):
     # 返回更新後的完整用戶信息（包含核簽資料）
     try:
         updated_user = get_user_with_signing_data(user_id)
+        if updated_user:
+            index_upsert("users", user_id, str(updated_user.get('UserID') or ''))
         return updated_user
     except Exception as e:
         raise Exception(f"更新用戶失敗: {str(e)}")
@@ -506,11 +551,28 @@ def delete_user(user_id):
         query = 'DELETE FROM SysUser WHERE ID = ?'
         params = (user_id,)
         execute_query(query, params, commit=True)
+        index_remove("users", user_id)
         
         return True
     except Exception:
         return False
 
+def search_user_ids(keyword):
+    """以搜尋索引找出 UserID 包含 keyword (不分大小寫) 的用戶 ID 集合
+    
+    Args:
+        keyword (str): 搜尋關鍵字
+        
+    Returns:
+        set: 用戶 ID 集合，或 None（索引停用或用戶數超過上限，由呼叫端逐筆比對）
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        return search_ids("users", keyword, cur)
+    finally:
+        cur.close()
+
 def verify_password(user_id, password):
     """驗證用戶密碼
     
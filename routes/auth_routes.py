@@ -8,8 +8,9 @@ import datetime
 from models.user import (
     add_user, verify_password, get_user_by_id, 
     get_all_users, get_all_users_with_signing_data, get_user_with_signing_data,
+    get_users_with_signing_data,
     update_user, delete_user, set_user_work_status, check_priority_level,
-    validate_user_data_consistency, fix_user_data_consistency
+    validate_user_data_consistency, fix_user_data_consistency, search_user_ids
 )
 from middleware.auth import require_auth, require_priority_level # middleware.auth 自身已更新
 
@@ -150,8 +151,13 @@ def get_users(user_id): # user_id 由 @require_priority_level 注入
         if not current_user:
             return jsonify({"success": False, "message": "無法獲取當前用戶信息"}), 404
             
-        # 獲取所有用戶數據
-        all_users = get_all_users_with_signing_data()
+        # 有搜索關鍵字時以搜尋索引找出符合的用戶，只讀取這些用戶的資料
+        matched_ids = search_user_ids(search_keyword) if search_keyword else None
+        if matched_ids is not None:
+            all_users = get_users_with_signing_data(matched_ids)
+        else:
+            # 獲取所有用戶數據
+            all_users = get_all_users_with_signing_data()
         
         # 移除密碼字段
         for user in all_users:
@@ -1,6 +1,13 @@
-from flask import Blueprint, request, jsonify
+import json
+from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.exceptions import HTTPException
 # Update imports to use the new modular structure
-from models.table_manager import add_form, get_all_forms, get_form_by_id, update_form, delete_form, update_form_mode, search_department
+from models.table_manager import FORM_LIST_FIELDS, add_form, get_all_forms, get_form_raw_by_id, get_form_items, update_form, patch_form, clone_form, delete_form, update_form_mode, search_department
+from models.form_records import RECORD_FILTER_PARAMS, insert_form_records, query_form_records
+from models.form_schema import normalize_storage_options
+from models.schema_diff import plan_form_table_migration, migrate_form_table
+from models.ddl_queue import get_ddl_job
 # If you need any schema or utils functions, import them like:
 # from models.form_schema import create_form_table, rename_and_update_form_table
 # from models.form_utils import collect_items
@@ -8,6 +15,10 @@ from models.table_manager import add_form, get_all_forms, get_form_by_id, update
 # 創建藍圖
 form_bp = Blueprint('forms', __name__, url_prefix='/api')
 
+def _ddl_status_code(ddl_job):
+    """DDL 工作尚未完成時回應 202 Accepted"""
+    return 202 if ddl_job and ddl_job["status"] in ("queued", "running") else 200
+
 @form_bp.route('/forms', methods=['POST'])
 def create_form():
     """創建新表單"""
@@ -21,6 +32,11 @@ def create_form():
                 "success": False,
                 "message": f"缺少必要字段: {field}"
             }), 400
+
+    try:
+        normalize_storage_options(data.get('storageOptions'))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
     try:
         new_form = add_form(data)
@@ -35,7 +51,13 @@ def create_form():
             "success": True,
             "message": "表單創建成功",
             "form": new_form
-        })
+        }), _ddl_status_code(new_form.get("ddlJob"))
+    except HTTPException as e:
+        # 無效的 formJson (400) 直接回應對應的狀態碼
+        return jsonify({
+            "success": False,
+            "message": f"創建表單失敗: {e.description}"
+        }), e.code
     except Exception as e:
         return jsonify({
             "success": False,
@@ -44,11 +66,30 @@ def create_form():
 
 @form_bp.route('/forms', methods=['GET'])
 def get_forms():
-    """獲取所有表單，支援分頁"""
+    """
+    獲取所有表單，支援分頁。
+    預設不返回 formJson，需要時以 include=formJson 取得；
+    fields=id,eFormName,mode 可只返回指定欄位；search 以子字串搜尋顯示名稱與資料表名稱。
+    """
+    include = {part.strip() for part in request.args.get('include', '').split(',') if part.strip()}
+    fields = None
+    if request.args.get('fields'):
+        fields = {part.strip() for part in request.args.get('fields').split(',') if part.strip()}
+        if 'formJson' in fields:
+            include.add('formJson')
+            fields.discard('formJson')
+        unknown_fields = fields - set(FORM_LIST_FIELDS)
+        if unknown_fields:
+            return jsonify({
+                "success": False,
+                "message": f"無效的欄位: {', '.join(sorted(unknown_fields))}"
+            }), 400
+
     try:
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 10))
-        result = get_all_forms(page=page, limit=limit)
+        result = get_all_forms(page=page, limit=limit, include_schema='formJson' in include, fields=fields,
+                               search=request.args.get('search') or None)
         return jsonify({
             "success": True,
             "forms": result["forms"],
@@ -72,43 +113,122 @@ def search_department_forms():
         }), 400
     
     try:
-        forms = search_department(code)
+        page = int(request.args.get('page', 1))
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "message": "無效的查詢參數"
+        }), 400
+
+    try:
+        result = search_department(code, page=page, limit=limit)
         return jsonify({
             "success": True,
-            "forms": forms,  # 使用複數形式
-            "total": len(forms)
+            "forms": result["forms"],  # 使用複數形式
+            "total": result["total"]
         })
+    except HTTPException as e:
+        # 部門代碼長度或分頁參數無效 (400)
+        return jsonify({
+            "success": False,
+            "message": f"搜尋表單失敗: {e.description}"
+        }), e.code
     except Exception as e:
         return jsonify({
             "success": False,
             "message": f"搜尋表單失敗: {str(e)}"
         }), 500
 
+def _form_response_with_raw_schema(form_info, schema_content_str):
+    """
+    組合 {"success": true, "form": {..., "formJson": <SchemaContent>}} 回應，
+    SchemaContent 原樣嵌入回應內容，不經過解析與重新序列化
+    """
+    form_prefix = json.dumps(form_info)[:-1]
+    separator = ", " if form_info else ""
+    body = (
+        '{"success": true, "form": ' + form_prefix + separator
+        + '"formJson": ' + (schema_content_str or "null") + '}}'
+    )
+    return current_app.response_class(body, mimetype='application/json')
+
+def _etag_version(etags):
+    """If-None-Match / If-Match 標頭中的表單版本 (表單的 ETag 為 SchemaVersion)，沒有時返回 None"""
+    for tag in etags.as_set(include_weak=True):
+        if tag.isdigit():
+            return int(tag)
+    return None
+
 # 保留原本的 get_form 但改用 form_id
+# 注意：視圖函數不可與 models.table_manager.get_form_by_id 同名，否則會遞迴呼叫自己
 @form_bp.route('/forms/<int:form_id>', methods=['GET'])
-def get_form_by_id(form_id):
-    """根據 ID 獲取特定表單"""
+def get_form(form_id):
+    """
+    根據 ID 獲取特定表單 (formJson 直接使用資料庫中的 JSON 內容)。
+    回應帶有以版本號為值的 ETag；If-None-Match 與目前版本相同時返回 304，不傳輸 SchemaContent。
+    """
     try:
-        form = get_form_by_id(form_id)
-        if not form:
+        known_version = _etag_version(request.if_none_match)
+        result = get_form_raw_by_id(form_id, known_version)
+        if not result:
             return jsonify({
                 "success": False,
                 "message": "表單不存在"
             }), 404
-        return jsonify({
-            "success": True,
-            "form": form
-        })
+        form_info, schema_content_str = result
+        if known_version is not None and form_info["version"] == known_version:
+            response = current_app.response_class(status=304)
+        else:
+            response = _form_response_with_raw_schema(form_info, schema_content_str)
+        response.set_etag(str(form_info["version"]))
+        return response
     except Exception as e:
         return jsonify({
             "success": False,
             "message": f"獲取表單失敗: {str(e)}"
         }), 500
 
+@form_bp.route('/forms/<int:form_id>/items', methods=['GET'])
+def get_form_items_data(form_id):
+    """
+    獲取表單項目的扁平列表 (id、label、type、path)，取代下載整份 formJson 再自行走訪。
+    ETag 與 GET /api/forms/<id> 相同為表單版本；If-None-Match 與目前版本相同時返回 304。
+    """
+    try:
+        known_version = _etag_version(request.if_none_match)
+        form_items = get_form_items(form_id)
+        if not form_items:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        if known_version is not None and form_items["version"] == known_version:
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify({
+                "success": True,
+                "formId": form_items["id"],
+                "version": form_items["version"],
+                "items": form_items["items"]
+            })
+        response.set_etag(str(form_items["version"]))
+        return response
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"獲取表單項目失敗: {str(e)}"
+        }), 500
+
 @form_bp.route('/forms/<int:form_id>', methods=['PUT'])
 def update_form_data(form_id):
     """更新表單數據"""
     data = request.get_json()
+    if data.get('storageOptions') is not None:
+        try:
+            normalize_storage_options(data['storageOptions'])
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
     try:
         updated_form = update_form(form_id, data)
         if not updated_form:
@@ -120,33 +240,129 @@ def update_form_data(form_id):
             "success": True,
             "message": "表單更新成功",
             "form": updated_form
+        }), _ddl_status_code(updated_form.get("ddlJob"))
+    except HTTPException as e:
+        # 表單不存在 (404) 與並行修改 (409) 直接回應對應的狀態碼
+        return jsonify({
+            "success": False,
+            "message": f"更新表單失敗: {e.description}"
+        }), e.code
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"更新表單失敗: {str(e)}"
+        }), 500
+
+@form_bp.route('/forms/<int:form_id>', methods=['PATCH'])
+def patch_form_data(form_id):
+    """
+    以 JSON Patch (RFC 6902) 操作陣列部分更新表單結構 (formJson)。
+    可帶 If-Match (GET 回應的 ETag) 確認表單未被其他人修改；版本不符時返回 412。
+    """
+    operations = request.get_json(force=True, silent=True)
+    if not isinstance(operations, list):
+        return jsonify({
+            "success": False,
+            "message": "請提供 JSON Patch 操作陣列"
+        }), 400
+    try:
+        patched = patch_form(form_id, operations, _etag_version(request.if_match))
+        if not patched:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        response = jsonify({
+            "success": True,
+            "message": "表單更新成功",
+            "form": patched
         })
+        response.set_etag(str(patched["version"]))
+        return response, _ddl_status_code(patched.get("ddlJob"))
+    except HTTPException as e:
+        # 操作錯誤 (400) 與版本不符 (412) 直接回應對應的狀態碼
+        return jsonify({
+            "success": False,
+            "message": f"更新表單失敗: {e.description}"
+        }), e.code
     except Exception as e:
         return jsonify({
             "success": False,
             "message": f"更新表單失敗: {str(e)}"
         }), 500
 
+@form_bp.route('/forms/<int:form_id>/clone', methods=['POST'])
+def clone_form_data(form_id):
+    """
+    在伺服器端複製表單定義並建立新的資料表。
+    請求內容: {"formIdentifier": 必填, "formDisplayName": 選填, "copyRecords": 是否複製巡檢紀錄}
+    複製紀錄或建立工作等待逾時時回應 202，進度可由 copyJob / ddlJob 的 id 查詢 GET /api/forms/jobs/<job_id>。
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('formIdentifier'):
+        return jsonify({
+            "success": False,
+            "message": "缺少必要字段: formIdentifier"
+        }), 400
+    try:
+        cloned = clone_form(form_id, data)
+        if not cloned:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        return jsonify({
+            "success": True,
+            "message": "表單複製成功",
+            "form": cloned
+        }), max(_ddl_status_code(cloned.get("ddlJob")), _ddl_status_code(cloned.get("copyJob")))
+    except HTTPException as e:
+        # 目標資料表已存在 (409) 直接回應對應的狀態碼
+        return jsonify({
+            "success": False,
+            "message": f"複製表單失敗: {e.description}"
+        }), e.code
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"複製表單失敗: {str(e)}"
+        }), 500
+
 @form_bp.route('/forms/<int:form_id>', methods=['DELETE'])
 def delete_form_data(form_id):
     """刪除表單"""
     try:
-        success = delete_form(form_id)
-        if not success:
+        archive_job = delete_form(form_id)
+        if not archive_job:
             return jsonify({
                 "success": False,
                 "message": "刪除表單失敗"
             }), 500
         return jsonify({
             "success": True,
-            "message": "表單刪除成功"
-        })
+            "message": "表單刪除成功",
+            "ddlJob": archive_job
+        }), _ddl_status_code(archive_job)
     except Exception as e:
         return jsonify({
             "success": False,
             "message": f"刪除表單失敗: {str(e)}"
         }), 500
 
+@form_bp.route('/forms/jobs/<job_id>', methods=['GET'])
+def get_form_ddl_job(job_id):
+    """查詢表單資料表 DDL 工作 (建立、改名、封存) 的狀態"""
+    job = get_ddl_job(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "message": "工作不存在"
+        }), 404
+    return jsonify({
+        "success": True,
+        "job": job
+    })
+
 @form_bp.route('/forms/<int:form_id>/mode', methods=['PUT'])
 def update_form_mode_data(form_id):
     """更新表單模式"""
@@ -173,4 +389,159 @@ def update_form_mode_data(form_id):
         return jsonify({
             "success": False,
             "message": f"更新表單模式失敗: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+@form_bp.route('/forms/<int:form_id>/schema/plan', methods=['POST'])
+def plan_form_schema(form_id):
+    """
+    預覽表單資料表的結構遷移計畫 (dry-run，不會修改資料表)。
+    請求內容可帶 formJson (擬更新的表單結構)；未提供時比對目前儲存的結構與實際資料表。
+    dropRemoved 為 true 時預覽移除已不在表單中的項目欄位 (同 POST /schema/migrate)。
+    """
+    data = request.get_json(silent=True) or {}
+    form_json = data.get('formJson')
+    drop_removed = data.get('dropRemoved') is True
+    try:
+        if isinstance(form_json, str):
+            form_json = json.loads(form_json)
+        valid_form_json = form_json is None or isinstance(form_json, dict)
+    except json.JSONDecodeError:
+        valid_form_json = False
+    if not valid_form_json:
+        return jsonify({
+            "success": False,
+            "message": "formJson 必須是有效的 JSON 物件"
+        }), 400
+
+    try:
+        plan = plan_form_table_migration(form_id, form_json, drop_removed=drop_removed)
+        if plan is None:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        return jsonify({
+            "success": True,
+            "plan": plan
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"產生結構遷移計畫失敗: {str(e)}"
+        }), 500
+
+@form_bp.route('/forms/<int:form_id>/schema/migrate', methods=['POST'])
+def migrate_form_schema(form_id):
+    """
+    讓表單資料表符合目前儲存的表單結構 (新增、移除、變更型別的欄位以單一批次執行)。
+    已不在表單中的項目欄位只在請求內容帶 {"dropRemoved": true} 時移除 (連同其巡檢紀錄)。
+    遷移由 DDL 佇列執行；等待逾時回應 202，進度可由 ddlJob 的 id 查詢。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        job = migrate_form_table(form_id, drop_removed=data.get('dropRemoved') is True)
+        if job is None:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        if job["status"] == "failed":
+            return jsonify({
+                "success": False,
+                "message": f"更新資料表結構失敗: {job['error']}",
+                "ddlJob": job
+            }), 500
+        return jsonify({
+            "success": True,
+            "message": "資料表結構已更新",
+            "result": job["result"],
+            "ddlJob": job
+        }), _ddl_status_code(job)
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"更新資料表結構失敗: {str(e)}"
+        }), 500
+
+@form_bp.route('/forms/<int:form_id>/records', methods=['POST'])
+def create_form_records(form_id):
+    """寫入巡檢紀錄 (單筆物件或紀錄陣列)"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({
+            "success": False,
+            "message": "請提供 JSON 格式的紀錄"
+        }), 400
+    try:
+        result = insert_form_records(form_id, data)
+        if result is None:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        if not result.get("success"):
+            return jsonify({
+                "success": False,
+                "message": "紀錄驗證失敗",
+                "errors": result.get("errors", [])
+            }), 400
+        return jsonify({
+            "success": True,
+            "message": "紀錄寫入成功",
+            "inserted": result["inserted"]
+        })
+    except HTTPException as e:
+        # 資料表遷移尚未完成 (409)，用戶端可稍後重試
+        return jsonify({
+            "success": False,
+            "message": f"寫入紀錄失敗: {e.description}"
+        }), e.code
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"寫入紀錄失敗: {str(e)}"
+        }), 500
+
+
+@form_bp.route('/forms/<int:form_id>/records', methods=['GET'])
+def get_form_records(form_id):
+    """
+    查詢巡檢紀錄，依新到舊排序。
+    可用 userId、pointInfoId、reviewerId、from / to (CheckDate，ISO 8601) 過濾；
+    以回應中的 next_cursor 作為下一頁的 after 參數。
+    """
+    try:
+        filters = {}
+        for param_name in RECORD_FILTER_PARAMS:
+            if request.args.get(param_name) is not None:
+                filters[param_name] = int(request.args.get(param_name))
+        if request.args.get('from'):
+            filters['checkDateFrom'] = datetime.fromisoformat(request.args.get('from'))
+        if request.args.get('to'):
+            filters['checkDateTo'] = datetime.fromisoformat(request.args.get('to'))
+        # 無效的 after 回應 400，避免用戶端以損毀的游標重新從第一頁開始
+        after = int(request.args['after']) if request.args.get('after') is not None else None
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "message": "無效的查詢參數"
+        }), 400
+
+    try:
+        result = query_form_records(form_id, filters=filters, after=after, limit=limit)
+        if result is None:
+            return jsonify({
+                "success": False,
+                "message": "表單不存在"
+            }), 404
+        return jsonify({
+            "success": True,
+            "records": result["records"],
+            "next_cursor": result["next_cursor"]
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"獲取紀錄失敗: {str(e)}"
+        }), 500
@@ -1,14 +1,23 @@
 from flask import Blueprint, request, jsonify, current_app  # 添加 current_app import
-from models.route import get_route_by_id, get_all_routes, create_route, update_route, delete_route
+from models.route import get_route_by_id, get_all_routes, create_route, update_route, delete_route, bulk_apply_routes, reconcile_route_bindings
 
 # 導入資料庫連接
 route_bp = Blueprint('route', __name__, url_prefix='/api')
 
+def _include_options():
+    """
+    解析 include 查詢參數：include=form 附上綁定表單的摘要，include=form,items 另外附上表單項目列表。
+    返回 (include_form, include_items)
+    """
+    include = {part.strip() for part in request.args.get('include', '').split(',') if part.strip()}
+    return 'form' in include or 'items' in include, 'items' in include
+
 @route_bp.route('/routes/<int:route_id>', methods=['GET'])
 def get_route(route_id):
-    """獲取特定巡檢路線"""
+    """獲取特定巡檢路線 (可用 include=form 或 include=form,items 附上綁定的表單)"""
     try:
-        route = get_route_by_id(route_id)
+        include_form, include_items = _include_options()
+        route = get_route_by_id(route_id, include_form=include_form, include_items=include_items)
         if not route:
             return jsonify({
                 "success": False,
@@ -26,7 +35,7 @@ def get_route(route_id):
 
 @route_bp.route('/routes', methods=['GET'])
 def get_routes():
-    """獲取所有巡檢路線 (可選分頁、搜尋和模式)"""
+    """獲取所有巡檢路線 (可選分頁、搜尋和模式；include=form 或 include=form,items 附上綁定的表單)"""
     try:
         # 從查詢參數獲取分頁、搜尋條件和模式
         page = request.args.get('page', 1, type=int)
@@ -37,7 +46,9 @@ def get_routes():
         # 將參數傳遞給模型函數 get_all_routes
         # get_all_routes 函數 (在 models/route.py 中) 需要能夠處理這些參數
         # 並根據這些參數構建正確的 SQL 查詢
-        routes_data = get_all_routes(page=page, limit=limit, search=search_term, mode=mode)
+        include_form, include_items = _include_options()
+        routes_data = get_all_routes(page=page, limit=limit, search=search_term, mode=mode,
+                                     include_form=include_form, include_items=include_items)
 
         # 假設 get_all_routes 返回一個包含 'routes' 列表和 'total' 總數的字典
         # 以便前端進行分頁。如果它只返回路線列表，您需要相應地調整。
@@ -89,6 +100,54 @@ def add_route():
             "message": f"創建路線失敗: {str(e)}"
         }), 500
 
+@route_bp.route('/routes/bulk', methods=['POST'])
+def bulk_routes():
+    """
+    批次新增、更新與刪除巡檢路線 (同一交易)。
+    請求內容: {"upserts": [{"RouteId"?, "RouteName", "BindingTableId", "BindingTableName"}], "deletes": [RouteId, ...]}
+    upserts 中帶 RouteId 的項目為更新，其餘為新增；回應包含每個項目的結果。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({
+            "success": False,
+            "message": "請提供 upserts 與 deletes"
+        }), 400
+    try:
+        result = bulk_apply_routes(data.get('upserts'), data.get('deletes'))
+        if not result["success"]:
+            return jsonify({
+                "success": False,
+                "message": "路線資料驗證失敗",
+                "errors": result["errors"]
+            }), 400
+        return jsonify({
+            "success": True,
+            "message": "批次處理路線成功",
+            "results": result["results"]
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"批次處理路線失敗: {str(e)}"
+        }), 500
+
+@route_bp.route('/routes/bindings/reconcile', methods=['POST'])
+def reconcile_bindings():
+    """以 TableManager 目前的表單名稱批次修正所有路線的 BindingTableName"""
+    try:
+        result = reconcile_route_bindings()
+        return jsonify({
+            "success": True,
+            "message": "路線綁定已同步",
+            "updated": result["updated"]
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"同步路線綁定失敗: {str(e)}"
+        }), 500
+
 @route_bp.route('/routes/<int:route_id>', methods=['PUT'])
 def update_route_data(route_id):
     """更新巡檢路線"""
@@ -36,7 +36,8 @@ def app():
         'DEBUG': True,
         'ENV': 'testing',
         'PORT': 3001,
-        'LOG_LEVEL': 'DEBUG'
+        'LOG_LEVEL': 'DEBUG',
+        'DDL_QUEUE_INLINE': True  # 測試中 DDL 工作於請求中直接執行
     }
     
     app = create_app(test_config)
@@ -447,5 +448,6 @@ def setup_test_function():
     """
     # 測試前設定
     yield
-    # 測試後清理
-    pass
\ No newline at end of file
+    # 測試後清理：清空資料表中繼資料快取，避免測試之間互相影響
+    from models.table_catalog import invalidate_table_catalog
+    invalidate_table_catalog()
\ No newline at end of file
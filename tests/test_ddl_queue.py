@@ -0,0 +1,265 @@
+import json
+import pytest
+import threading
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+from flask import abort
+
+# 導入要測試的模組
+from models.ddl_queue import enqueue_ddl_job, get_ddl_job, wait_for_ddl_queue
+from models.table_manager import add_form, archive_form_table, delete_form, update_form
+from models.table_catalog import _replace_catalog as seed_catalog
+from routes.form_routes import form_bp
+from config import create_app
+
+
+@pytest.fixture
+def ddl_db():
+    """背景佇列用於 DdlJob 與 sp_getapplock 的連線 (預設取得鎖定成功)"""
+    conn = MagicMock()
+    conn.cursor.return_value.fetchone.return_value = (0,)
+    with patch('models.ddl_queue.get_db', return_value=conn):
+        yield conn
+
+
+@pytest.fixture
+def async_app(app, ddl_db):
+    """DDL 工作由背景執行緒執行的應用程式"""
+    return create_app({**app.config, 'DDL_QUEUE_INLINE': False}, load_env=False)
+
+
+def ddl_statements(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list]
+
+
+@pytest.fixture
+def form_client(app):
+    """註冊表單藍圖的測試客戶端"""
+    form_app = create_app(dict(app.config), load_env=False)
+    form_app.register_blueprint(form_bp)
+    return form_app.test_client()
+
+
+class TestDdlQueue:
+    """測試 DDL 佇列的執行與狀態"""
+
+    def test_jobs_run_serially_on_worker_thread(self, async_app):
+        threads = []
+        release = threading.Event()
+
+        def first_job():
+            release.wait(timeout=5)
+            threads.append(threading.current_thread().name)
+            return "first"
+
+        def second_job():
+            threads.append(threading.current_thread().name)
+            return "second"
+
+        with async_app.app_context():
+            first = enqueue_ddl_job("create_table", 1, first_job)
+            second = enqueue_ddl_job("archive_table", 1, second_job)
+            # 請求只記錄意圖即返回
+            assert first["status"] in ("queued", "running")
+            assert get_ddl_job(second["id"])["status"] == "queued"
+            release.set()
+            wait_for_ddl_queue()
+
+        assert threads == ["ddl-queue", "ddl-queue"]
+        assert get_ddl_job(first["id"])["result"] == "first"
+        assert get_ddl_job(second["id"])["status"] == "succeeded"
+
+    def test_failed_job_records_error(self, async_app):
+        def failing_job():
+            abort(409, description="Target table name 'user_x' already exists.")
+
+        with async_app.app_context():
+            job = enqueue_ddl_job("rename_table", 2, failing_job)
+            wait_for_ddl_queue()
+
+        status = get_ddl_job(job["id"])
+        assert status["status"] == "failed"
+        assert status["error"] == "Target table name 'user_x' already exists."
+        assert status["finishedAt"] is not None
+
+    def test_worker_holds_shared_lock_and_saves_state(self, async_app, ddl_db):
+        with async_app.app_context():
+            job = enqueue_ddl_job("archive_table", 3, lambda: {"renamed": True})
+            wait_for_ddl_queue()
+
+        statements = ddl_statements(ddl_db)
+        lock = next(i for i, sql in enumerate(statements) if "sp_getapplock" in sql)
+        release = next(i for i, sql in enumerate(statements) if "sp_releaseapplock" in sql)
+        saves = [c[0][1] for c in ddl_db.cursor.return_value.execute.call_args_list if "DdlJob" in c[0][0]]
+        # 加入時、開始執行時與完成時各寫入一次狀態，執行期間持有跨行程鎖定
+        assert [params[0] for params in saves] == ["queued", "running", "succeeded"]
+        assert saves[-1][3] == '{"renamed": true}'
+        assert lock < release
+        # 取得鎖定後先重新載入 table catalog，其他行程的 DDL 不會留下過期的欄位定義
+        assert "FROM sys.tables" in statements[lock + 1]
+        assert "DdlJob" in statements[lock + 2] and "DdlJob" in statements[release - 1]
+        assert get_ddl_job(job["id"])["status"] == "succeeded"
+
+    def test_lock_timeout_fails_job_without_running_it(self, async_app, ddl_db):
+        ddl_db.cursor.return_value.fetchone.return_value = (-1,)
+        ran = []
+
+        with async_app.app_context():
+            job = enqueue_ddl_job("rename_table", 4, lambda: ran.append(True))
+            wait_for_ddl_queue()
+
+        status = get_ddl_job(job["id"])
+        assert status["status"] == "failed"
+        assert "another worker" in status["error"]
+        assert ran == []
+        assert not any("sp_releaseapplock" in sql for sql in ddl_statements(ddl_db))
+
+    def test_wait_returns_unfinished_job_after_timeout(self, async_app):
+        release = threading.Event()
+        async_app.config['DDL_WAIT_TIMEOUT'] = 0
+
+        with async_app.app_context():
+            job = enqueue_ddl_job("create_table", None, lambda: release.wait(timeout=5), wait=True)
+            assert job["status"] in ("queued", "running")
+            release.set()
+            wait_for_ddl_queue()
+
+        assert get_ddl_job(job["id"])["status"] == "succeeded"
+
+    def test_job_from_other_worker_is_read_from_table(self, async_app, ddl_db):
+        ddl_db.cursor.return_value.fetchone.return_value = (
+            "a" * 32, "rename_table", 6, "running", datetime(2024, 5, 1, 8, 0), datetime(2024, 5, 1, 8, 1), None, None, None)
+
+        with async_app.app_context():
+            job = get_ddl_job("a" * 32)
+
+        assert job["status"] == "running"
+        assert job["formId"] == 6
+        assert job["startedAt"] == "2024-05-01T08:01:00"
+        assert job["result"] is None
+        assert ddl_db.cursor.return_value.execute.call_args[0][1] == ("a" * 32,)
+
+    @patch('models.table_manager.get_db')
+    def test_add_form_returns_pending_job_after_wait_timeout(self, mock_get_db, async_app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [(None,), (22,)]
+        seed_catalog([], [])
+        release = threading.Event()
+        async_app.config['DDL_WAIT_TIMEOUT'] = 0
+
+        with async_app.app_context():
+            enqueue_ddl_job("archive_table", 20, lambda: release.wait(timeout=5))
+            result = add_form({"formIdentifier": "slow_form", "formDisplayName": "S", "formJson": {"Elements": []}})
+            release.set()
+            wait_for_ddl_queue()
+
+        assert result["id"] is None
+        assert result["ddlJob"]["status"] == "queued"
+        assert get_ddl_job(result["ddlJob"]["id"])["result"]["id"] == 22
+
+    @patch('models.table_manager.get_db')
+    def test_add_form_waits_for_create_job_behind_earlier_jobs(self, mock_get_db, async_app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [(None,), (21,)]  # OBJECT_ID 確認資料表不存在、新表單 ID
+        seed_catalog([], [])
+        order = []
+
+        def execute(sql, *params):
+            if not sql.startswith("SELECT OBJECT_ID"):
+                order.append(("create", threading.current_thread().name))
+        mock_cursor.execute.side_effect = execute
+
+        with async_app.app_context():
+            enqueue_ddl_job("archive_table", 20, lambda: order.append(("archive", threading.current_thread().name)))
+            result = add_form({"formIdentifier": "queued_form", "formDisplayName": "Q", "formJson": {"Elements": []}})
+
+        # 建立工作排在先前的工作之後，於背景執行緒執行，請求等待其完成
+        assert order == [("archive", "ddl-queue"), ("create", "ddl-queue")]
+        assert result["id"] == 21
+        assert result["ddlJob"]["kind"] == "create_table"
+        assert result["ddlJob"]["status"] == "succeeded"
+        mock_conn.commit.assert_called_once()
+
+
+@patch('models.table_manager.get_db')
+class TestFormDdlJobs:
+    """測試表單改名與刪除的 DDL 工作"""
+
+    @patch('models.form_schema.rename_and_update_form_table')
+    def test_update_form_queues_rename_when_identifier_changes(self, mock_rename, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        # 目前定義 (TableName 為 nchar，含尾端空白) 與 OUTPUT inserted.SchemaVersion
+        mock_cursor.fetchone.side_effect = [('old_form  ', 'N', 0, False, 'NONE', 'H', 1), (2,)]
+        mock_rename.return_value = {"success": True, "table_name": "user_new_form"}
+        previous_json = {"Elements": [{"ElmentType": "Item", "ItemId": "0"}]}
+        mock_cursor.fetchall.return_value = [('H', json.dumps(previous_json))]
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+
+        with app.app_context():
+            result = update_form(4, {"formIdentifier": "new_form", "formDisplayName": "N", "formJson": form_json})
+
+        assert any("OUTPUT inserted.SchemaVersion" in c[0][0] for c in mock_cursor.execute.call_args_list)
+        # 以更新前儲存的結構比對資料表
+        mock_rename.assert_called_once_with("old_form", "new_form", form_json, None, previous_json)
+        assert result["ddlJob"]["kind"] == "rename_table"
+        assert result["ddlJob"]["status"] == "succeeded"
+
+    def test_delete_form_queues_table_archive(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = ('user_gone ',)
+        mock_cursor.fetchall.return_value = []
+        mock_cursor.rowcount = 1
+        seed_catalog([('user_gone', 'user_goneId', 'int', 4, 0, 0, False, None, 'NONE')], [])
+
+        with patch('models.table_manager.archive_form_table') as mock_archive:
+            mock_archive.return_value = {"renamed": True, "table_name": "user_gone_old1"}
+            with app.app_context():
+                job = delete_form(3)
+
+        mock_archive.assert_called_once_with("user_gone", "user_gone_old1")
+        assert job["kind"] == "archive_table"
+        assert job["result"] == {"renamed": True, "table_name": "user_gone_old1"}
+        # 邏輯刪除在加入工作前已提交
+        mock_conn.commit.assert_called_once()
+
+    def test_archive_renames_partitions_before_main_table(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        seed_catalog([
+            ('user_gone', 'user_goneId', 'int', 4, 0, 0, False, None, 'NONE'),
+            ('user_gone_p2', 'user_goneId', 'int', 4, 0, 0, False, 'user_gone', 'NONE')
+        ], [])
+
+        with app.app_context():
+            result = archive_form_table("user_gone", "user_gone_old1")
+
+        assert result == {"renamed": True, "table_name": "user_gone_old1"}
+        statements = [c[0][0] for c in mock_cursor.execute.call_args_list]
+        assert statements[-1] == "EXEC sp_rename 'user_gone', 'user_gone_old1'"
+        assert "EXEC sp_rename N'[dbo].[user_gone_p2]', N'user_gone_old1_p2'" in statements
+        mock_conn.commit.assert_called_once()
+
+
+class TestDdlJobEndpoint:
+    """測試 GET /api/forms/jobs/<job_id>"""
+
+    def test_get_job_status(self, app, form_client):
+        with app.app_context():
+            job = enqueue_ddl_job("create_table", 5, lambda: {"success": True})
+
+        response = form_client.get(f"/api/forms/jobs/{job['id']}")
+
+        assert response.status_code == 200
+        body = response.get_json()["job"]
+        assert body["status"] == "succeeded"
+        assert body["formId"] == 5
+        assert "_target" not in body
+
+    def test_unknown_job_returns_404(self, form_client):
+        response = form_client.get("/api/forms/jobs/does-not-exist")
+
+        assert response.status_code == 404
@@ -0,0 +1,366 @@
+import pytest
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import patch
+from werkzeug.exceptions import HTTPException
+
+# 導入要測試的模組
+from models import form_records
+from models.form_records import copy_form_records, insert_form_records, query_form_records
+from models.table_catalog import _replace_catalog as seed_catalog
+from routes.form_routes import form_bp
+from config import create_app
+
+
+def catalog_column(table, column, references=None):
+    """table catalog 載入查詢的一列 (nvarchar(max) 欄位)"""
+    return (table, column, 'nvarchar', -1, 0, 0, False, references, 'NONE')
+
+
+@pytest.fixture(autouse=True)
+def clear_statement_cache():
+    """每個測試前清空語句快取，並讓範例表單的項目欄位都位於主表，避免測試之間互相影響"""
+    form_records._insert_statements.clear()
+    seed_catalog([catalog_column("user_test_form_001", "Item1"), catalog_column("user_test_form_001", "Item2")], [])
+    yield
+    form_records._insert_statements.clear()
+
+
+@pytest.fixture
+def sample_form_schema():
+    """get_form_schema 的範例回傳值"""
+    return {
+        "id": 1,
+        "formIdentifier": "test_form_001",
+        "schemaHash": "HASH-RECORDS-1",
+        "formJson": {
+            "Elements": [
+                {"ElmentType": "Item", "ItemId": "1"},
+                {"ElmentType": "Group", "Elements": [
+                    {"ElmentType": "Item", "ItemId": "2"}
+                ]}
+            ]
+        }
+    }
+
+
+@patch('models.form_records.get_db')
+@patch('models.form_records.get_form_schema')
+class TestInsertFormRecords:
+    """測試 insert_form_records 函數"""
+
+    def test_insert_batch_uses_fast_executemany(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+
+        records = [
+            {"UserId": 5, "PointInfoId": 7, "CheckDate": "2024-05-01T08:30:00", "Item1": 12.5, "Item2_Remark": "正常"},
+            {"UserId": "6", "Item2": True}
+        ]
+
+        with app.app_context():
+            result = insert_form_records(1, records)
+
+        assert result == {"success": True, "inserted": 2, "table_name": "user_test_form_001"}
+        assert mock_cursor.fast_executemany is True
+        sql, rows = mock_cursor.executemany.call_args[0]
+        assert sql.startswith("INSERT INTO [dbo].[user_test_form_001] ([UserId], [PointInfoId], [ReviewerId], [ReviewerComment], [CheckDate], [TableName], [Item1], [Item1_Remark], [Item2], [Item2_Remark])")
+        assert rows[0] == [5, 7, None, None, datetime(2024, 5, 1, 8, 30), "test_form_001", "12.5", None, None, "正常"]
+        assert rows[1] == [6, None, None, None, None, "test_form_001", None, None, "1", None]
+        mock_conn.commit.assert_called_once()
+        mock_cursor.close.assert_called_once()
+
+    def test_insert_single_record_object(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+
+        with app.app_context():
+            result = insert_form_records(1, {"Item1": "OK"})
+
+        assert result["inserted"] == 1
+        assert len(mock_cursor.executemany.call_args[0][1]) == 1
+
+    def test_insert_statement_is_reused_for_same_schema_version(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+
+        with app.app_context():
+            insert_form_records(1, {"Item1": "A"})
+            insert_form_records(1, {"Item1": "B"})
+
+        first_sql = mock_cursor.executemany.call_args_list[0][0][0]
+        second_sql = mock_cursor.executemany.call_args_list[1][0][0]
+        assert first_sql is second_sql
+
+    def test_invalid_records_are_rejected_without_insert(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+
+        records = [
+            {"Item1": "OK"},
+            {"Item99": "x", "Unknown": 1},
+            {"UserId": "abc", "CheckDate": "not-a-date"},
+            "not-an-object"
+        ]
+
+        with app.app_context():
+            result = insert_form_records(1, records)
+
+        assert result["success"] is False
+        assert [error["index"] for error in result["errors"]] == [1, 2, 3]
+        assert len(result["errors"][1]["messages"]) == 2
+        mock_cursor.executemany.assert_not_called()
+        mock_conn.commit.assert_not_called()
+
+    def test_typed_items_are_coerced_and_validated(self, mock_get_schema, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = {
+            "id": 2,
+            "formIdentifier": "typed_form",
+            "schemaHash": "HASH-TYPED-1",
+            "formJson": {"Elements": [
+                {"ElmentType": "Item", "ItemId": "1", "ItemType": "number"},
+                {"ElmentType": "Item", "ItemId": "2", "ItemType": "checkbox"},
+                {"ElmentType": "Item", "ItemId": "3", "ItemType": "date"},
+                {"ElmentType": "Item", "ItemId": "4", "ItemType": "text", "MaxLength": 5}
+            ]}
+        }
+        seed_catalog([catalog_column("user_typed_form", f"Item{item_id}") for item_id in range(1, 5)], [])
+
+        with app.app_context():
+            result = insert_form_records(2, {"Item1": "12.50", "Item2": "true", "Item3": "2024-05-01", "Item4": "OK"})
+            assert result["success"] is True
+            row = mock_cursor.executemany.call_args[0][1][0]
+            assert row[6:] == [Decimal("12.50"), None, True, None, date(2024, 5, 1), None, "OK", None]
+
+            invalid = insert_form_records(2, [{"Item1": "abc"}, {"Item2": "maybe"}, {"Item4": "too long"}, {"Item1_Remark": "x" * 1001}])
+        assert invalid["success"] is False
+        assert [error["index"] for error in invalid["errors"]] == [0, 1, 2, 3]
+
+    def test_insert_splits_partitioned_form(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        seed_catalog([catalog_column("user_test_form_001", "Item1"),
+                      catalog_column("user_test_form_001_p2", "Item2", references="user_test_form_001")], [])
+
+        with app.app_context():
+            result = insert_form_records(1, [{"UserId": 1, "Item1": "A", "Item2": "B"}])
+
+        assert result["inserted"] == 1
+        assert mock_cursor.fast_executemany is False
+        sql, rows = mock_cursor.executemany.call_args[0]
+        assert "INSERT INTO [dbo].[user_test_form_001] ([UserId], [PointInfoId], [ReviewerId], [ReviewerComment], [CheckDate], [TableName], [Item1], [Item1_Remark])" in sql
+        assert "DECLARE @RecordId int = SCOPE_IDENTITY();" in sql
+        assert "INSERT INTO [dbo].[user_test_form_001_p2] ([user_test_form_001Id], [Item2], [Item2_Remark]) VALUES (@RecordId, ?, ?);" in sql
+        assert rows[0] == [1, None, None, None, None, "test_form_001", "A", None, "B", None]
+
+    def test_form_not_found(self, mock_get_schema, mock_get_db, app):
+        mock_get_schema.return_value = None
+
+        with app.app_context():
+            assert insert_form_records(999, [{"Item1": "x"}]) is None
+
+    def test_empty_batch_is_rejected(self, mock_get_schema, mock_get_db, app):
+        with app.app_context():
+            result = insert_form_records(1, [])
+
+        assert result["success"] is False
+        mock_get_schema.assert_not_called()
+
+    def test_items_without_columns_are_not_cached(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        """表單定義已提交但 DDL 工作尚未新增 Item2 的欄位"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        seed_catalog([catalog_column("user_test_form_001", "Item1")], [])
+        # 重新載入 catalog (欄位定義與索引兩個結果集) 仍沒有 Item2，之後其他 worker 新增了 Item2
+        mock_cursor.fetchall.side_effect = [
+            [catalog_column("user_test_form_001", "Item1")], [],
+            [catalog_column("user_test_form_001", "Item1")], [],
+            [catalog_column("user_test_form_001", "Item1"), catalog_column("user_test_form_001", "Item2")], []
+        ]
+
+        with app.app_context():
+            # 含 Item2 的紀錄返回可重試的 409，不寫入錯誤的欄位
+            with pytest.raises(HTTPException) as excinfo:
+                insert_form_records(1, [{"Item1": "a", "Item2": "b"}])
+            assert excinfo.value.code == 409
+            mock_cursor.executemany.assert_not_called()
+
+            # 未使用 Item2 的紀錄仍可寫入，語句不含 Item2 且不放入快取
+            assert insert_form_records(1, [{"Item1": "a"}])["success"] is True
+            assert "[Item2]" not in mock_cursor.executemany.call_args[0][0]
+            assert form_records._insert_statements == {}
+
+            # 欄位新增後 (其他 worker 的 DDL) 重新建立並快取完整的語句
+            assert insert_form_records(1, [{"Item1": "a", "Item2": "b"}])["success"] is True
+            assert "[Item2]" in mock_cursor.executemany.call_args[0][0]
+            assert len(form_records._insert_statements) == 1
+
+    @patch('models.form_records.abort')
+    def test_database_error_rolls_back(self, mock_abort, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        mock_cursor.executemany.side_effect = Exception("Insert failed")
+
+        with app.app_context():
+            insert_form_records(1, [{"Item1": "x"}])
+
+        mock_conn.rollback.assert_called_once()
+        mock_abort.assert_called_once()
+        mock_cursor.close.assert_called_once()
+
+
+@patch('models.form_records.get_db')
+@patch('models.form_records.get_form_schema')
+class TestQueryFormRecords:
+    """測試 query_form_records 函數"""
+
+    def test_query_with_filters_and_cursor(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        mock_cursor.description = [("user_test_form_001Id",), ("UserId",), ("Item1",)]
+        seed_catalog([catalog_column("user_test_form_001", "Item1"), catalog_column("user_test_form_001", "Item2")], [])
+        mock_cursor.fetchall.return_value = [(30, 5, "OK"), (29, 5, "NG")]
+
+        filters = {
+            "userId": 5,
+            "pointInfoId": None,
+            "checkDateFrom": datetime(2024, 1, 1),
+            "checkDateTo": datetime(2024, 2, 1)
+        }
+        with app.app_context():
+            result = query_form_records(1, filters=filters, after=31, limit=2)
+
+        assert result["records"][0] == {"user_test_form_001Id": 30, "UserId": 5, "Item1": "OK"}
+        assert result["next_cursor"] == 29
+        sql, params = mock_cursor.execute.call_args[0]
+        assert sql == ("SELECT TOP (?) * FROM [dbo].[user_test_form_001] WHERE [UserId] = ? AND [CheckDate] >= ? "
+                       "AND [CheckDate] < ? AND [user_test_form_001Id] < ? ORDER BY [user_test_form_001Id] DESC")
+        assert params == [2, 5, datetime(2024, 1, 1), datetime(2024, 2, 1), 31]
+        mock_cursor.close.assert_called_once()
+
+    def test_query_last_page_has_no_cursor(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        mock_cursor.description = [("user_test_form_001Id",)]
+        mock_cursor.fetchall.return_value = [(3,)]
+
+        with app.app_context():
+            result = query_form_records(1, limit=50)
+
+        assert result["next_cursor"] is None
+        assert "WHERE" not in mock_cursor.execute.call_args[0][0]
+
+    def test_query_joins_partition_tables(self, mock_get_schema, mock_get_db, app, mock_db_connection, sample_form_schema):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = sample_form_schema
+        mock_cursor.description = [("user_test_form_001Id",), ("Item2",)]
+        seed_catalog([catalog_column("user_test_form_001", "Item1"),
+                      catalog_column("user_test_form_001_p2", "Item2", references="user_test_form_001")], [])
+        mock_cursor.fetchall.return_value = [(8, "B")]
+
+        with app.app_context():
+            result = query_form_records(1, filters={"userId": 5}, after=9, limit=10)
+
+        assert result["records"] == [{"user_test_form_001Id": 8, "Item2": "B"}]
+        sql, params = mock_cursor.execute.call_args[0]
+        assert sql == ("SELECT TOP (?) m.*, p2.[Item2], p2.[Item2_Remark] FROM [dbo].[user_test_form_001] AS m "
+                       "LEFT JOIN [dbo].[user_test_form_001_p2] AS p2 ON p2.[user_test_form_001Id] = m.[user_test_form_001Id] "
+                       "WHERE m.[UserId] = ? AND m.[user_test_form_001Id] < ? ORDER BY m.[user_test_form_001Id] DESC")
+        assert params == [10, 5, 9]
+
+    def test_query_form_not_found(self, mock_get_schema, mock_get_db, app):
+        mock_get_schema.return_value = None
+
+        with app.app_context():
+            assert query_form_records(999) is None
+        mock_get_db.assert_not_called()
+
+    @patch('routes.form_routes.query_form_records')
+    def test_endpoint_rejects_invalid_cursor_and_limit(self, mock_query, mock_get_schema, mock_get_db, app):
+        form_app = create_app(dict(app.config), load_env=False)
+        form_app.register_blueprint(form_bp)
+        client = form_app.test_client()
+        mock_query.return_value = {"records": [], "next_cursor": None}
+
+        # 損毀的游標不可被當成第一頁
+        assert client.get('/api/forms/1/records?after=abc').status_code == 400
+        assert client.get('/api/forms/1/records?after=').status_code == 400
+        assert client.get('/api/forms/1/records?limit=ten').status_code == 400
+        mock_query.assert_not_called()
+
+        assert client.get('/api/forms/1/records?after=31&limit=2').status_code == 200
+        mock_query.assert_called_once_with(1, filters={}, after=31, limit=2)
+
+
+@patch('models.form_records.get_db')
+class TestCopyFormRecords:
+    """測試複製表單時的巡檢紀錄複製"""
+
+    def test_copy_in_keyset_batches(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        # ID 為 1、2、1000、1001、50000：每批從上一批的最後一個 ID 之後開始，不掃過空的範圍
+        mock_cursor.fetchone.side_effect = [(1,), (2, 2), (1001, 2), (50000, 1)]
+        seed_catalog([catalog_column("user_src", "user_srcId"), catalog_column("user_src", "TableName"),
+                      catalog_column("user_src", "Item1"),
+                      catalog_column("user_src_p2", "user_srcId", references="user_src"),
+                      catalog_column("user_src_p2", "Item2", references="user_src"),
+                      catalog_column("user_dst", "user_dstId"), catalog_column("user_dst", "TableName"),
+                      catalog_column("user_dst", "Item1"), catalog_column("user_dst", "Item2")], [])
+        app.config['CLONE_RECORDS_BATCH_SIZE'] = 2
+
+        with app.app_context():
+            result = copy_form_records("user_src", "user_dst", "dst")
+
+        assert result == {"copied": 5, "batches": 3}
+        batches = mock_cursor.execute.call_args_list[1:]
+        assert len(batches) == 3
+        sql, params = batches[0][0]
+        assert "SET IDENTITY_INSERT [dbo].[user_dst] ON;" in sql
+        assert ("SELECT TOP (?) [user_srcId] FROM [dbo].[user_src] WHERE [user_srcId] > @last "
+                "ORDER BY [user_srcId]") in sql
+        # 分布在來源分割表的欄位以 LEFT JOIN 取得，TableName 改為新表單
+        assert ("INSERT INTO [dbo].[user_dst] ([user_dstId], [TableName], [Item1], [Item2]) "
+                "SELECT m.[user_srcId], ?, m.[Item1], s1.[Item2] FROM [dbo].[user_src] AS m "
+                "LEFT JOIN [dbo].[user_src_p2] AS s1 ON s1.[user_srcId] = m.[user_srcId] "
+                "WHERE m.[user_srcId] > @last AND m.[user_srcId] <= @high;") in sql
+        assert params == [0, 2, "dst"]
+        assert batches[1][0][1] == [2, 2, "dst"]
+        assert batches[2][0][1] == [1001, 2, "dst"]
+        assert mock_conn.commit.call_count == 3
+
+    def test_empty_source_copies_nothing(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (None,)
+        seed_catalog([catalog_column("user_src", "Item1"), catalog_column("user_dst", "Item1")], [])
+
+        with app.app_context():
+            result = copy_form_records("user_src", "user_dst", "dst")
+
+        assert result == {"copied": 0, "batches": 0}
+        mock_cursor.execute.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+    def test_missing_table_returns_404(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        seed_catalog([catalog_column("user_src", "Item1")], [])
+
+        with app.app_context():
+            with pytest.raises(HTTPException) as excinfo:
+                copy_form_records("user_src", "user_dst", "dst")
+
+        assert excinfo.value.code == 404
@@ -2,13 +2,19 @@ import pytest
 import json
 from unittest.mock import patch, MagicMock, call
 from flask import Flask
+from models.table_catalog import _replace_catalog as seed_catalog
 
 # 導入要測試的模組
 from models.form_schema import (
     collect_items,
+    compile_schema,
+    get_compiled_schema,
     get_configured_db_name,
+    normalize_storage_options,
     create_form_table,
     rename_and_update_form_table,
+    rename_partition_tables,
+    get_item_table_layout,
     update_form_table_schema
 )
 
@@ -86,6 +92,110 @@ class TestCollectItems:
         collect_items(form_json, items)
         assert items == [7]
 
+    def test_collect_items_preserves_document_order(self):
+        form_json = {
+            "Elements": [
+                {"ElmentType": "Group", "Elements": [
+                    {"ElmentType": "Item", "ItemId": "30"},
+                    {"ElmentType": "Item", "ItemId": "10"}
+                ]},
+                {"ElmentType": "Item", "ItemId": "20"},
+                {"ElmentType": "Item", "ItemId": "10"}
+            ]
+        }
+        items = []
+        collect_items(form_json, items)
+        assert items == [30, 10, 20]
+
+    def test_collect_items_deeply_nested_does_not_hit_recursion_limit(self):
+        import sys
+        depth = sys.getrecursionlimit() * 2
+        node = {"ElmentType": "Item", "ItemId": "1"}
+        for _ in range(depth):
+            node = {"ElmentType": "Group", "Elements": [node]}
+        items = []
+        collect_items(node, items)
+        assert items == [1]
+
+    def test_collect_items_keeps_existing_items(self):
+        items = [2]
+        collect_items({"Elements": [{"ElmentType": "Item", "ItemId": "2"}, {"ElmentType": "Item", "ItemId": "3"}]}, items)
+        assert items == [2, 3]
+
+# 測試 compile_schema / get_compiled_schema 函數
+class TestCompiledSchema:
+    def test_compile_schema_collects_ids_labels_types_and_paths(self):
+        form_json = {
+            "Elements": [
+                {"ElmentType": "Group", "Elements": [
+                    {"ElmentType": "Item", "ItemId": "1", "ItemName": "溫度", "ItemType": "number"}
+                ]},
+                {"ElmentType": "Item", "ItemId": "2", "Label": "備註"}
+            ]
+        }
+        compiled = compile_schema(form_json)
+        assert compiled.item_ids == [1, 2]
+        assert len(compiled) == 2
+        first = compiled.items_by_id[1]
+        assert first["label"] == "溫度"
+        assert first["type"] == "number"
+        assert first["path"] == "/Elements/0/Elements/0"
+        assert compiled.items_by_id[2]["label"] == "備註"
+        assert compiled.items_by_id[2]["type"] is None
+        assert compiled.items_by_id[2]["path"] == "/Elements/1"
+
+    def test_get_compiled_schema_reuses_same_version(self):
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "4"}]}
+        first = get_compiled_schema(form_json)
+        assert get_compiled_schema(json.loads(json.dumps(form_json))) is first
+        assert get_compiled_schema(json.dumps(form_json)).item_ids == [4]
+
+        changed = {"Elements": [{"ElmentType": "Item", "ItemId": "5"}]}
+        assert get_compiled_schema(changed).item_ids == [5]
+
+    def test_compile_schema_infers_column_types(self):
+        mock_app = Flask(__name__)
+        form_json = {
+            "Elements": [
+                {"ElmentType": "Item", "ItemId": "1", "ItemType": "Number"},
+                {"ElmentType": "Item", "ItemId": "2", "InputType": "checkbox"},
+                {"ElmentType": "Item", "ItemId": "3", "type": "date"},
+                {"ElmentType": "Item", "ItemId": "4", "ItemType": "text", "MaxLength": 50},
+                {"ElmentType": "Item", "ItemId": "5", "ItemType": "text"},
+                {"ElmentType": "Item", "ItemId": "6", "ItemType": "text", "maxLength": "8000"},
+                {"ElmentType": "Item", "ItemId": "7", "ItemType": "signature"}
+            ]
+        }
+        with mock_app.app_context():
+            compiled = compile_schema(form_json)
+        types = {item_id: (item["kind"], item["sql_type"], item["max_length"]) for item_id, item in compiled.items_by_id.items()}
+        assert types == {
+            1: ("decimal", "[decimal](18, 4)", None),
+            2: ("bit", "[bit]", None),
+            3: ("date", "[date]", None),
+            4: ("text", "[nvarchar](50)", 50),
+            5: ("text", "[nvarchar](255)", 255),
+            6: ("text", "[nvarchar](max)", None),
+            7: (None, "[nvarchar](max)", None)
+        }
+
+# 測試 normalize_storage_options 函數
+class TestNormalizeStorageOptions:
+    def test_defaults_and_normalization(self):
+        assert normalize_storage_options(None) == {"sparse": False, "compression": "NONE"}
+        assert normalize_storage_options({"compression": "page"}) == {"sparse": False, "compression": "PAGE"}
+        assert normalize_storage_options({"sparse": True}) == {"sparse": True, "compression": "NONE"}
+
+    @pytest.mark.parametrize("options", [
+        {"compression": "COLUMNSTORE"},
+        {"sparse": "yes"},
+        {"sparse": True, "compression": "PAGE"},
+        ["PAGE"]
+    ])
+    def test_invalid_options(self, options):
+        with pytest.raises(ValueError):
+            normalize_storage_options(options)
+
 # 測試 get_configured_db_name 函數
 class TestGetConfiguredDbName:
     def test_get_db_name_success(self):
@@ -129,6 +239,133 @@ class TestCreateFormTable:
         mock_conn.commit.assert_called_once()
         mock_cursor.close.assert_called_once()
 
+    def test_create_table_creates_record_indexes_in_same_batch(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {"formIdentifier": "indexed_form", "formJson": {"Elements": []}}
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                create_form_table(form_data)
+
+        create_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        for column in ("CheckDate", "UserId", "PointInfoId", "ReviewerId"):
+            assert f"CREATE NONCLUSTERED INDEX [IX_user_indexed_form_{column}] ON [dbo].[user_indexed_form] ([{column}]);" in create_sql
+
+    def test_create_table_uses_typed_item_columns(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {
+            "formIdentifier": "typed_form",
+            "formJson": {"Elements": [
+                {"ElmentType": "Item", "ItemId": "1", "ItemType": "number"},
+                {"ElmentType": "Item", "ItemId": "2", "ItemType": "checkbox"},
+                {"ElmentType": "Item", "ItemId": "3", "ItemType": "select", "MaxLength": 20}
+            ]}
+        }
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                create_form_table(form_data)
+
+        create_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        assert "[Item1] [decimal](18, 4) NULL, [Item1_Remark] [nvarchar](1000) NULL" in create_sql
+        assert "[Item2] [bit] NULL" in create_sql
+        assert "[Item3] [nvarchar](20) NULL" in create_sql
+        assert "[nvarchar](max)" not in create_sql
+
+    def test_create_table_partitions_wide_forms(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {
+            "formIdentifier": "wide_form",
+            "formJson": {"Elements": [{"ElmentType": "Item", "ItemId": str(i)} for i in range(1, 6)]}
+        }
+        mock_app = Flask(__name__)
+        mock_app.config['FORM_ITEMS_PER_TABLE'] = 2
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                result = create_form_table(form_data)
+
+        assert result['partition_tables'] == ['user_wide_form_p2', 'user_wide_form_p3']
+        drop_sql = mock_cursor.execute.call_args_list[0][0][0]
+        assert "sys.foreign_keys" in drop_sql
+        create_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        main_sql, p2_sql, p3_sql = create_sql.split("CREATE TABLE")[1:]
+        assert "[Item2]" in main_sql and "[Item3]" not in main_sql
+        assert "[user_wide_form_p2]" in p2_sql and "[Item3]" in p2_sql and "[Item4]" in p2_sql
+        assert "FOREIGN KEY ([user_wide_formId])" in p2_sql
+        assert "REFERENCES [dbo].[user_wide_form] ([user_wide_formId]) ON DELETE CASCADE" in p2_sql
+        assert "[Item5]" in p3_sql
+        mock_conn.commit.assert_called_once()
+
+    def test_create_table_with_sparse_item_columns(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {
+            "formIdentifier": "sparse_form",
+            "formJson": {"Elements": [{"ElmentType": "Item", "ItemId": "1", "ItemType": "number"}]},
+            "storageOptions": {"sparse": True}
+        }
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                create_form_table(form_data)
+
+        create_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        assert "[Item1] [decimal](18, 4) SPARSE NULL, [Item1_Remark] [nvarchar](1000) SPARSE NULL" in create_sql
+        assert "[UserId] [int] NULL" in create_sql
+        assert "DATA_COMPRESSION" not in create_sql
+
+    def test_create_table_with_page_compression(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {
+            "formIdentifier": "page_form",
+            "formJson": {"Elements": [{"ElmentType": "Item", "ItemId": str(i)} for i in range(1, 4)]},
+            "storageOptions": {"compression": "PAGE"}
+        }
+        mock_app = Flask(__name__)
+        mock_app.config['FORM_ITEMS_PER_TABLE'] = 2
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                create_form_table(form_data)
+
+        create_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        assert ") ON [PRIMARY] TEXTIMAGE_ON [PRIMARY] WITH (DATA_COMPRESSION = PAGE)" in create_sql
+        assert "CREATE NONCLUSTERED INDEX [IX_user_page_form_CheckDate] ON [dbo].[user_page_form] ([CheckDate]) WITH (DATA_COMPRESSION = PAGE);" in create_sql
+        # 分割表也套用相同的壓縮設定
+        assert create_sql.count("WITH (DATA_COMPRESSION = PAGE)") == 2 + len(("CheckDate", "UserId", "PointInfoId", "ReviewerId"))
+        assert "SPARSE" not in create_sql
+
+    def test_create_table_rejects_conflicting_storage_options(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        form_data = {
+            "formIdentifier": "bad_storage",
+            "formJson": {"Elements": []},
+            "storageOptions": {"sparse": True, "compression": "PAGE"}
+        }
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                with pytest.raises(Exception) as excinfo:
+                    create_form_table(form_data)
+        assert "SPARSE" in str(excinfo.value)
+        mock_cursor.execute.assert_not_called()
+
     def test_create_table_missing_identifier(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
         form_data = {"formJson": {"Elements": []}}
         mock_app = Flask(__name__)
@@ -187,6 +424,18 @@ class TestCreateFormTable:
         assert create_sql_call is not None
         assert "Item1" not in create_sql_call
 
+def live_column(table, column, type_name='nvarchar', max_length=-1, precision=0, scale=0, is_sparse=False,
+                references=None, compression='NONE'):
+    """
+    table catalog 載入查詢的一列
+    (資料表, 欄位, 型別, max_length, precision, scale, is_sparse, 參照的主表, 壓縮設定)
+    """
+    if column.endswith('_Remark') and type_name == 'nvarchar' and max_length == -1:
+        max_length = 2000
+    return (table, column, type_name, max_length, precision, scale, is_sparse, references, compression)
+
+RECORD_INDEXES = ('CheckDate', 'UserId', 'PointInfoId', 'ReviewerId')
+
 # 測試 update_form_table_schema 函數
 @patch('models.form_schema.get_db')
 @patch('models.form_schema.get_configured_db_name')
@@ -196,9 +445,8 @@ class TestUpdateFormTableSchema:
         mock_get_db.return_value = mock_conn
         mock_get_conf_db_name.return_value = 'TestDB'
 
-        # 修正：設定 fetchone 和 fetchall 的行為
-        mock_cursor.fetchone.return_value = (True,)  # 表存在
-        mock_cursor.fetchall.return_value = []  # 現有欄位為空
+        # 表存在但沒有任何 Item 欄位
+        seed_catalog([live_column('user_update_form_01', 'user_update_form_01Id', 'int', 4)], [])
 
         form_identifier = "update_form_01"
         form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
@@ -211,10 +459,98 @@ class TestUpdateFormTableSchema:
         assert "Schema update for user_update_form_01 completed" in result['message']
         assert "Item1" in result['added_columns']
         assert "Item1_Remark" in result['added_columns']
-        mock_cursor.execute.assert_any_call(f"ALTER TABLE [dbo].[user_{form_identifier}] ADD [Item1] [nvarchar](max) NULL, [Item1_Remark] [nvarchar](max) NULL")
+        mock_cursor.execute.assert_any_call(
+            f"SET XACT_ABORT ON;\nALTER TABLE [dbo].[user_{form_identifier}] ADD [Item1] [nvarchar](max) NULL, [Item1_Remark] [nvarchar](1000) NULL;"
+        )
         mock_conn.commit.assert_called_once()
         mock_cursor.close.assert_called_once()
 
+    def test_update_schema_creates_only_missing_record_indexes(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        # 既有 Item 欄位定義與既有索引的第一個鍵欄位
+        seed_catalog(
+            [live_column('user_idx_form', 'Item1'), live_column('user_idx_form', 'Item1_Remark')],
+            [('user_idx_form', 'user_idx_formId'), ('user_idx_form', 'CheckDate'), ('user_idx_form', 'UserId')]
+        )
+
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                result = update_form_table_schema("idx_form", form_json)
+
+        assert result['created_indexes'] == ['IX_user_idx_form_PointInfoId', 'IX_user_idx_form_ReviewerId']
+        index_sql = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE NONCLUSTERED INDEX" in c[0][0])
+        assert "[IX_user_idx_form_CheckDate]" not in index_sql
+        mock_conn.commit.assert_called_once()
+
+    def test_update_schema_fills_partitions_and_creates_new_one(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        seed_catalog(
+            [live_column('user_wide', 'Item1'), live_column('user_wide', 'Item1_Remark'),
+             live_column('user_wide', 'Item2'), live_column('user_wide', 'Item2_Remark'),
+             live_column('user_wide_p2', 'Item3', references='user_wide'),
+             live_column('user_wide_p2', 'Item3_Remark', references='user_wide'),
+             live_column('user_other', 'Item9')],
+            [('user_wide', column) for column in RECORD_INDEXES]
+        )
+
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": str(i)} for i in range(1, 6)]}
+        mock_app = Flask(__name__)
+        mock_app.config['FORM_ITEMS_PER_TABLE'] = 2
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                result = update_form_table_schema("wide", form_json)
+
+        assert result['added_columns'] == ['Item4', 'Item4_Remark', 'Item5', 'Item5_Remark']
+        assert result['partition_tables'] == ['user_wide_p3']
+        batch = next(c[0][0] for c in mock_cursor.execute.call_args_list if "CREATE TABLE" in c[0][0])
+        assert "ALTER TABLE [dbo].[user_wide_p2] ADD [Item4] [nvarchar](max) NULL, [Item4_Remark] [nvarchar](1000) NULL;" in batch
+        assert "[dbo].[user_wide_p3]" in batch and "[Item5]" in batch
+        mock_conn.commit.assert_called_once()
+        # 提交後 catalog 已反映新的欄位與分割表，不需重新查詢
+        mock_cursor.execute.reset_mock()
+        mock_app.config['FORM_ITEMS_PER_TABLE'] = 2
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                result = update_form_table_schema("wide", form_json)
+        assert result['added_columns'] == []
+        mock_cursor.execute.assert_not_called()
+
+    def test_update_schema_applies_storage_options(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_conf_db_name.return_value = 'TestDB'
+
+        # 既有 Item 欄位定義 (未使用 SPARSE，資料表目前為 PAGE 壓縮) 與既有索引
+        seed_catalog(
+            [live_column('user_store', 'Item1', compression='PAGE'), live_column('user_store', 'Item1_Remark', compression='PAGE')],
+            [('user_store', column) for column in RECORD_INDEXES]
+        )
+
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}, {"ElmentType": "Item", "ItemId": "2"}]}
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                result = update_form_table_schema("store", form_json, storage_options={"sparse": True})
+
+        # 啟用 SPARSE 前先解除壓縮
+        assert result['storage_changes'] == [
+            "ALTER INDEX ALL ON [dbo].[user_store] REBUILD WITH (DATA_COMPRESSION = NONE);",
+            "ALTER TABLE [dbo].[user_store] ALTER COLUMN [Item1] ADD SPARSE;",
+            "ALTER TABLE [dbo].[user_store] ALTER COLUMN [Item1_Remark] ADD SPARSE;"
+        ]
+        mock_cursor.execute.assert_any_call(
+            "SET XACT_ABORT ON;\nALTER TABLE [dbo].[user_store] ADD [Item2] [nvarchar](max) SPARSE NULL, [Item2_Remark] [nvarchar](1000) SPARSE NULL;"
+        )
+        mock_conn.commit.assert_called_once()
+
     def test_update_schema_table_not_found(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
         mock_conn, mock_cursor = mock_db_connection
         mock_get_db.return_value = mock_conn
@@ -235,9 +571,11 @@ class TestUpdateFormTableSchema:
         mock_get_db.return_value = mock_conn
         mock_get_conf_db_name.return_value = 'TestDB'
 
-        # 修正：設定 fetchone 和 fetchall 的行為
-        mock_cursor.fetchone.return_value = (True,)  # 表存在
-        mock_cursor.fetchall.return_value = [('Item1',), ('Item1_Remark',)]  # 所有欄位都已存在
+        # 所有欄位都已存在
+        seed_catalog(
+            [live_column('user_existing_cols_form', 'Item1'), live_column('user_existing_cols_form', 'Item1_Remark')],
+            [('user_existing_cols_form', column) for column in RECORD_INDEXES]
+        )
 
         form_identifier = "existing_cols_form"
         form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
@@ -253,14 +591,15 @@ class TestUpdateFormTableSchema:
         # 確保沒有執行 ALTER TABLE
         alter_call_found = any("ALTER TABLE" in c[0][0] for c in mock_cursor.execute.call_args_list)
         assert not alter_call_found
+        # 沒有變更時同樣提交，結束同一連線上先前的交易 (例如只改名的 DDL 工作)
+        mock_conn.commit.assert_called_once()
 
     def test_update_schema_with_existing_cursor(self, mock_get_conf_db_name, mock_get_db, mock_db_connection):
         mock_conn, mock_cursor_passed = mock_db_connection
         mock_get_conf_db_name.return_value = 'TestDB'
 
-        # 修正：設定 fetchone 和 fetchall 的行為
-        mock_cursor_passed.fetchone.return_value = (True,)  # 表存在
-        mock_cursor_passed.fetchall.return_value = []  # 現有欄位為空
+        # 表存在但沒有任何 Item 欄位
+        seed_catalog([live_column('user_form_with_cursor', 'user_form_with_cursorId', 'int', 4)], [])
 
         form_identifier = "form_with_cursor"
         form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
@@ -288,12 +627,11 @@ class TestRenameAndUpdateFormTable:
         mock_get_conf_db_name.return_value = 'TestDB'
         mock_update_schema.return_value = {"message": "Schema updated", "added_columns": ["Item1"]}
 
-        # 模擬舊表存在，新表不存在
-        mock_cursor.fetchone.side_effect = [
-            (True,),  # 舊表存在
-            None,     # 新表不存在
-            (True,)   # 舊 ID 欄位存在 (用於 sp_rename column)
-        ]
+        # 舊表 (含舊 ID 欄位) 與其分割表存在，新表不存在
+        seed_catalog([
+            live_column('user_old_form', 'user_old_formId', 'int', 4),
+            live_column('user_old_form_p2', 'user_old_formId', 'int', 4, references='user_old_form')
+        ], [])
 
         old_id = "old_form"
         new_id = "new_form"
@@ -302,14 +640,23 @@ class TestRenameAndUpdateFormTable:
         mock_app = Flask(__name__)
         with mock_app.app_context():
             with patch('models.form_schema.current_app', mock_app):
-                result = rename_and_update_form_table(old_id, new_id, form_json)
+                result = rename_and_update_form_table(old_id, new_id, form_json, previous_form_json=form_json)
 
         assert result['success'] is True
         assert f"Table renamed to user_{new_id}" in result['message']
         # 檢查 sp_rename 是否被呼叫
         assert any("EXEC sp_rename '[dbo].[user_old_form]'" in c[0][0] for c in mock_cursor.execute.call_args_list)
-        mock_update_schema.assert_called_once_with(new_id, form_json, db_name_param='TestDB')
+        mock_cursor.execute.assert_any_call("EXEC sp_rename N'[dbo].[user_new_form].[user_old_formId]', N'user_new_formId', 'COLUMN'")
+        # 以更新前的結構比對，不會轉換既有欄位的型別
+        mock_update_schema.assert_called_once_with(new_id, form_json, db_name_param='TestDB', storage_options=None,
+                                                   previous_form_json=form_json)
         mock_cursor.close.assert_called_once()
+        # 改名在更新結構前提交
+        mock_conn.commit.assert_called_once()
+        # catalog 已反映改名後的資料表與分割表
+        with mock_app.app_context():
+            layout = get_item_table_layout(mock_cursor, 'user_new_form')
+        assert [name for _, name, _ in layout] == ['user_new_form', 'user_new_form_p2']
 
     def test_rename_identifiers_same_calls_update_only(self, mock_update_schema, mock_get_conf_db_name, mock_get_db):
         mock_get_conf_db_name.return_value = 'TestDB'
@@ -322,7 +669,8 @@ class TestRenameAndUpdateFormTable:
             with patch('models.form_schema.current_app', mock_app):
                 rename_and_update_form_table(form_id, form_id, form_json)
 
-        mock_update_schema.assert_called_once_with(form_id, form_json, db_name_param='TestDB')
+        mock_update_schema.assert_called_once_with(form_id, form_json, db_name_param='TestDB', storage_options=None,
+                                                   previous_form_json=None)
         mock_get_db.assert_not_called()
 
     def test_rename_old_table_not_found_calls_update_only(self, mock_update_schema, mock_get_conf_db_name, mock_get_db, mock_db_connection):
@@ -330,7 +678,7 @@ class TestRenameAndUpdateFormTable:
         mock_get_db.return_value = mock_conn
         mock_get_conf_db_name.return_value = 'TestDB'
 
-        mock_cursor.fetchone.return_value = None  # 舊表不存在
+        seed_catalog([], [])  # 舊表不存在
 
         old_id = "non_existent_old"
         new_id = "new_from_non_existent"
@@ -341,7 +689,8 @@ class TestRenameAndUpdateFormTable:
             with patch('models.form_schema.current_app', mock_app):
                 rename_and_update_form_table(old_id, new_id, form_json)
 
-        mock_update_schema.assert_called_once_with(new_id, form_json, db_name_param='TestDB')
+        mock_update_schema.assert_called_once_with(new_id, form_json, db_name_param='TestDB', storage_options=None,
+                                                   previous_form_json=None)
         # 檢查 sp_rename 是否未被呼叫
         assert not any("EXEC sp_rename" in c[0][0] for c in mock_cursor.execute.call_args_list)
         # 修正：由於 update_form_table_schema 內部可能會關閉 cursor，所以不檢查 close 次數
@@ -352,10 +701,8 @@ class TestRenameAndUpdateFormTable:
         mock_get_db.return_value = mock_conn
         mock_get_conf_db_name.return_value = 'TestDB'
 
-        mock_cursor.fetchone.side_effect = [
-            (True,),  # 舊表存在
-            (True,)   # 新表已存在
-        ]
+        # 舊表與新表都已存在
+        seed_catalog([live_column('user_old_form_conflict', 'Item1'), live_column('user_new_form_conflict', 'Item1')], [])
 
         old_id = "old_form_conflict"
         new_id = "new_form_conflict"
@@ -370,6 +717,8 @@ class TestRenameAndUpdateFormTable:
         assert "already exists" in str(excinfo.value)
         mock_update_schema.assert_not_called()
         mock_cursor.close.assert_called_once()
+        mock_conn.commit.assert_not_called()
+        mock_conn.rollback.assert_called_once()
 
     def test_rename_db_name_not_configured_aborts(self, mock_update_schema, mock_get_conf_db_name, mock_get_db):
         mock_get_conf_db_name.side_effect = ValueError("DB_NAME is not configured.")
@@ -381,4 +730,25 @@ class TestRenameAndUpdateFormTable:
                     rename_and_update_form_table("old", "new", {})
         assert "Database name not configured" in str(excinfo.value)
         mock_update_schema.assert_not_called()
-        mock_get_db.assert_not_called()
\ No newline at end of file
+        mock_get_db.assert_not_called()
+
+
+# 測試 rename_partition_tables 函數
+class TestRenamePartitionTables:
+    def test_rename_partition_tables_and_key_columns(self, mock_db_connection):
+        _, mock_cursor = mock_db_connection
+        seed_catalog([
+            live_column('user_old', 'user_oldId', 'int', 4),
+            live_column('user_old_p2', 'user_oldId', 'int', 4, references='user_old'),
+            live_column('user_old_p3', 'user_oldId', 'int', 4, references='user_old'),
+            live_column('unrelated', 'user_oldId', 'int', 4, references='user_old')
+        ], [])
+
+        mock_app = Flask(__name__)
+        with mock_app.app_context():
+            with patch('models.form_schema.current_app', mock_app):
+                renamed = rename_partition_tables(mock_cursor, 'user_old', 'user_new')
+
+        assert renamed == [('user_old_p2', 'user_new_p2'), ('user_old_p3', 'user_new_p3')]
+        mock_cursor.execute.assert_any_call("EXEC sp_rename N'[dbo].[user_old_p2].[user_oldId]', N'user_newId', 'COLUMN'")
+        mock_cursor.execute.assert_any_call("EXEC sp_rename N'[dbo].[user_old_p3]', N'user_new_p3'")
@@ -0,0 +1,53 @@
+import pytest
+
+# 導入要測試的模組
+from models.json_patch import JsonPatchError, apply_json_patch, operation_paths, parse_pointer, pointer_overlaps
+
+
+class TestApplyJsonPatch:
+    """測試 RFC 6902 操作"""
+
+    def test_operations_do_not_modify_input(self):
+        document = {"Elements": [{"ItemId": "1", "ItemName": "溫度"}, {"ItemId": "2"}]}
+
+        patched = apply_json_patch(document, [
+            {"op": "replace", "path": "/Elements/0/ItemName", "value": "壓力"},
+            {"op": "add", "path": "/Elements/-", "value": {"ItemId": "3"}},
+            {"op": "remove", "path": "/Elements/1"},
+            {"op": "copy", "from": "/Elements/0/ItemName", "path": "/Title"},
+            {"op": "move", "from": "/Title", "path": "/Subtitle"},
+            {"op": "test", "path": "/Subtitle", "value": "壓力"}
+        ])
+
+        assert patched == {"Elements": [{"ItemId": "1", "ItemName": "壓力"}, {"ItemId": "3"}], "Subtitle": "壓力"}
+        assert document == {"Elements": [{"ItemId": "1", "ItemName": "溫度"}, {"ItemId": "2"}]}
+
+    def test_add_inserts_into_array(self):
+        assert apply_json_patch({"a": [1, 3]}, [{"op": "add", "path": "/a/1", "value": 2}]) == {"a": [1, 2, 3]}
+
+    def test_pointer_escapes(self):
+        assert parse_pointer("/a~1b/c~0d") == ["a/b", "c~d"]
+        assert apply_json_patch({"a/b": 1}, [{"op": "replace", "path": "/a~1b", "value": 2}]) == {"a/b": 2}
+
+    @pytest.mark.parametrize("operations", [
+        [{"op": "replace", "path": "/missing", "value": 1}],
+        [{"op": "remove", "path": "/a/5"}],
+        [{"op": "add", "path": "/a/01", "value": 1}],
+        [{"op": "test", "path": "/a/0", "value": 2}],
+        [{"op": "move", "from": "/a", "path": "/a/0"}],
+        [{"op": "add", "path": "a", "value": 1}],
+        [{"op": "replace", "path": "/a"}],
+        [{"op": "merge", "path": "/a", "value": 1}],
+        {"op": "add", "path": "/b", "value": 1}
+    ])
+    def test_invalid_operations_raise(self, operations):
+        with pytest.raises(JsonPatchError):
+            apply_json_patch({"a": [1]}, operations)
+
+
+def test_operation_paths_and_overlap():
+    assert operation_paths([{"op": "move", "from": "/a", "path": "/b"}, {"op": "remove", "path": "/c"}]) == ["/b", "/a", "/c"]
+    assert pointer_overlaps("/Elements/1", "/Elements/1/ItemName")
+    assert pointer_overlaps("/Elements/1/ItemName", "/Elements")
+    assert not pointer_overlaps("/Elements/1", "/Elements/10")
+    assert pointer_overlaps("", "/Elements/1")
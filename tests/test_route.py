@@ -9,8 +9,27 @@ from models.route import (
     get_all_routes, 
     create_route, 
     update_route, 
-    delete_route
+    delete_route,
+    bulk_apply_routes,
+    reconcile_route_bindings
 )
+from models.route_cache import invalidate_route_cache
+from models.search_index import invalidate_search_index
+
+
+@pytest.fixture(autouse=True)
+def route_queries_without_cache(app):
+    """
+    既有測試驗證直接查詢資料庫的路徑 (資料表超過快取上限時使用)，因此停用路線快取與搜尋索引；
+    TestRouteCache 與 TestRouteSearchIndex 另外啟用。每個測試前後清空快照與索引，避免測試之間互相影響
+    """
+    app.config['ROUTE_CACHE_MAX_ROWS'] = 0
+    app.config['SEARCH_INDEX_MAX_DOCS'] = 0
+    invalidate_route_cache()
+    invalidate_search_index()
+    yield
+    invalidate_route_cache()
+    invalidate_search_index()
 
 class TestGetRouteById:
     """測試 get_route_by_id 函數"""
@@ -394,4 +413,284 @@ class TestRouteAPIEndpoints:
         assert response.status_code == 200
         data = response.get_json()
         assert data['success'] is True
-        assert "路線創建成功" in data['message']
\ No newline at end of file
+        assert "路線創建成功" in data['message']
+
+
+@patch('models.route.get_db')
+class TestRouteCache:
+    """測試路線快照快取"""
+
+    ROWS = [(1, '北區路線', 10, 'user_north'), (2, '南區路線', None, None), (3, '北區夜巡', 11, 'user_night')]
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, app):
+        app.config['ROUTE_CACHE_MAX_ROWS'] = 10
+
+    VERSION = (3, 3, 1234)
+
+    def test_snapshot_serves_id_lookup_search_and_mode(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = self.ROWS
+        mock_cursor.fetchone.return_value = self.VERSION
+
+        with app.app_context():
+            assert get_route_by_id(2)["RouteName"] == '南區路線'
+            assert get_route_by_id(99) is None
+            result = get_all_routes(page=1, limit=1, search="北區", mode="1")
+
+        # 整個資料表只查詢一次 (多取一筆判斷是否超過上限)，其餘讀取只查詢版本
+        sqls = [c[0][0] for c in mock_cursor.execute.call_args_list]
+        loads = [c for c in mock_cursor.execute.call_args_list if "ORDER BY RouteId" in c[0][0]]
+        assert len(loads) == 1 and loads[0][0][1] == 11
+        assert sum("CHECKSUM_AGG" in sql for sql in sqls) == 3
+        assert result["total_records"] == 2
+        assert [route["RouteId"] for route in result["routes"]] == [1]
+
+    def test_changes_from_other_workers_reload_snapshot(self, mock_get_db, app, mock_db_connection):
+        """其他 worker 行程的異動不會清除本行程的快照，由版本不同發現並重新載入"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = self.ROWS
+        mock_cursor.fetchone.return_value = self.VERSION
+
+        with app.app_context():
+            assert get_route_by_id(2)["RouteName"] == '南區路線'
+            mock_cursor.fetchall.return_value = [self.ROWS[0], (2, '南區日巡', None, None), self.ROWS[2]]
+            mock_cursor.fetchone.return_value = (3, 3, 5678)
+            mock_cursor.execute.reset_mock()
+            assert get_route_by_id(2)["RouteName"] == '南區日巡'
+
+        assert "ORDER BY RouteId" in mock_cursor.execute.call_args[0][0]
+
+    def test_create_update_delete_invalidate_snapshot(self, mock_get_db, app, mock_db_connection, sample_route_data):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = self.ROWS
+
+        with app.app_context():
+            get_route_by_id(1)
+            for change in (lambda: create_route(sample_route_data), lambda: update_route(1, sample_route_data),
+                           lambda: delete_route(1)):
+                change()
+                mock_cursor.execute.reset_mock()
+                get_route_by_id(1)
+                # 異動後重新載入快照
+                assert "ORDER BY RouteId" in mock_cursor.execute.call_args[0][0]
+
+    def test_large_table_falls_back_to_queries(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        app.config['ROUTE_CACHE_MAX_ROWS'] = 2
+        mock_cursor.fetchall.return_value = self.ROWS
+        mock_cursor.fetchone.return_value = (3, '北區夜巡', 11, 'user_night')
+
+        with app.app_context():
+            assert get_route_by_id(3)["RouteId"] == 3
+            mock_cursor.execute.reset_mock()
+            get_route_by_id(3)
+
+        # 超過上限後在快照過期前不再嘗試載入整表
+        mock_cursor.execute.assert_called_once()
+        assert "WHERE RouteId = ?" in mock_cursor.execute.call_args[0][0]
+
+
+@patch('models.route.get_db')
+class TestRouteIncludeForm:
+    """測試 include=form 以同一查詢附上綁定表單"""
+
+    FORM_ROWS = [
+        (1, '北區路線', 10, 'user_north', 10, 'north      ', '北區表單', 0, 3, 'HASH-ROUTE-FORM'),
+        (2, '南區路線', 99, 'user_gone', None, None, None, None, None, None),
+        (3, '北區夜巡', 10, 'user_north', 10, 'north      ', '北區表單', 0, 3, 'HASH-ROUTE-FORM')
+    ]
+
+    def test_list_joins_table_manager_in_data_query(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        app.config['ROUTE_CACHE_MAX_ROWS'] = 10
+        mock_cursor.fetchone.return_value = (3,)
+        mock_cursor.fetchall.return_value = self.FORM_ROWS
+
+        with app.app_context():
+            result = get_all_routes(page=1, limit=10, include_form=True)
+
+        # 不使用路線快照：計數 + 含 JOIN 的資料查詢
+        calls = mock_cursor.execute.call_args_list
+        assert len(calls) == 2
+        assert "LEFT JOIN [RoutinInspection_dev].[dbo].[TableManager] t" in calls[1][0][0]
+        assert "JOIN" not in calls[0][0][0]
+        assert result["routes"][0]["form"] == {"id": 10, "dbName": "north", "eFormName": "北區表單", "mode": 0, "version": 3}
+        assert result["routes"][1]["form"] is None
+
+    @patch('models.table_manager.get_form_item_indexes')
+    def test_items_are_resolved_once_per_form(self, mock_item_indexes, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (3,)
+        mock_cursor.fetchall.return_value = self.FORM_ROWS
+        mock_item_indexes.return_value = {10: [{"id": 1, "label": "溫度", "type": None, "path": "/Elements/0"}]}
+
+        with app.app_context():
+            result = get_all_routes(include_items=True)
+
+        mock_item_indexes.assert_called_once_with(mock_cursor, [(10, 'HASH-ROUTE-FORM')])
+        assert result["routes"][2]["form"]["items"][0]["label"] == "溫度"
+
+    def test_single_route_with_form(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = self.FORM_ROWS[0]
+
+        with app.app_context():
+            route = get_route_by_id(1, include_form=True)
+
+        sql, route_id = mock_cursor.execute.call_args[0]
+        assert "WHERE r.[RouteId] = ?" in sql and route_id == 1
+        assert route["form"]["eFormName"] == "北區表單"
+
+
+@patch('models.route.get_db')
+class TestBulkRoutes:
+    """測試 POST /api/routes/bulk 的批次新增、更新與刪除"""
+
+    def test_bulk_changes_are_staged_and_applied_in_one_transaction(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        # MERGE / DELETE 的 OUTPUT：(Seq, RouteId)；Seq 2 (RouteId 8) 不存在
+        mock_cursor.fetchall.return_value = [(0, 41), (1, 7), (3, 9)]
+        upserts = [
+            {"RouteName": "新路線", "BindingTableId": None, "BindingTableName": None},
+            {"RouteId": 7, "RouteName": "改名路線", "BindingTableId": 10, "BindingTableName": "user_a"},
+            {"RouteId": 8, "RouteName": "不存在"}
+        ]
+
+        with app.app_context():
+            result = bulk_apply_routes(upserts, [9])
+
+        assert result["success"] is True
+        assert result["results"]["upserts"] == [
+            {"index": 0, "RouteId": 41, "status": "created"},
+            {"index": 1, "RouteId": 7, "status": "updated"},
+            {"index": 2, "RouteId": 8, "status": "not_found"}
+        ]
+        assert result["results"]["deletes"] == [{"index": 0, "RouteId": 9, "status": "deleted"}]
+        assert mock_cursor.fast_executemany is True
+        staged = mock_cursor.executemany.call_args[0][1]
+        assert staged[1] == (1, 'U', 7, "改名路線", 10, "user_a")
+        assert staged[3] == (3, 'D', 9, None, None, None)
+        assert "MERGE [RoutinInspection_dev].[dbo].[Routes]" in mock_cursor.execute.call_args[0][0]
+        mock_conn.commit.assert_called_once()
+
+    def test_invalid_items_are_reported_without_writing(self, mock_get_db, app):
+        with app.app_context():
+            result = bulk_apply_routes([{"RouteId": 3, "RouteName": "A"}, {"BindingTableId": "x"}], [3, "y"])
+
+        assert result["success"] is False
+        assert [(error["op"], error["index"]) for error in result["errors"]] == [("upsert", 1), ("delete", 0), ("delete", 1)]
+        mock_get_db.assert_not_called()
+
+    def test_bulk_invalidates_route_cache_once(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = []
+
+        with patch('models.route.invalidate_route_cache') as mock_invalidate:
+            with app.app_context():
+                bulk_apply_routes([{"RouteName": "A"}, {"RouteName": "B"}], [1, 2])
+
+        mock_invalidate.assert_called_once()
+
+    def test_endpoint_returns_400_with_item_errors(self, mock_get_db, app):
+        from config import create_app
+        from routes.route_routes import route_bp
+        route_app = create_app(dict(app.config), load_env=False)
+        route_app.register_blueprint(route_bp)
+
+        response = route_app.test_client().post('/api/routes/bulk', json={"upserts": [{}]})
+
+        assert response.status_code == 400
+        assert response.get_json()["errors"][0]["messages"] == ["缺少必要字段: RouteName"]
+
+
+@patch('models.route.get_db')
+class TestReconcileRouteBindings:
+    """測試 POST /api/routes/bindings/reconcile"""
+
+    def test_reconcile_updates_all_routes_and_invalidates_cache(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.rowcount = 5
+
+        with patch('models.route.invalidate_route_cache') as mock_invalidate:
+            with app.app_context():
+                result = reconcile_route_bindings()
+
+        assert result == {"success": True, "updated": 5}
+        sql = mock_cursor.execute.call_args[0][0]
+        assert "JOIN [RoutinInspection_dev].[dbo].[TableManager] AS t ON t.TableManagerId = r.[BindingTableId]" in sql
+        assert "t.TableManagerId = ?" not in sql
+        mock_conn.commit.assert_called_once()
+        mock_invalidate.assert_called_once()
+
+
+@patch('models.route.get_db')
+class TestRouteSearchIndex:
+    """測試以 n-gram 索引搜尋路線"""
+
+    DOCS = [(1, '北區路線', 'user_north'), (2, '南區路線', None), (3, '北區夜巡', 'user_night')]
+
+    @pytest.fixture(autouse=True)
+    def enable_index(self, app):
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 10
+
+    def test_search_filters_by_indexed_ids(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.side_effect = [self.DOCS, [(3, '北區夜巡', 11, 'user_night')]]
+        mock_cursor.fetchone.return_value = (2,)
+
+        with app.app_context():
+            result = get_all_routes(page=1, limit=10, search="USER_N")
+
+        calls = mock_cursor.execute.call_args_list
+        assert len(calls) == 3  # 載入索引 + count + data query
+        count_sql, ids_param = calls[1][0]
+        assert "OPENJSON(?)" in count_sql
+        assert "LIKE" not in count_sql
+        assert json.loads(ids_param) == [1, 3]
+        assert result["total_records"] == 2
+
+    def test_no_match_skips_queries(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = self.DOCS
+
+        with app.app_context():
+            result = get_all_routes(page=1, limit=10, search="西區")
+
+        mock_cursor.execute.assert_called_once()
+        assert result == {"routes": [], "total_records": 0}
+
+    def test_writes_update_index_without_reload(self, mock_get_db, app, mock_db_connection, sample_route_data):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.side_effect = [self.DOCS, []]
+        mock_cursor.fetchone.return_value = (0,)
+
+        with app.app_context():
+            get_all_routes(page=1, limit=10, search="北區")
+            mock_cursor.fetchone.return_value = (7,)
+            create_route({**sample_route_data, "RouteName": "西區路線"})
+            mock_cursor.rowcount = 1
+            update_route(2, {**sample_route_data, "RouteName": "東區路線"})
+            delete_route(1)
+            mock_cursor.reset_mock()
+            mock_cursor.fetchone.return_value = (0,)
+            mock_cursor.fetchall.side_effect = None
+            mock_cursor.fetchall.return_value = []
+            get_all_routes(page=1, limit=10, search="區路線")
+
+        # 索引沒有重新載入，第一個查詢即為 count query
+        assert json.loads(mock_cursor.execute.call_args_list[0][0][1]) == [2, 7]
+
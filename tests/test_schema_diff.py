@@ -0,0 +1,251 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+
+# 導入要測試的模組
+from models.form_schema import compile_schema
+from models.schema_diff import build_migration_batch, migrate_form_table, plan_schema_changes
+from models.table_catalog import _replace_catalog as seed_catalog
+from routes.form_routes import form_bp
+from config import create_app
+
+
+def live_column(table, column, type_name='nvarchar', max_length=-1, precision=0, scale=0, is_sparse=False,
+                references=None, compression='NONE'):
+    """
+    table catalog 載入查詢的一列
+    (資料表, 欄位, 型別, max_length, precision, scale, is_sparse, 參照的主表, 壓縮設定)
+    """
+    return (table, column, type_name, max_length, precision, scale, is_sparse, references, compression)
+
+
+def item(item_id, label=None, item_type=None):
+    """表單 JSON 中的一個項目元素"""
+    element = {"ElmentType": "Item", "ItemId": str(item_id)}
+    if label:
+        element["ItemName"] = label
+    if item_type:
+        element["ItemType"] = item_type
+    return element
+
+
+@pytest.fixture
+def schema_app():
+    """提供 current_app 的最小應用程式"""
+    mock_app = Flask(__name__)
+    with mock_app.app_context():
+        with patch('models.form_schema.current_app', mock_app):
+            yield mock_app
+
+
+@pytest.fixture
+def form_client(app):
+    """註冊表單藍圖的測試客戶端"""
+    form_app = create_app(dict(app.config), load_env=False)
+    form_app.register_blueprint(form_bp)
+    return form_app.test_client()
+
+
+class TestPlanSchemaChanges:
+    """測試 plan_schema_changes 的比對結果與遷移語句"""
+
+    def test_detects_added_removed_retyped_and_renamed_items(self, schema_app, mock_db_cursor):
+        seed_catalog([
+            live_column('user_f', 'user_fId', 'int', 4),
+            live_column('user_f', 'Item1'), live_column('user_f', 'Item1_Remark', max_length=2000),
+            live_column('user_f', 'Item2'), live_column('user_f', 'Item2_Remark', max_length=2000),
+            live_column('user_f', 'Item3'), live_column('user_f', 'Item3_Remark', max_length=2000),
+        ], [])
+        previous = compile_schema({"Elements": [item(1, "溫度", "text"), item(2, "壓力"), item(3, "備註")]})
+        compiled = compile_schema({"Elements": [item(1, "溫度", "number"), item(20, "壓力"), item(4, "新項目")]})
+
+        plan = plan_schema_changes(mock_db_cursor, 'user_f', compiled, previous)
+
+        assert plan["retyped"] == [{"id": 1, "from": "[nvarchar](max)", "to": "[decimal](18, 4)"}]
+        assert plan["renamed"] == [{"from": 2, "to": 20}]
+        assert plan["removed"] == [3]
+        assert plan["added"] == [4]
+        assert plan["statements"] == [
+            "ALTER TABLE [dbo].[user_f] ALTER COLUMN [Item1] [decimal](18, 4) NULL;",
+            "EXEC sp_rename N'[dbo].[user_f].[Item2]', N'Item20', 'COLUMN';",
+            "EXEC sp_rename N'[dbo].[user_f].[Item2_Remark]', N'Item20_Remark', 'COLUMN';",
+            "ALTER TABLE [dbo].[user_f] DROP COLUMN [Item3], [Item3_Remark];",
+            "ALTER TABLE [dbo].[user_f] ADD [Item4] [nvarchar](max) NULL, [Item4_Remark] [nvarchar](1000) NULL;",
+        ]
+        # 比對使用 table catalog，整個遷移只需要一次往返
+        assert build_migration_batch(plan).startswith("SET XACT_ABORT ON;\n")
+        mock_db_cursor.execute.assert_not_called()
+        assert ("rename_column", "user_f", "Item2", "Item20") in plan["catalog_changes"]
+        assert ("drop_column", "user_f", "Item3") in plan["catalog_changes"]
+
+    def test_only_items_limits_diff_to_touched_items(self, schema_app, mock_db_cursor):
+        seed_catalog([
+            live_column('user_f', 'user_fId', 'int', 4),
+            live_column('user_f', 'Item1'), live_column('user_f', 'Item1_Remark', max_length=2000),
+            live_column('user_f', 'Item2'),
+            live_column('user_f', 'Item3'), live_column('user_f', 'Item3_Remark', max_length=2000),
+        ], [])
+        compiled = compile_schema({"Elements": [item(1, "溫度", "number"), item(2), item(5)]})
+
+        plan = plan_schema_changes(mock_db_cursor, 'user_f', compiled, only_items={1, 5})
+
+        # Item2 缺少的 Remark、Item3 的移除不在範圍內
+        assert plan["retyped"] == [{"id": 1, "from": "[nvarchar](max)", "to": "[decimal](18, 4)"}]
+        assert plan["removed"] == []
+        assert plan["added"] == [5]
+        assert not any("Item2_Remark" in statement or "Item3" in statement for statement in plan["statements"])
+
+    def test_unchanged_definition_keeps_legacy_column_type(self, schema_app, mock_db_cursor):
+        seed_catalog([
+            live_column('user_f', 'Item1'), live_column('user_f', 'Item1_Remark', max_length=2000)
+        ], [])
+        form_json = {"Elements": [item(1, "溫度", "number")]}
+
+        plan = plan_schema_changes(mock_db_cursor, 'user_f', compile_schema(form_json), compile_schema(form_json))
+
+        assert plan["statements"] == []
+        assert build_migration_batch(plan) == ""
+
+    def test_adds_missing_remark_and_inherits_sparse(self, schema_app, mock_db_cursor):
+        seed_catalog([live_column('user_f', 'Item1', is_sparse=True)], [])
+        compiled = compile_schema({"Elements": [item(1), item(2)]})
+
+        plan = plan_schema_changes(mock_db_cursor, 'user_f', compiled)
+
+        assert plan["statements"] == [
+            "ALTER TABLE [dbo].[user_f] ADD [Item1_Remark] [nvarchar](1000) SPARSE NULL, "
+            "[Item2] [nvarchar](max) SPARSE NULL, [Item2_Remark] [nvarchar](1000) SPARSE NULL;"
+        ]
+
+    def test_keep_removed_columns_when_drop_disabled(self, schema_app, mock_db_cursor):
+        seed_catalog([
+            live_column('user_f', 'Item1'), live_column('user_f', 'Item1_Remark', max_length=2000)
+        ], [])
+
+        plan = plan_schema_changes(mock_db_cursor, 'user_f', compile_schema({"Elements": []}), drop_removed=False)
+
+        assert plan["removed"] == []
+        assert plan["statements"] == []
+
+
+@patch('models.schema_diff.get_db')
+@patch('models.schema_diff.get_form_schema')
+class TestSchemaPlanEndpoint:
+    """測試 POST /api/forms/<id>/schema/plan"""
+
+    def test_plan_returns_statements_without_executing(self, mock_get_schema, mock_get_db, form_client, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = {
+            "id": 3, "formIdentifier": "plan_form", "schemaHash": "HASH-PLAN-1",
+            "formJson": {"Elements": [item(1)]}
+        }
+        # 第一次 fetchall 為 catalog 的欄位定義，第二次為索引
+        mock_cursor.fetchall.side_effect = [
+            [live_column('user_plan_form', 'Item1'), live_column('user_plan_form', 'Item1_Remark', max_length=2000)],
+            []
+        ]
+
+        response = form_client.post('/api/forms/3/schema/plan', json={"formJson": {"Elements": [item(1), item(2)]}})
+
+        assert response.status_code == 200
+        plan = response.get_json()["plan"]
+        assert plan["added"] == [2]
+        assert plan["sql"] == ("SET XACT_ABORT ON;\nALTER TABLE [dbo].[user_plan_form] ADD "
+                               "[Item2] [nvarchar](max) NULL, [Item2_Remark] [nvarchar](1000) NULL;")
+        assert "catalog_changes" not in plan
+        # dry-run 只載入一次 table catalog，不執行遷移也不提交
+        mock_cursor.execute.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+    def test_plan_reloads_stale_catalog(self, mock_get_schema, mock_get_db, form_client, mock_db_connection):
+        """其他 worker 行程已加入 Item2：快取中的欄位定義過期，dry-run 仍以重新載入的結果比對"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = {
+            "id": 3, "formIdentifier": "plan_form", "schemaHash": "HASH-PLAN-1",
+            "formJson": {"Elements": [item(1)]}
+        }
+        seed_catalog([live_column('user_plan_form', 'Item1'), live_column('user_plan_form', 'Item1_Remark', max_length=2000)], [])
+        mock_cursor.fetchall.side_effect = [
+            [live_column('user_plan_form', 'Item1'), live_column('user_plan_form', 'Item1_Remark', max_length=2000),
+             live_column('user_plan_form', 'Item2'), live_column('user_plan_form', 'Item2_Remark', max_length=2000)],
+            []
+        ]
+
+        response = form_client.post('/api/forms/3/schema/plan', json={"formJson": {"Elements": [item(1), item(2)]}})
+
+        assert response.status_code == 200
+        plan = response.get_json()["plan"]
+        assert plan["added"] == []
+        assert plan["sql"] == ""
+
+    def test_plan_form_not_found(self, mock_get_schema, mock_get_db, form_client):
+        mock_get_schema.return_value = None
+
+        response = form_client.post('/api/forms/999/schema/plan', json={})
+
+        assert response.status_code == 404
+        mock_get_db.assert_not_called()
+
+    def test_plan_rejects_invalid_form_json(self, mock_get_schema, mock_get_db, form_client):
+        response = form_client.post('/api/forms/3/schema/plan', json={"formJson": "{not json"})
+
+        assert response.status_code == 400
+        mock_get_schema.assert_not_called()
+
+
+@patch('models.form_schema.get_db')
+@patch('models.schema_diff.get_form_schema')
+class TestMigrateFormTable:
+    """測試 POST /api/forms/<id>/schema/migrate 使用的 migrate_form_table"""
+
+    def test_migrate_keeps_legacy_columns_like_plan(self, mock_get_schema, mock_get_db, app, mock_db_connection):
+        """以儲存的結構作為前一版，不轉換型別推斷之前建立的 nvarchar(max) 欄位 (與 dry-run 相同)"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = {
+            "id": 3, "formIdentifier": "legacy_form", "schemaHash": "HASH-LEGACY",
+            "formJson": {"Elements": [item(1, "溫度", "number")]}
+        }
+        seed_catalog([
+            live_column('user_legacy_form', 'Item1'), live_column('user_legacy_form', 'Item1_Remark', max_length=2000),
+            live_column('user_legacy_form', 'Item9')
+        ], [])
+
+        with app.app_context():
+            with patch('models.form_schema.get_configured_db_name', return_value='TestDB'):
+                job = migrate_form_table(3)
+
+        # 遷移由 DDL 佇列執行 (測試中於請求中直接執行)
+        assert job["kind"] == "migrate_schema"
+        assert job["status"] == "succeeded"
+        result = job["result"]
+        assert result["retyped_items"] == []
+        # 已不在表單中的項目預設保留欄位
+        assert result["removed_items"] == []
+        assert result["retained_items"] == [9]
+        assert not any("ALTER COLUMN" in c[0][0] or "DROP" in c[0][0] for c in mock_cursor.execute.call_args_list)
+        mock_conn.commit.assert_called_once()
+
+    def test_migrate_drops_removed_items_when_requested(self, mock_get_schema, mock_get_db, app, mock_db_connection):
+        """dropRemoved=true 時才移除已不在表單中的項目欄位"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = {
+            "id": 3, "formIdentifier": "legacy_form", "schemaHash": "HASH-LEGACY",
+            "formJson": {"Elements": [item(1, "溫度", "number")]}
+        }
+        seed_catalog([
+            live_column('user_legacy_form', 'Item1'), live_column('user_legacy_form', 'Item1_Remark', max_length=2000),
+            live_column('user_legacy_form', 'Item9')
+        ], [])
+
+        with app.app_context():
+            with patch('models.form_schema.get_configured_db_name', return_value='TestDB'):
+                job = migrate_form_table(3, drop_removed=True)
+
+        result = job["result"]
+        assert result["removed_items"] == [9]
+        assert result["retained_items"] == []
+        assert any("DROP" in c[0][0] for c in mock_cursor.execute.call_args_list)
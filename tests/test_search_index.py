@@ -0,0 +1,121 @@
+import pytest
+from unittest.mock import Mock, patch
+
+# 導入要測試的模組
+from models.search_index import NgramIndex, invalidate_search_index, search_ids, search_loader
+
+
+@pytest.fixture
+def loaded_index():
+    index = NgramIndex("test")
+    assert index.load([(1, "北區路線\nuser_North"), (2, "南區路線"), (3, "北區夜巡\nuser_night")], 60, index.generation)
+    return index
+
+
+class TestNgramIndex:
+    """測試 n-gram 反向索引"""
+
+    def test_short_query_uses_posting_lookup(self, loaded_index):
+        assert loaded_index.search("北區") == {1, 3}
+        assert loaded_index.search("線") == {1, 2}
+        assert loaded_index.search("") == {1, 2, 3}
+
+    def test_long_query_intersects_trigrams_case_insensitive(self, loaded_index):
+        assert loaded_index.search("USER_N") == {1, 3}
+        assert loaded_index.search("user_north") == {1}
+        assert loaded_index.search("區路線") == {1, 2}
+        assert loaded_index.search("不存在的路線") == set()
+
+    def test_query_does_not_match_across_fields(self, loaded_index):
+        # 兩個欄位以換行分隔，"線user" 不應相符
+        assert loaded_index.search("路線user") == set()
+
+    def test_upsert_and_remove(self, loaded_index):
+        loaded_index.upsert(2, "西區路線")
+        loaded_index.upsert(4, "北區新路線")
+        loaded_index.remove(1)
+
+        assert loaded_index.search("南區") == set()
+        assert loaded_index.search("西區路線") == {2}
+        assert loaded_index.search("北區") == {3, 4}
+
+    def test_unloaded_or_oversized_index_returns_none(self):
+        index = NgramIndex("test")
+        assert index.search("北區") is None
+        # 尚未載入時的寫入只遞增世代
+        index.upsert(1, "北區")
+        assert index.search("北區") is None
+
+        assert index.load(None, 60, index.generation)
+        assert index.is_fresh()
+        assert index.search("北區") is None
+
+    def test_load_is_discarded_after_concurrent_write(self):
+        index = NgramIndex("test")
+        generation = index.generation
+        index.remove(1)
+
+        assert not index.load([(1, "北區")], 60, generation)
+        assert not index.is_fresh()
+
+    def test_invalidate_clears_index(self, loaded_index):
+        loaded_index.invalidate()
+
+        assert not loaded_index.is_fresh()
+        assert loaded_index.search("北區") is None
+
+
+class TestSearchIds:
+    """測試索引載入與停用設定"""
+
+    @pytest.fixture(autouse=True)
+    def reset_indexes(self, app):
+        max_docs = app.config.get('SEARCH_INDEX_MAX_DOCS')
+        invalidate_search_index()
+        yield
+        invalidate_search_index()
+        app.config['SEARCH_INDEX_MAX_DOCS'] = max_docs
+
+    def test_index_is_loaded_once_and_reused(self, app):
+        loader = Mock(return_value=[(1, "北區路線"), (2, "南區路線")])
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 10
+
+        with patch.dict('models.search_index._loaders', {"routes": loader}):
+            with app.app_context():
+                assert search_ids("routes", "北區", Mock()) == {1}
+                assert search_ids("routes", "路線", Mock()) == {1, 2}
+
+        # 多取一筆判斷是否超過上限
+        loader.assert_called_once()
+        assert loader.call_args[0][1] == 11
+
+    def test_oversized_table_falls_back(self, app):
+        loader = Mock(return_value=[(1, "北區"), (2, "南區"), (3, "西區")])
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 2
+
+        with patch.dict('models.search_index._loaders', {"routes": loader}):
+            with app.app_context():
+                assert search_ids("routes", "北區", Mock()) is None
+                assert search_ids("routes", "北區", Mock()) is None
+
+        # 過大的結果同樣保存到過期，不會每次搜尋都重新載入
+        loader.assert_called_once()
+
+    def test_disabled_index_does_not_query(self, app):
+        loader = Mock()
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 0
+
+        with patch.dict('models.search_index._loaders', {"routes": loader}):
+            with app.app_context():
+                assert search_ids("routes", "北區", Mock()) is None
+
+        loader.assert_not_called()
+
+    def test_search_loader_registers_function(self):
+        with patch.dict('models.search_index._loaders', {}):
+            @search_loader("users")
+            def load_users(cursor, limit):
+                return []
+
+            from models.search_index import _loaders
+            assert _loaders["users"] is load_users
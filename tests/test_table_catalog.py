@@ -0,0 +1,150 @@
+import pytest
+from unittest.mock import patch
+
+# 導入要測試的模組
+from models import table_catalog
+from models.table_catalog import (
+    apply_catalog_changes,
+    find_table_names,
+    get_catalog_table,
+    get_table_family,
+    invalidate_table_catalog,
+    table_exists,
+    _replace_catalog
+)
+
+
+def catalog_column(table, column, type_name='nvarchar', max_length=-1, is_sparse=False, references=None, compression='NONE'):
+    """table catalog 載入查詢的一列"""
+    return (table, column, type_name, max_length, 0, 0, is_sparse, references, compression)
+
+
+@pytest.fixture
+def catalog_cursor(mock_db_cursor):
+    """第一次 fetchall 為欄位定義，第二次為索引的 cursor"""
+    mock_db_cursor.fetchall.side_effect = [
+        [catalog_column('user_f', 'user_fId', 'int', 4), catalog_column('USER_F', 'Item1', max_length=510),
+         catalog_column('user_f_p2', 'user_fId', 'int', 4, references='user_f'),
+         catalog_column('user_f_p2', 'Item2', 'decimal')],
+        [('user_f', 'user_fId'), ('user_f', 'CheckDate')]
+    ]
+    return mock_db_cursor
+
+
+class TestLoadTableCatalog:
+    """測試 catalog 的載入與重新載入"""
+
+    def test_loads_all_user_tables_in_one_round_trip(self, app, catalog_cursor):
+        with app.app_context():
+            table = get_catalog_table(catalog_cursor, 'User_F')
+            assert table_exists(catalog_cursor, 'user_f_p2')
+            assert not table_exists(catalog_cursor, 'user_missing')
+            family = [entry["name"] for entry in get_table_family(catalog_cursor, 'user_f')]
+
+        assert table["columns"]["item1"] == {"name": "Item1", "sql_type": "[nvarchar](255)", "sparse": False}
+        assert table["indexed_columns"] == {"user_fId", "CheckDate"}
+        assert sorted(family) == ['user_f', 'user_f_p2']
+        # 載入一次 catalog；catalog 中沒有的資料表只以 OBJECT_ID 確認
+        assert catalog_cursor.execute.call_count == 2
+        assert "sys.tables" in catalog_cursor.execute.call_args_list[0][0][0]
+        assert catalog_cursor.execute.call_args_list[1][0] == ("SELECT OBJECT_ID(?, N'U')", ('[dbo].[user_missing]',))
+
+    def test_table_created_by_another_process_is_reloaded(self, app, catalog_cursor):
+        """其他 worker 行程建立的資料表不在本行程的 catalog 中，確認存在後重新載入"""
+        _replace_catalog([], [])
+        catalog_cursor.fetchone.return_value = (1234,)
+
+        with app.app_context():
+            assert table_exists(catalog_cursor, 'user_f')
+            family = [entry["name"] for entry in get_table_family(catalog_cursor, 'user_f')]
+
+        assert sorted(family) == ['user_f', 'user_f_p2']
+        assert catalog_cursor.execute.call_count == 2
+
+    def test_reloads_after_ttl(self, app, catalog_cursor):
+        with app.app_context():
+            get_catalog_table(catalog_cursor, 'user_f')
+            with patch.object(table_catalog.time, 'monotonic', return_value=table_catalog._catalog_loaded_at + 301):
+                catalog_cursor.fetchall.side_effect = [[], []]
+                assert get_catalog_table(catalog_cursor, 'user_f') is None
+        # 初次載入、過期後重新載入與 OBJECT_ID 確認
+        assert catalog_cursor.execute.call_count == 3
+
+    def test_invalidate_forces_reload(self, app, catalog_cursor):
+        with app.app_context():
+            get_catalog_table(catalog_cursor, 'user_f')
+            invalidate_table_catalog()
+            catalog_cursor.fetchall.side_effect = [[], []]
+            assert not table_exists(catalog_cursor, 'user_f')
+
+    def test_non_user_tables_are_queried_directly(self, app, mock_db_cursor):
+        mock_db_cursor.fetchone.return_value = (1234,)
+        mock_db_cursor.fetchall.return_value = [('legacy_old1',)]
+
+        with app.app_context():
+            assert table_exists(mock_db_cursor, 'legacy')
+            assert find_table_names(mock_db_cursor, 'legacy_old') == ['legacy_old1']
+
+        assert "OBJECT_ID" in mock_db_cursor.execute.call_args_list[0][0][0]
+        assert mock_db_cursor.execute.call_args_list[1][0][1] == (len('legacy_old'), 'legacy_old')
+
+
+class TestApplyCatalogChanges:
+    """測試 DDL 提交後的 catalog 更新"""
+
+    def test_rename_table_updates_partition_references(self, app, mock_db_cursor):
+        _replace_catalog([
+            catalog_column('user_old', 'user_oldId', 'int', 4),
+            catalog_column('user_old_p2', 'user_oldId', 'int', 4, references='user_old')
+        ], [('user_old', 'user_oldId')])
+        before = get_catalog_table(mock_db_cursor, 'user_old')
+
+        apply_catalog_changes([
+            ("rename_column", "user_old_p2", "user_oldId", "user_newId"),
+            ("rename_table", "user_old_p2", "user_new_p2"),
+            ("rename_table", "user_old", "user_new"),
+            ("rename_column", "user_new", "user_oldId", "user_newId")
+        ])
+
+        with app.app_context():
+            assert get_catalog_table(mock_db_cursor, 'user_old') is None
+            assert sorted(entry["name"] for entry in get_table_family(mock_db_cursor, 'user_new')) == ['user_new', 'user_new_p2']
+            renamed = get_catalog_table(mock_db_cursor, 'user_new')
+        assert renamed["indexed_columns"] == {"user_newId"}
+        assert "user_newid" in get_catalog_table(mock_db_cursor, 'user_new_p2')["columns"]
+        # 已取得的內容不受後續變更影響
+        assert before["name"] == 'user_old' and "user_oldid" in before["columns"]
+        # 只有改名前的名稱以 OBJECT_ID 確認 (不存在)，沒有重新載入
+        mock_db_cursor.execute.assert_called_once()
+        assert "OBJECT_ID" in mock_db_cursor.execute.call_args[0][0]
+
+    def test_column_changes(self, app, mock_db_cursor):
+        _replace_catalog([catalog_column('user_f', 'Item1'), catalog_column('user_f', 'Item2')], [])
+
+        apply_catalog_changes([
+            ("alter_column", "user_f", "Item1", "[decimal](18, 4)", True),
+            ("drop_column", "user_f", "Item2"),
+            ("add_column", "user_f", "Item3", "[bit]", False),
+            ("add_index", "user_f", "UserId"),
+            ("set_compression", "user_f", "PAGE"),
+            ("create_table", "user_g", None, [("user_gId", "[int]", False)], ["user_gId"], "NONE"),
+            ("drop_table", "user_missing")
+        ])
+
+        with app.app_context():
+            table = get_catalog_table(mock_db_cursor, 'user_f')
+            assert table_exists(mock_db_cursor, 'user_g')
+        assert table["columns"]["item1"] == {"name": "Item1", "sql_type": "[decimal](18, 4)", "sparse": True}
+        assert "item2" not in table["columns"]
+        assert table["columns"]["item3"]["sql_type"] == "[bit]"
+        assert table["indexed_columns"] == {"UserId"}
+        assert table["compression"] == "PAGE"
+
+    def test_changes_are_ignored_before_first_load(self, app, mock_db_cursor):
+        apply_catalog_changes([("create_table", "user_g", None, [], [], "NONE")])
+
+        mock_db_cursor.fetchall.side_effect = [[], []]
+        with app.app_context():
+            assert not table_exists(mock_db_cursor, 'user_g')
+        # 載入 catalog 與 OBJECT_ID 確認
+        assert mock_db_cursor.execute.call_count == 2
@@ -0,0 +1,945 @@
+import pytest
+import json
+from unittest.mock import patch
+from werkzeug.exceptions import HTTPException
+
+# 導入要測試的模組
+from models.table_manager import (
+    add_form,
+    delete_form,
+    clone_form,
+    patch_form,
+    get_all_forms,
+    get_form_by_id,
+    get_form_items,
+    get_form_item_indexes,
+    get_form_raw_by_id,
+    update_form,
+    update_form_mode,
+    search_department,
+    _escape_like,
+    _generate_unique_table_name
+)
+from models.form_cache import (
+    get_cached_schema, store_cached_schema, clear_schema_cache, schema_content_hash,
+    invalidate_department_index
+)
+from models.table_catalog import _replace_catalog as seed_catalog, table_exists
+from models.search_index import invalidate_search_index
+from routes.form_routes import form_bp
+from config import create_app
+
+
+@pytest.fixture(autouse=True)
+def clear_form_cache():
+    """每個測試前後清空行程內快取，避免測試互相影響"""
+    clear_schema_cache()
+    invalidate_department_index()
+    yield
+    clear_schema_cache()
+    invalidate_department_index()
+
+
+def current_form_row(table_name='f', display_name='F', items_cnt=0, sparse=False, compression='NONE',
+                     schema_hash=None, version=1):
+    """update_form 讀取目前定義的查詢結果"""
+    return (table_name, display_name, items_cnt, sparse, compression, schema_hash, version)
+
+
+@pytest.fixture
+def form_client(app):
+    """註冊表單藍圖的測試客戶端"""
+    form_app = create_app(dict(app.config), load_env=False)
+    form_app.register_blueprint(form_bp)
+    return form_app.test_client()
+
+
+class TestSchemaCache:
+    """測試 SchemaContent 解析快取"""
+
+    @patch('models.table_manager.get_db')
+    def test_get_all_forms_fetches_missing_schemas_once(self, mock_get_db, app, mock_db_connection):
+        """快取未命中時以單一查詢讀取內容，再次查詢時不再讀取 SchemaContent"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+
+        list_rows = [(1, 'user_a', '表單A', 1, 'HASH1'), (2, 'user_b', '表單B', 0, 'HASH2')]
+        content_rows = [('HASH1', json.dumps({"Elements": []})), ('HASH2', json.dumps({"Elements": [1]}))]
+        mock_cursor.fetchone.return_value = (2,)
+        mock_cursor.fetchall.side_effect = [list_rows, content_rows, list_rows]
+
+        with app.app_context():
+            first = get_all_forms(page=1, limit=10, include_schema=True)
+            second = get_all_forms(page=1, limit=10, include_schema=True)
+
+        assert first == second
+        assert first['total'] == 2
+        assert first['forms'][1]['formJson'] == {"Elements": [1]}
+        assert first['forms'][0]['dbName'] == 'user_a'
+        assert first['forms'][0]['eFormName'] == '表單A'
+
+        content_queries = [c for c in mock_cursor.execute.call_args_list if "FROM SchemaBlob" in c[0][0]]
+        assert len(content_queries) == 1
+        assert content_queries[0][0][1] == ['HASH1', 'HASH2']
+
+    @patch('models.table_manager.get_db')
+    def test_get_form_by_id_hash_mismatch_refetches(self, mock_get_db, app, mock_db_connection):
+        """內容雜湊改變時重新讀取並解析"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        store_cached_schema('OLD', {"Elements": ["old"]})
+
+        mock_cursor.fetchone.return_value = (5, 'user_c', '表單C', 1, 'NEW')
+        mock_cursor.fetchall.return_value = [('NEW', json.dumps({"Elements": ["new"]}))]
+
+        with app.app_context():
+            form = get_form_by_id(5)
+
+        assert form['formJson'] == {"Elements": ["new"]}
+        assert get_cached_schema('NEW') == {"Elements": ["new"]}
+
+    @patch('models.table_manager.get_db')
+    def test_null_schema_content_skips_fetch(self, mock_get_db, app, mock_db_connection):
+        """SchemaContent 為 NULL 時不需額外查詢"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (6, 'user_d', '表單D', 1, None)
+
+        with app.app_context():
+            form = get_form_by_id(6)
+
+        assert form['formJson'] is None
+        assert mock_cursor.execute.call_count == 1
+
+    @patch('models.table_manager.get_db')
+    def test_update_form_writes_schema_blob_and_caches_it(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "3"}]}
+        content_hash = schema_content_hash(json.dumps(form_json))
+        mock_cursor.fetchone.side_effect = [current_form_row(schema_hash='H'), (2,)]  # 目前定義、OUTPUT inserted.SchemaVersion
+
+        with app.app_context():
+            update_form(7, {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': form_json})
+
+        update_sql, params = next(c[0] for c in mock_cursor.execute.call_args_list if "UPDATE TableManager" in c[0][0])
+        assert "INSERT INTO SchemaBlob" in update_sql
+        assert "SchemaContent = ?" not in update_sql
+        assert params[:3] == (content_hash, content_hash, json.dumps(form_json))
+        assert get_cached_schema(content_hash) == form_json
+
+    @patch('models.table_manager.get_db')
+    def test_forms_with_identical_content_share_parsed_schema(self, mock_get_db, app, mock_db_connection):
+        """內容相同的表單只讀取、解析一次，並共用同一個解析結果"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.side_effect = [
+            [(1, 'user_a', 'A', 1, 'SAME'), (2, 'user_b', 'B', 1, 'SAME')],
+            [('SAME', json.dumps({"Elements": ["shared"]}))]
+        ]
+        mock_cursor.fetchone.return_value = (2,)
+
+        with app.app_context():
+            result = get_all_forms(page=1, limit=10, include_schema=True)
+
+        first, second = result['forms']
+        assert first['formJson'] is second['formJson']
+        blob_sql, params = mock_cursor.execute.call_args_list[-1][0]
+        assert "FROM SchemaBlob" in blob_sql
+        assert params == ['SAME']
+
+
+class TestFormListProjection:
+    """測試表單列表的欄位投影"""
+
+    @patch('models.table_manager.get_db')
+    def test_get_all_forms_default_skips_schema_content(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(1, 'user_a', '表單A', 1)]
+        mock_cursor.fetchone.return_value = (1,)
+
+        with app.app_context():
+            result = get_all_forms(page=1, limit=10)
+
+        assert result['forms'] == [{"id": 1, "dbName": 'user_a', "eFormName": '表單A', "mode": 1}]
+        assert not any("SchemaContent" in c[0][0] for c in mock_cursor.execute.call_args_list)
+
+    @patch('models.table_manager.get_db')
+    def test_get_all_forms_selects_requested_fields_only(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(1, 0)]
+        mock_cursor.fetchone.return_value = (1,)
+
+        with app.app_context():
+            result = get_all_forms(page=1, limit=10, fields={"mode"})
+
+        assert result['forms'] == [{"id": 1, "mode": 0}]
+        list_sql = mock_cursor.execute.call_args_list[0][0][0]
+        assert "TableManagerId, TestMode" in list_sql
+        assert "DisplayName" not in list_sql
+
+    @patch('models.table_manager.get_db')
+    def test_get_all_forms_search_uses_index(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.side_effect = [
+            [(1, '1A01 溫度巡檢', 'user_temp  '), (2, '1A01 壓力巡檢', 'user_press'), (3, '2B02 溫度', 'user_t2')],
+            [(1, 'user_temp', '1A01 溫度巡檢', 1), (3, 'user_t2', '2B02 溫度', 1)]
+        ]
+        mock_cursor.fetchone.return_value = (2,)
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 10
+        invalidate_search_index("forms")
+
+        try:
+            with app.app_context():
+                result = get_all_forms(page=1, limit=10, search="溫度")
+        finally:
+            app.config['SEARCH_INDEX_MAX_DOCS'] = 0
+            invalidate_search_index("forms")
+
+        assert result['total'] == 2
+        list_sql, list_params = mock_cursor.execute.call_args_list[1][0]
+        assert "OPENJSON(?)" in list_sql
+        assert json.loads(list_params[0]) == [1, 3]
+        assert mock_cursor.execute.call_args_list[2][0][1] == list_params[:1]
+
+    @patch('models.table_manager.get_db')
+    def test_get_all_forms_search_falls_back_to_like(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = []
+        mock_cursor.fetchone.return_value = (0,)
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 0
+
+        with app.app_context():
+            get_all_forms(page=1, limit=10, search="50%")
+
+        list_sql, list_params = mock_cursor.execute.call_args_list[0][0]
+        assert "DisplayName LIKE ? ESCAPE" in list_sql
+        assert list_params == ('%50\\%%', '%50\\%%', 0, 10)
+
+    @patch('routes.form_routes.get_all_forms')
+    def test_get_forms_endpoint_parses_include_and_fields(self, mock_get_all, form_client):
+        mock_get_all.return_value = {"forms": [], "total": 0}
+
+        response = form_client.get('/api/forms?page=2&limit=5&fields=eFormName,formJson')
+
+        assert response.status_code == 200
+        mock_get_all.assert_called_once_with(page=2, limit=5, include_schema=True, fields={"eFormName"}, search=None)
+
+    def test_get_forms_endpoint_rejects_unknown_fields(self, form_client):
+        response = form_client.get('/api/forms?fields=SchemaContent')
+
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+
+
+class TestRawSchemaPassThrough:
+    """測試 SchemaContent 原樣輸出"""
+
+    @patch('models.table_manager.get_db')
+    def test_get_form_raw_validates_once(self, mock_get_db, app, mock_db_connection):
+        """同一內容版本只驗證一次"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        raw = '{"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}'
+        mock_cursor.fetchone.return_value = (3, 'user_x', '表單X', 1, raw, 'H3', 5)
+
+        with app.app_context():
+            with patch('models.table_manager.json.loads', wraps=json.loads) as mock_loads:
+                first = get_form_raw_by_id(3)
+                second = get_form_raw_by_id(3)
+
+        assert first == ({"id": 3, "dbName": 'user_x', "eFormName": '表單X', "mode": 1, "version": 5}, raw)
+        assert second == first
+        assert mock_loads.call_count == 1
+
+    @patch('models.table_manager.get_db')
+    def test_get_form_raw_invalid_json_returns_empty_object(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (4, 'user_y', '表單Y', 0, '{broken', 'H4', 1)
+
+        with app.app_context():
+            _, schema_text = get_form_raw_by_id(4)
+
+        assert schema_text == "{}"
+
+    def test_schema_content_hash_matches_sql_server_hashbytes(self):
+        """Python 端雜湊需與 CONVERT(char(64), HASHBYTES('SHA2_256', N'{}'), 2) 相同"""
+        assert schema_content_hash("{}") == "BBAA971BC41901DB6F76AEA6EC5F59B97567AA1FCAE8B7ABC2533F1375BC61BE"
+
+    @patch('models.table_manager.get_db')
+    def test_update_form_marks_written_schema_validated(self, mock_get_db, app, mock_db_connection):
+        """寫入時已驗證的內容，讀取時不需再解析"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "2"}]}
+        raw = json.dumps(form_json)
+        mock_cursor.fetchone.side_effect = [current_form_row(), (2,)]
+
+        with app.app_context():
+            update_form(9, {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': form_json})
+            mock_cursor.fetchone.side_effect = None
+            mock_cursor.fetchone.return_value = (9, 'f', 'F', 1, raw, schema_content_hash(raw), 2)
+            with patch('models.table_manager.json.loads') as mock_loads:
+                _, schema_text = get_form_raw_by_id(9)
+
+        assert schema_text == raw
+        mock_loads.assert_not_called()
+
+    @patch('routes.form_routes.get_form_raw_by_id')
+    def test_get_form_endpoint_embeds_raw_json(self, mock_get_raw, form_client):
+        raw = '{"Elements":[{"ElmentType":"Item","ItemId":"9"}]}'
+        mock_get_raw.return_value = ({"id": 1, "dbName": "user_z", "eFormName": "表單Z", "mode": 1, "version": 3}, raw)
+
+        response = form_client.get('/api/forms/1')
+
+        assert response.status_code == 200
+        assert raw.encode() in response.data
+        data = response.get_json()
+        assert data['success'] is True
+        assert data['form']['eFormName'] == "表單Z"
+        assert data['form']['formJson'] == json.loads(raw)
+
+    @patch('routes.form_routes.get_form_raw_by_id')
+    def test_get_form_endpoint_not_found(self, mock_get_raw, form_client):
+        mock_get_raw.return_value = None
+
+        response = form_client.get('/api/forms/999')
+
+        assert response.status_code == 404
+        assert response.get_json()['success'] is False
+
+
+class TestSearchDepartment:
+    """測試部門代碼搜尋"""
+
+    @patch('models.table_manager.get_db')
+    def test_search_department_uses_prefix_like_and_paginates(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(i, f'user_{i}', f'A1B2表單{i}', 1) for i in range(1, 6)]
+
+        with app.app_context():
+            result = search_department('A1B2', page=2, limit=2)
+
+        assert result['total'] == 5
+        assert [f['id'] for f in result['forms']] == [3, 4]
+        sql, params = mock_cursor.execute.call_args[0]
+        assert "LIKE ?" in sql
+        assert "SUBSTRING" not in sql
+        assert params == ('A1B2%',)
+
+    @patch('models.table_manager.get_db')
+    def test_search_department_served_from_index_until_forms_change(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(1, 'user_1', 'A1B2表單', 1)]
+
+        with app.app_context():
+            search_department('A1B2')
+            search_department('A1B2', page=1, limit=5)
+            assert mock_cursor.execute.call_count == 1
+
+            update_form_mode(1, 0)
+            search_department('A1B2')
+
+        like_queries = [c for c in mock_cursor.execute.call_args_list if "LIKE" in c[0][0]]
+        assert len(like_queries) == 2
+
+    @patch('models.table_manager.get_db')
+    def test_results_loaded_during_invalidation_are_not_stored(self, mock_get_db, app, mock_db_connection):
+        """查詢期間表單已變更時，查詢到的 (可能是舊的) 結果不寫入索引"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+
+        def rows_then_invalidate():
+            invalidate_department_index()
+            return [(1, 'user_1', 'A1B2表單', 1)]
+        mock_cursor.fetchall.side_effect = rows_then_invalidate
+
+        with app.app_context():
+            search_department('A1B2')
+            search_department('A1B2')
+
+        assert mock_cursor.execute.call_count == 2
+
+    @patch('models.form_cache.DEPARTMENT_INDEX_SIZE', 2)
+    @patch('models.table_manager.get_db')
+    def test_index_keeps_most_recent_department_codes(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = []
+
+        with app.app_context():
+            for code in ('A001', 'A002', 'A001', 'A003'):
+                search_department(code)
+            mock_cursor.execute.reset_mock()
+            search_department('A001')
+            search_department('A003')
+            assert mock_cursor.execute.call_count == 0
+            # A002 最久未使用，已被移除
+            search_department('A002')
+            assert mock_cursor.execute.call_count == 1
+
+    @patch('models.table_manager.get_db')
+    def test_page_below_one_is_rejected(self, mock_get_db, app, form_client):
+        with app.app_context():
+            with pytest.raises(HTTPException) as excinfo:
+                search_department('A1B2', page=0)
+        assert excinfo.value.code == 400
+
+        for query in ('code=A1B2&page=0', 'code=A1B2&page=1&limit=0', 'code=A1B2&page=x', 'code=A1B'):
+            response = form_client.get(f'/api/search-department?{query}')
+            assert response.status_code == 400
+        mock_get_db.assert_not_called()
+
+    def test_escape_like_wildcards(self):
+        assert _escape_like('A_%[') == 'A\\_\\%\\['
+
+
+class TestGenerateUniqueTableName:
+    """測試 _oldN 流水號配置"""
+
+    def test_returns_first_free_counter_with_single_query(self, mock_db_cursor):
+        # TableManager 中的名稱由查詢取得，實際資料表的名稱由 table catalog 取得
+        mock_db_cursor.fetchall.return_value = [
+            ('user_form_old1',), ('USER_FORM_OLD2  ',), ('user_form_old03',), ('user_form_older',)
+        ]
+        seed_catalog([('user_form_old4', 'user_form_old4Id', 'int', 4, 0, 0, False, None, 'NONE'),
+                      ('user_other_old3', 'user_other_old3Id', 'int', 4, 0, 0, False, None, 'NONE')], [])
+
+        new_name = _generate_unique_table_name(mock_db_cursor, 'user_form')
+
+        assert new_name == 'user_form_old3'
+        mock_db_cursor.execute.assert_called_once()
+        sql, params = mock_db_cursor.execute.call_args[0]
+        assert "INFORMATION_SCHEMA" not in sql
+        assert params == ('user\\_form\\_old%',)
+
+    def test_returns_old1_when_no_archived_copies(self, mock_db_cursor):
+        mock_db_cursor.fetchall.return_value = []
+
+        assert _generate_unique_table_name(mock_db_cursor, 'user_form') == 'user_form_old1'
+
+
+@patch('models.table_manager.get_db')
+class TestFormStorageOptions:
+    """測試表單儲存選項 (SPARSE / DATA_COMPRESSION) 的保存"""
+
+    def test_add_form_persists_storage_options(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [(None,), (12,)]  # OBJECT_ID 確認資料表不存在、新表單 ID
+        seed_catalog([], [])
+
+        form_data = {
+            "formIdentifier": "store_form",
+            "formDisplayName": "Store",
+            "formJson": {"Elements": []},
+            "storageOptions": {"compression": "page"}
+        }
+        with app.app_context():
+            result = add_form(form_data)
+
+        assert result["id"] == 12
+        insert_sql, params = mock_cursor.execute.call_args_list[-1][0]
+        assert "SparseItems, DataCompression" in insert_sql
+        assert params[-2:] == (False, "PAGE")
+        assert "WITH (DATA_COMPRESSION = PAGE)" in insert_sql
+
+    def test_add_form_rejects_invalid_storage_options(self, mock_get_db, app):
+        with app.app_context():
+            with pytest.raises(Exception) as excinfo:
+                add_form({"formIdentifier": "x", "formDisplayName": "X", "storageOptions": {"compression": "ZIP"}})
+        assert "compression" in str(excinfo.value)
+        mock_get_db.assert_not_called()
+
+    @patch('models.form_schema.apply_table_storage_options')
+    def test_update_form_applies_storage_options(self, mock_apply, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        # 結構未變更，只調整儲存選項
+        mock_cursor.fetchone.side_effect = [current_form_row('store_form', 'Store', schema_hash=schema_content_hash('{}')), (2,)]
+
+        form_data = {"formIdentifier": "store_form", "formDisplayName": "Store", "formJson": {}, "storageOptions": {"sparse": True}}
+        with app.app_context():
+            update_form(5, form_data)
+
+        params = mock_cursor.execute.call_args_list[1][0][1]
+        assert params[6:8] == (True, "NONE")
+        mock_apply.assert_called_once_with("store_form", {"sparse": True, "compression": "NONE"})
+
+
+    @patch('models.form_schema.update_form_table_schema')
+    def test_update_form_migrates_table_when_schema_changes(self, mock_migrate, mock_get_db, app, mock_db_connection):
+        """識別符不變但結構變更時，以更新前的結構比對並遷移資料表"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        previous_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}, {"ElmentType": "Item", "ItemId": "2"}]}
+        mock_cursor.fetchone.side_effect = [current_form_row('grow_form', 'Grow', schema_hash='H-PREV'), (2,)]
+        mock_cursor.fetchall.return_value = [('H-PREV', json.dumps(previous_json))]
+
+        with app.app_context():
+            result = update_form(5, {"formIdentifier": "grow_form", "formDisplayName": "Grow", "formJson": form_json})
+
+        assert result["ddlJob"]["kind"] == "update_schema"
+        mock_migrate.assert_called_once_with("grow_form", form_json, storage_options=None, previous_form_json=previous_json)
+
+    @patch('models.form_schema.get_configured_db_name', return_value='TestDB')
+    @patch('models.form_schema.get_db')
+    def test_update_form_keeps_columns_of_removed_items(self, mock_schema_db, mock_db_name, mock_get_db, app,
+                                                       mock_db_connection):
+        """PUT 移除項目時保留其欄位與資料，只有 /schema/migrate 帶 dropRemoved 才刪除"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_schema_db.return_value = mock_conn
+        previous_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}, {"ElmentType": "Item", "ItemId": "2"}]}
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+        mock_cursor.fetchone.side_effect = [current_form_row('shrink_form', 'Shrink', schema_hash='H-PREV'), (2,)]
+        mock_cursor.fetchall.return_value = [('H-PREV', json.dumps(previous_json))]
+        seed_catalog([
+            ('user_shrink_form', 'Item1', 'nvarchar', -1, 0, 0, False, None, 'NONE'),
+            ('user_shrink_form', 'Item1_Remark', 'nvarchar', 2000, 0, 0, False, None, 'NONE'),
+            ('user_shrink_form', 'Item2', 'nvarchar', -1, 0, 0, False, None, 'NONE'),
+            ('user_shrink_form', 'Item2_Remark', 'nvarchar', 2000, 0, 0, False, None, 'NONE'),
+        ], [])
+
+        with app.app_context():
+            result = update_form(5, {"formIdentifier": "shrink_form", "formDisplayName": "Shrink", "formJson": form_json})
+
+        job = result["ddlJob"]
+        assert job["status"] == "succeeded"
+        assert job["result"]["removed_items"] == []
+        assert job["result"]["retained_items"] == [2]
+        assert not any("DROP" in str(c[0][0]) for c in mock_cursor.execute.call_args_list)
+
+
+@patch('models.table_manager.get_db')
+class TestAddFormAtomicBatch:
+    """測試新增表單時 TableManager 紀錄與資料表在同一交易批次中建立"""
+
+    def test_insert_and_create_table_in_one_batch(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [(None,), (30,)]  # OBJECT_ID 確認資料表不存在、新表單 ID
+        seed_catalog([], [])
+
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+        with app.app_context():
+            result = add_form({"formIdentifier": "atomic_form", "formDisplayName": "A", "formJson": form_json})
+            assert table_exists(mock_cursor, "user_atomic_form")
+
+        assert result["id"] == 30
+        assert result["table_name"] == "user_atomic_form"
+        assert result["ddlJob"]["status"] == "succeeded"
+        # catalog 中沒有的資料表以 OBJECT_ID 確認，之後只執行一個批次
+        assert mock_cursor.execute.call_count == 2
+        assert "OBJECT_ID" in mock_cursor.execute.call_args_list[0][0][0]
+        batch = mock_cursor.execute.call_args[0][0]
+        assert "SET XACT_ABORT ON" in batch
+        assert "OUTPUT inserted.TableManagerId INTO @inserted" in batch
+        assert batch.index("INSERT INTO TableManager") < batch.index("CREATE TABLE [dbo].[user_atomic_form]")
+        assert "CREATE NONCLUSTERED INDEX [IX_user_atomic_form_CheckDate]" in batch
+        mock_conn.commit.assert_called_once()
+
+    def test_failed_batch_rolls_back_without_commit(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        def execute(sql, *params):
+            if "CREATE TABLE" in sql:
+                raise Exception("CREATE TABLE failed")
+        mock_cursor.execute.side_effect = execute
+        seed_catalog([], [])
+
+        with app.app_context():
+            with pytest.raises(Exception) as excinfo:
+                add_form({"formIdentifier": "broken_form", "formDisplayName": "B", "formJson": {"Elements": []}})
+            assert not table_exists(mock_cursor, "user_broken_form")
+
+        assert "CREATE TABLE failed" in str(excinfo.value)
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+    def test_invalid_form_json_is_rejected_before_insert(self, mock_get_db, app):
+        with app.app_context():
+            with pytest.raises(HTTPException) as excinfo:
+                add_form({"formIdentifier": "x", "formDisplayName": "X", "formJson": "not json"})
+        assert excinfo.value.code == 400
+        assert "Invalid JSON" in excinfo.value.description
+        mock_get_db.assert_not_called()
+
+    def test_create_endpoint_returns_400_for_invalid_form_json(self, mock_get_db, form_client):
+        response = form_client.post('/api/forms', json={"formIdentifier": "x", "formDisplayName": "X",
+                                                        "formJson": "not json"})
+        assert response.status_code == 400
+        assert response.get_json()["message"] == "創建表單失敗: Invalid JSON in formJson for table creation."
+
+        response = form_client.post('/api/forms', json={"formIdentifier": "x", "formDisplayName": "X", "formJson": [1]})
+        assert response.status_code == 400
+        mock_get_db.assert_not_called()
+
+
+class TestSchemaVersion:
+    """測試 SchemaHash / SchemaVersion：略過未變更的儲存與 ETag"""
+
+    @patch('models.table_manager.get_db')
+    def test_identical_save_is_skipped(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        form_json = {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}
+        mock_cursor.fetchone.return_value = current_form_row('f  ', schema_hash=schema_content_hash(json.dumps(form_json)), version=4)
+
+        with app.app_context():
+            result = update_form(7, {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': form_json,
+                                     'storageOptions': {"compression": "none"}})
+
+        assert result["unchanged"] is True
+        assert result["version"] == 4
+        assert "ddlJob" not in result
+        mock_cursor.execute.assert_called_once()
+        assert "SchemaContent" not in mock_cursor.execute.call_args[0][0]
+        mock_conn.commit.assert_not_called()
+
+    @patch('models.table_manager.get_db')
+    def test_changed_save_bumps_version(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        form_json = {"Elements": []}
+        mock_cursor.fetchone.side_effect = [current_form_row(display_name='Old', schema_hash=schema_content_hash(json.dumps(form_json)), version=4), (5,)]
+
+        with app.app_context():
+            result = update_form(7, {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': form_json})
+
+        assert result["version"] == 5
+        update_sql, params = mock_cursor.execute.call_args_list[1][0]
+        assert "SchemaVersion = SchemaVersion + 1" in update_sql
+        assert params[8] == schema_content_hash(json.dumps(form_json))
+        assert params[-1] == 4
+        mock_conn.commit.assert_called_once()
+
+    @patch('models.table_manager.get_db')
+    def test_concurrent_modification_is_rejected(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [current_form_row(version=4), None]
+
+        with app.app_context():
+            with pytest.raises(HTTPException) as excinfo:
+                update_form(7, {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': {"Elements": [1]}})
+
+        assert excinfo.value.code == 409
+        assert "modified concurrently" in excinfo.value.description
+        mock_conn.commit.assert_not_called()
+
+    @patch('models.table_manager.get_db')
+    def test_update_endpoint_returns_409_and_404(self, mock_get_db, form_client, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [current_form_row(version=4), None]
+
+        payload = {'formIdentifier': 'f', 'formDisplayName': 'F', 'formJson': {"Elements": [1]}}
+        response = form_client.put('/api/forms/7', json=payload)
+        assert response.status_code == 409
+        assert "modified concurrently" in response.get_json()["message"]
+
+        mock_cursor.fetchone.side_effect = [None, (0,)]
+        assert form_client.put('/api/forms/7', json=payload).status_code == 404
+
+    @patch('models.table_manager.get_db')
+    def test_get_form_raw_skips_content_for_known_version(self, mock_get_db, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = (3, 'user_x', '表單X', 1, None, 'H3', 5)
+
+        with app.app_context():
+            form_info, schema_text = get_form_raw_by_id(3, known_version=5)
+
+        assert form_info["version"] == 5
+        assert schema_text is None
+        assert mock_cursor.execute.call_args[0][1] == (5, 3)
+
+    @patch('routes.form_routes.get_form_raw_by_id')
+    def test_get_form_endpoint_returns_etag_and_304(self, mock_get_raw, form_client):
+        form_info = {"id": 1, "dbName": "user_z", "eFormName": "表單Z", "mode": 1, "version": 3}
+        mock_get_raw.return_value = (form_info, '{"Elements": []}')
+
+        response = form_client.get('/api/forms/1')
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"3"'
+        mock_get_raw.assert_called_with(1, None)
+
+        mock_get_raw.return_value = (form_info, None)
+        response = form_client.get('/api/forms/1', headers={"If-None-Match": '"3"'})
+        assert response.status_code == 304
+        assert response.data == b""
+        mock_get_raw.assert_called_with(1, 3)
+
+
+@patch('models.table_manager.get_form_schema')
+class TestPatchForm:
+    """測試 PATCH /api/forms/<id> 的 JSON Patch 部分更新"""
+
+    FORM_JSON = {"Elements": [
+        {"ElmentType": "Item", "ItemId": "1", "ItemName": "溫度"},
+        {"ElmentType": "Item", "ItemId": "2", "ItemName": "壓力"}
+    ]}
+
+    def stored_form(self, version=3):
+        raw = json.dumps(self.FORM_JSON)
+        return {"id": 5, "formIdentifier": "f", "schemaHash": schema_content_hash(raw), "version": version,
+                "formJson": self.FORM_JSON}
+
+    @patch('models.table_manager.get_db')
+    @patch('models.form_schema.update_form_table_schema')
+    def test_patch_persists_and_migrates_touched_items_only(self, mock_update_table, mock_get_db, mock_get_schema,
+                                                            app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = self.stored_form()
+        mock_cursor.fetchone.return_value = (4,)
+        mock_update_table.return_value = {"message": "ok"}
+
+        with app.app_context():
+            result = patch_form(5, [{"op": "add", "path": "/Elements/1/ItemType", "value": "number"}], expected_version=3)
+
+        assert result["version"] == 4
+        assert result["touchedItems"] == [2]
+        assert result["ddlJob"]["kind"] == "patch_schema"
+        update_sql, params = mock_cursor.execute.call_args[0]
+        assert "SchemaVersion = SchemaVersion + 1" in update_sql
+        assert json.loads(params[2])["Elements"][1]["ItemType"] == "number"
+        assert params[-1] == 3
+        mock_conn.commit.assert_called_once()
+        args, kwargs = mock_update_table.call_args
+        assert args[0] == "f"
+        assert kwargs["only_items"] == {2}
+        assert kwargs["previous_form_json"] == self.FORM_JSON
+        # 快取中的結構不會被修改
+        assert "ItemType" not in self.FORM_JSON["Elements"][1]
+
+    def test_version_mismatch_is_rejected(self, mock_get_schema, app):
+        mock_get_schema.return_value = self.stored_form(version=3)
+
+        with app.app_context():
+            with pytest.raises(Exception) as excinfo:
+                patch_form(5, [{"op": "remove", "path": "/Elements/0"}], expected_version=2)
+
+        assert excinfo.value.code == 412
+
+    @patch('models.table_manager.get_db')
+    def test_concurrent_update_is_rejected(self, mock_get_db, mock_get_schema, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = self.stored_form()
+        mock_cursor.fetchone.return_value = None
+
+        with app.app_context():
+            with pytest.raises(Exception) as excinfo:
+                patch_form(5, [{"op": "remove", "path": "/Elements/0"}])
+
+        assert excinfo.value.code == 412
+        mock_conn.commit.assert_not_called()
+
+    @patch('models.table_manager.get_db')
+    def test_no_op_patch_is_not_written(self, mock_get_db, mock_get_schema, app):
+        mock_get_schema.return_value = self.stored_form()
+
+        with app.app_context():
+            result = patch_form(5, [{"op": "test", "path": "/Elements/0/ItemId", "value": "1"}])
+
+        assert result["unchanged"] is True
+        mock_get_db.assert_not_called()
+
+    def test_endpoint_maps_errors_to_status_codes(self, mock_get_schema, form_client):
+        mock_get_schema.return_value = self.stored_form(version=3)
+
+        response = form_client.patch('/api/forms/5', json=[{"op": "replace", "path": "/missing", "value": 1}])
+        assert response.status_code == 400
+
+        response = form_client.patch('/api/forms/5', json=[], headers={"If-Match": '"2"'})
+        assert response.status_code == 412
+
+        response = form_client.patch('/api/forms/5', json={"op": "add"})
+        assert response.status_code == 400
+
+
+@patch('models.table_manager.get_form_schema')
+@patch('models.table_manager.get_db')
+class TestCloneForm:
+    """測試 POST /api/forms/<id>/clone 的伺服器端複製"""
+
+    SOURCE = {"id": 7, "formIdentifier": "src_form", "schemaHash": "HASH-CLONE", "version": 4,
+              "formJson": {"Elements": [{"ElmentType": "Item", "ItemId": "1"}]}}
+
+    def test_clone_copies_definition_and_creates_table_in_one_batch(self, mock_get_db, mock_get_schema, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = self.SOURCE
+        # OBJECT_ID (複製前的檢查)、來源的儲存選項、OBJECT_ID (建立資料表的語句)、新表單
+        mock_cursor.fetchone.side_effect = [(None,), (False, 'PAGE'), (None,), (40, 'F')]
+        seed_catalog([('user_src_form', 'user_src_formId', 'int', 4, 0, 0, False, None, 'NONE')], [])
+
+        with app.app_context():
+            result = clone_form(7, {"formIdentifier": "copy_form"})
+            assert table_exists(mock_cursor, "user_copy_form")
+
+        assert result["id"] == 40
+        assert result["table_name"] == "user_copy_form"
+        assert result["ddlJob"]["kind"] == "clone_table"
+        assert "copyJob" not in result
+        batch, params = mock_cursor.execute.call_args[0]
+        # 結構內容不經過用戶端，直接沿用來源紀錄的 SchemaHash
+        assert "SELECT ?, COALESCE(?, DisplayName), SchemaHash, ItemsCnt, SparseItems, DataCompression" in batch
+        assert "DROP TABLE" not in batch
+        assert "CREATE TABLE [dbo].[user_copy_form]" in batch
+        assert "DATA_COMPRESSION = PAGE" in batch
+        assert params == ("copy_form", None, 7)
+        mock_conn.commit.assert_called_once()
+
+    @patch('models.form_records.copy_form_records')
+    def test_copy_records_is_queued_after_create(self, mock_copy, mock_get_db, mock_get_schema, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = self.SOURCE
+        mock_cursor.fetchone.side_effect = [(None,), (False, 'NONE'), (None,), (41, '副本')]
+        mock_copy.return_value = {"copied": 10, "batches": 1}
+        seed_catalog([], [])
+
+        with app.app_context():
+            result = clone_form(7, {"formIdentifier": "copy_form", "formDisplayName": "副本", "copyRecords": True})
+
+        mock_copy.assert_called_once_with("user_src_form", "user_copy_form", "copy_form")
+        assert result["copyJob"]["kind"] == "copy_records"
+        assert result["copyJob"]["formId"] == 41
+        assert result["copyJob"]["result"] == {"copied": 10, "batches": 1}
+
+    def test_existing_target_table_is_rejected(self, mock_get_db, mock_get_schema, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_get_schema.return_value = self.SOURCE
+        seed_catalog([('user_taken', 'user_takenId', 'int', 4, 0, 0, False, None, 'NONE')], [])
+
+        with app.app_context():
+            with pytest.raises(Exception) as excinfo:
+                clone_form(7, {"formIdentifier": "taken"})
+
+        assert excinfo.value.code == 409
+        mock_cursor.execute.assert_not_called()
+
+    def test_endpoint_status_codes(self, mock_get_db, mock_get_schema, form_client):
+        mock_get_schema.return_value = None
+
+        assert form_client.post('/api/forms/7/clone', json={}).status_code == 400
+        assert form_client.post('/api/forms/7/clone', json={"formIdentifier": "copy_form"}).status_code == 404
+
+
+@patch('models.table_manager.get_form_schema')
+class TestFormItems:
+    """測試 GET /api/forms/<id>/items 的扁平項目列表"""
+
+    FORM_JSON = {"Elements": [
+        {"ElmentType": "Group", "Elements": [
+            {"ElmentType": "Item", "ItemId": "2", "ItemName": "壓力", "ItemType": "number"}
+        ]},
+        {"ElmentType": "Item", "ItemId": "1", "ItemName": "溫度"}
+    ]}
+
+    def stored_form(self, version=6):
+        return {"id": 8, "formIdentifier": "f", "schemaHash": "HASH-ITEMS", "version": version, "formJson": self.FORM_JSON}
+
+    def test_items_are_flat_and_in_document_order(self, mock_get_schema, app):
+        mock_get_schema.return_value = self.stored_form()
+
+        with app.app_context():
+            result = get_form_items(8)
+
+        assert result["version"] == 6
+        assert result["items"] == [
+            {"id": 2, "label": "壓力", "type": "number", "path": "/Elements/0/Elements/0"},
+            {"id": 1, "label": "溫度", "type": None, "path": "/Elements/1"}
+        ]
+
+    def test_endpoint_uses_version_etag(self, mock_get_schema, form_client):
+        mock_get_schema.return_value = self.stored_form()
+
+        response = form_client.get('/api/forms/8/items')
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"6"'
+        assert [item["id"] for item in response.get_json()["items"]] == [2, 1]
+
+        response = form_client.get('/api/forms/8/items', headers={"If-None-Match": '"6"'})
+        assert response.status_code == 304
+        assert response.data == b""
+
+    def test_missing_form_returns_404(self, mock_get_schema, form_client):
+        mock_get_schema.return_value = None
+
+        assert form_client.get('/api/forms/9/items').status_code == 404
+
+    def test_item_indexes_read_missing_schemas_in_one_query(self, mock_get_schema, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        store_cached_schema("HASH-CACHED", self.FORM_JSON)
+        mock_cursor.fetchall.return_value = [("HASH-MISSING", json.dumps({"Elements": [{"ElmentType": "Item", "ItemId": "5"}]}))]
+
+        with app.app_context():
+            indexes = get_form_item_indexes(mock_cursor, [(1, "HASH-CACHED"), (2, "HASH-MISSING"), (3, None)])
+
+        mock_cursor.execute.assert_called_once()
+        assert [item["id"] for item in indexes[1]] == [2, 1]
+        assert indexes[2][0]["path"] == "/Elements/0"
+        assert indexes[3] == []
+
+
+@patch('models.table_manager.invalidate_route_cache')
+@patch('models.table_manager.get_db')
+class TestRouteBindingRefresh:
+    """測試表單改名與刪除時同步路線的 BindingTableName"""
+
+    def test_rename_refreshes_routes_in_same_transaction(self, mock_get_db, mock_invalidate_routes, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [current_form_row(table_name='old_form  '), (2,)]
+        mock_cursor.rowcount = 3
+
+        with patch('models.form_schema.rename_and_update_form_table'):
+            with app.app_context():
+                update_form(4, {"formIdentifier": "new_form", "formDisplayName": "F", "formJson": {}})
+
+        refresh_sql, form_id = mock_cursor.execute.call_args_list[2][0]
+        assert "SET r.[BindingTableName] = RTRIM(t.TableName)" in refresh_sql
+        assert form_id == 4
+        mock_conn.commit.assert_called_once()
+        mock_invalidate_routes.assert_called_once()
+
+    def test_update_without_rename_does_not_touch_routes(self, mock_get_db, mock_invalidate_routes, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.side_effect = [current_form_row(display_name='Old'), (2,)]
+
+        with app.app_context():
+            update_form(4, {"formIdentifier": "f", "formDisplayName": "New", "formJson": {}})
+
+        assert all("BindingTableName" not in c[0][0] for c in mock_cursor.execute.call_args_list)
+        mock_invalidate_routes.assert_not_called()
+
+    def test_delete_refreshes_routes_to_archived_name(self, mock_get_db, mock_invalidate_routes, app, mock_db_connection):
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchone.return_value = ('gone ',)
+        mock_cursor.fetchall.return_value = []
+        seed_catalog([], [])
+
+        with patch('models.table_manager.archive_form_table'):
+            with app.app_context():
+                delete_form(3)
+
+        refresh_sql, form_id = mock_cursor.execute.call_args[0]
+        assert "SET r.[BindingTableName] = RTRIM(t.TableName)" in refresh_sql
+        assert form_id == 3
+        mock_conn.commit.assert_called_once()
+        mock_invalidate_routes.assert_called_once()
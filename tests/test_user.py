@@ -15,10 +15,12 @@ from unittest.mock import Mock, MagicMock, patch, call
 from models.user import (
     add_signing_data, get_signing_data_by_user_id, delete_signing_data_by_user_id,
     validate_user_data_consistency, fix_user_data_consistency,
-    add_user, get_user_with_signing_data, get_all_users_with_signing_data,
+    add_user, get_user_with_signing_data, get_all_users_with_signing_data, get_users_with_signing_data,
     update_user, get_user_by_id, get_user_by_user_id, get_all_users,
-    delete_user, verify_password, check_priority_level, set_user_work_status
+    delete_user, verify_password, check_priority_level, set_user_work_status,
+    search_user_ids
 )
+from models.search_index import invalidate_search_index
 
 
 class TestSigningDataOperations:
@@ -471,6 +473,61 @@ class TestUserCRUDOperations:
         assert result[0]['supervisorName'] == '主管A'
         assert result[1]['supervisorName'] == '主管B'
 
+    @patch('models.user.execute_query')
+    def test_get_users_with_signing_data_uses_two_queries(self, mock_execute_query):
+        """測試以固定兩次查詢獲取多個用戶及其核簽資料"""
+        mock_execute_query.side_effect = [
+            [{'ID': 1, 'UserID': 'a001'}, {'ID': 3, 'UserID': 'a003'}],
+            [{'巡檢人ID': 'a003', '主管姓名': '主管C'}]
+        ]
+        
+        result = get_users_with_signing_data({3, 2, 1})
+        
+        assert mock_execute_query.call_count == 2
+        for query_call in mock_execute_query.call_args_list:
+            assert 'OPENJSON(?)' in query_call[0][0]
+            assert query_call[0][1] == ('[1, 2, 3]',)
+        assert [user['ID'] for user in result] == [1, 3]
+        assert 'supervisorName' not in result[0]
+        assert result[1]['supervisorName'] == '主管C'
+    
+    @patch('models.user.execute_query')
+    def test_get_users_with_signing_data_empty_ids(self, mock_execute_query):
+        """測試沒有 ID 時不查詢"""
+        assert get_users_with_signing_data(set()) == []
+        mock_execute_query.assert_not_called()
+
+
+class TestUserSearchIndex:
+    """測試以搜尋索引查詢 UserID"""
+
+    @pytest.fixture(autouse=True)
+    def enable_index(self, app):
+        max_docs = app.config.get('SEARCH_INDEX_MAX_DOCS')
+        app.config['SEARCH_INDEX_MAX_DOCS'] = 10
+        invalidate_search_index("users")
+        yield
+        app.config['SEARCH_INDEX_MAX_DOCS'] = max_docs
+        invalidate_search_index("users")
+
+    @patch('models.user.execute_query')
+    @patch('models.user.get_user_by_id')
+    @patch('models.user.get_db')
+    def test_search_user_ids_follows_deletes(self, mock_get_db, mock_get_user, mock_execute, app, mock_db_connection):
+        """索引載入後，刪除用戶時同步移除"""
+        mock_conn, mock_cursor = mock_db_connection
+        mock_get_db.return_value = mock_conn
+        mock_cursor.fetchall.return_value = [(1, 'A0001'), (2, 'a0002'), (3, 'B0001')]
+        mock_get_user.return_value = {'ID': 2, 'UserID': 'a0002'}
+
+        with app.app_context():
+            assert search_user_ids('a000') == {1, 2}
+            delete_user(2)
+            assert search_user_ids('A000') == {1}
+
+        # 索引只載入一次
+        mock_cursor.execute.assert_called_once()
+
 
 class TestPasswordAndAuthentication:
     """測試密碼和認證功能"""